@@ -0,0 +1,459 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+# Stdlib import
+import datetime
+import gzip
+import json
+import os
+import random
+import re
+import time
+
+# 3rd Party imports
+import click
+
+# Project imports
+import compact
+from build import Build, BUILD_URL
+from build_summary_gh import JOB_RE, RETENTION_DAYS, scan_build, serialise
+from buildxml import read_build_xml
+from discovery import find_builds
+from failure import Failure, JunitFailure
+from store import JSONStore
+
+# # Build Summary Benchmarks
+# Generates a synthetic jenkins jobs dir, then times each stage of the
+# summary separately: discovery, build.xml parsing, log reading, scanning
+# for each failure type, and serialisation. Timings can be saved as a
+# baseline, and later runs compared against it:
+#
+#   python3 benchmark.py generate /tmp/jobs --max-lines 1000000
+#   python3 benchmark.py run /tmp/jobs --save-baseline baseline.json
+#   ... change failure.py ...
+#   python3 benchmark.py run /tmp/jobs --baseline baseline.json
+#
+# Baselines are only comparable when taken on the same machine with the
+# same tree, the tree's parameters are recorded with the baseline.
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'samples')
+
+# Written to the root of a generated tree, it doesn't match JOB_RE so
+# isn't visited by discovery.
+TREE_INFO = 'benchmark.json'
+
+JOBS = [
+    'PM_rpc-openstack-master-xenial-deploy',
+    'PM_rpc-openstack-newton-trusty-upgrade',
+    'PR_rpc-openstack-master-xenial-deploy',
+    'PR_rpc-gating-master-bionic-lint',
+    'RELEASE_rpc-openstack-master-xenial',
+    'RE_rpc-openstack-pike-xenial-release',
+]
+# Jobs that are in the jobs dir but aren't summarised
+OTHER_JOBS = ['OTHER_tox-lint', 'Infra-nodepool-image']
+
+RESULTS = ['SUCCESS'] * 6 + ['FAILURE'] * 3 + ['ABORTED', 'UNSTABLE']
+
+# Log lines matched by each of the failure types in failure.py
+FAILURE_LINES = [
+    "fatal: Failed to fetch from https://github.com/rcbops/rpc-gating.git",
+    "Caused by: hudson.plugins.git.GitException: Command git fetch failed",
+    "W: Failed to fetch http://mirror.rackspace.com/ubuntu/dists/xenial"
+    " Hash Sum mismatch",
+    "E: Unable to locate package python-foo",
+    "WARNING: The following packages cannot be authenticated!",
+    "ERROR: Service Unavailable (HTTP 503)",
+    "{0} tempest.api.compute.servers.test_servers.ServersTestJSON"
+    ".test_create_server [12.3s] ... FAILED",
+    "Agent went offline during the build",
+    "E: Could not get lock /var/lib/dpkg/lock - open (11: Resource"
+    " temporarily unavailable)",
+    "Could not find a version that satisfies the requirement foo==1.0"
+    " (from versions: 0.9)",
+    "java.io.IOException: hudson.remoting.ChannelClosedException: Remote"
+    " call on aio1 failed",
+    "ERROR: foo is not a legal parameter in an Ansible task or handler",
+    "fatal: [aio1_nova_api_container-1a2b3c4d]: FAILED! => {\"changed\":"
+    " false, \"msg\": \"No package matching 'nova' is available\"}",
+    "Build timed out (after 180 minutes). Marking the build as aborted.",
+    "Failed to connect to the host via ssh: Connection timed out",
+    "Timeout when waiting for 172.29.236.100:22",
+    "Warning: failed to create container",
+]
+
+# Post build marker, lines after it aren't scanned
+POST_BUILD_MARKER = "[PostBuildScript] - Execution post build scripts."
+
+CHAIN_RE = re.compile(r'<hudson\.model\.Cause_-UpstreamCause>.*'
+                      r'</hudson\.model\.Cause_-UpstreamCause>', re.DOTALL)
+ROOT_CAUSES = [
+    '<com.cloudbees.jenkins.GitHubPushCause plugin="github@1.28.1">'
+    '<pushedBy>{user}</pushedBy></com.cloudbees.jenkins.GitHubPushCause>',
+    '<hudson.model.Cause_-UserIdCause><userId>{user}</userId>'
+    '</hudson.model.Cause_-UserIdCause>',
+    '<hudson.triggers.TimerTrigger_-TimerTriggerCause/>',
+]
+UPSTREAM_CAUSE = """<hudson.model.Cause_-UpstreamCause>
+            <upstreamProject>{job}</upstreamProject>
+            <upstreamUrl>job/{job}/</upstreamUrl>
+            <upstreamBuild>{build_num}</upstreamBuild>
+            <upstreamCauses>{upstream}</upstreamCauses>
+          </hudson.model.Cause_-UpstreamCause>"""
+
+
+def read_sample(name):
+    with open(os.path.join(SAMPLES, name)) as f:
+        return f.read()
+
+
+def set_field(xml, tag, value):
+    """Replace the text of the first element with a tag."""
+    return re.sub(r'<{tag}>[^<]*</{tag}>'.format(tag=re.escape(tag)),
+                  '<{tag}>{value}</{tag}>'.format(tag=tag, value=value),
+                  xml, count=1)
+
+
+def cause_chain(rng, depth):
+    """Get the xml of a chain of upstream causes, depth long."""
+    chain = rng.choice(ROOT_CAUSES).format(
+        user=rng.choice(['alice', 'bob', 'carol']))
+    for level in range(depth):
+        chain = UPSTREAM_CAUSE.format(
+            job='PM-trigger-{}_rpc-openstack-master'.format(level),
+            build_num=rng.randint(1, 5000),
+            upstream=chain)
+    return chain
+
+
+def build_xml(rng, job_name, templates, start_time):
+    """Generate a build.xml for a job, from the samples."""
+    if job_name.startswith('PR_'):
+        xml = templates['pr']
+        pull_id = rng.randint(1, 5000)
+        xml = set_field(xml, 'pullID', pull_id)
+        xml = set_field(xml, 'url', 'https://github.com/rcbops/'
+                        'rpc-openstack/pull/{}'.format(pull_id))
+    else:
+        xml = templates['pm']
+        xml = CHAIN_RE.sub(
+            lambda m: cause_chain(rng, rng.randint(0, 4)), xml, count=1)
+    duration = rng.randint(60, 6 * 3600) * 1000
+    # jenkins creates the build a few miliseconds before it starts, as in
+    # the samples
+    xml = set_field(xml, 'timestamp',
+                    int(start_time * 1000) - rng.randint(5, 60))
+    xml = set_field(xml, 'startTime', int(start_time * 1000))
+    xml = set_field(xml, 'duration', duration)
+    return xml.replace('<result>SUCCESS</result>',
+                       '<result>{}</result>'.format(rng.choice(RESULTS)))
+
+
+def log_lines(rng, count, failure_rate):
+    """Yield the lines of an ansible like log.
+
+    failure_rate is the probability of each line being one that matches a
+    failure type.
+    """
+    play = 0
+    task = 0
+    filler = ['ok: [aio1]', 'changed: [aio1]', 'skipping: [aio1]',
+              'ok: [aio1_nova_api_container-1a2b3c4d] => (item=nova)',
+              '+ echo "Running deploy step"']
+    for num in range(count):
+        r = rng.random()
+        if r < 0.01:
+            play += 1
+            yield "PLAY [Play number {}] {}\n".format(play, '*' * 40)
+        elif r < 0.08:
+            task += 1
+            yield "TASK [role{} : task {}] {}\n".format(
+                task % 7, task, '*' * 40)
+        elif r < 0.08 + failure_rate:
+            yield rng.choice(FAILURE_LINES) + "\n"
+        elif r < 0.08 + 2 * failure_rate:
+            yield "...ignoring\n"
+        else:
+            yield "{} {}\n".format(rng.choice(filler),
+                                   'x' * rng.randint(0, 120))
+
+
+def write_log(path, lines, compress):
+    if compress:
+        f = gzip.open(path + '.gz', 'wt')
+    else:
+        f = open(path, 'w')
+    with f:
+        f.writelines(lines)
+
+
+def junit_xml(rng, cases, failure_rate):
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<result><suites><suite><cases>\n']
+    for num in range(cases):
+        failed = rng.random() < failure_rate
+        parts.append(
+            '<case><className>tempest.api.compute.test_{cls}.Test{cls}'
+            '</className><testName>test_{name}</testName>'
+            '<skipped>{skipped}</skipped><failedSince>{since}</failedSince>'
+            '</case>\n'.format(
+                cls=num % 20,
+                name=rng.choice(['bootstrap', 'key', 'boot', 'resize']),
+                skipped='true' if rng.random() < 0.05 else 'false',
+                since=rng.randint(1, 100) if failed else 0))
+    parts.append('</cases></suite></suites></result>\n')
+    return ''.join(parts)
+
+
+def generate_tree(root, builds_per_job, min_lines, max_lines, gzip_fraction,
+                  failure_rate, junit_fraction, seed):
+    """Generate a synthetic jobs dir, returns the info of the tree."""
+    rng = random.Random(seed)
+    templates = dict(pm=read_sample('pm.xml'), pr=read_sample('pr.xml'))
+    now = time.time()
+    totals = dict(builds=0, lines=0)
+    for job_name in JOBS + OTHER_JOBS:
+        for build_num in range(1, builds_per_job + 1):
+            build_folder = os.path.join(root, job_name, 'builds',
+                                        str(build_num))
+            artifacts = os.path.join(build_folder, 'archive', 'artifacts')
+            if not os.path.isdir(artifacts):
+                os.makedirs(artifacts)
+            # builds are well within the retention period
+            start_time = now - rng.randint(3600, 30 * 24 * 3600)
+            with open(os.path.join(build_folder, 'build.xml'), 'w') as f:
+                f.write(build_xml(rng, job_name, templates, start_time))
+            count = rng.randint(min_lines, max_lines)
+            lines = log_lines(rng, count, failure_rate)
+            if rng.random() < 0.5:
+                # post build scripts, which aren't scanned
+                lines = list(lines)
+                lines.insert(rng.randint(0, len(lines)),
+                             POST_BUILD_MARKER + "\n")
+            write_log(os.path.join(build_folder, 'log'), lines,
+                      rng.random() < gzip_fraction)
+            deploy_count = rng.randint(0, max(min_lines, max_lines // 10))
+            write_log(os.path.join(artifacts, 'deploy.sh.log'),
+                      log_lines(rng, deploy_count, failure_rate), False)
+            if rng.random() < junit_fraction:
+                with open(os.path.join(build_folder, 'junitResult.xml'),
+                          'w') as f:
+                    f.write(junit_xml(rng, rng.randint(10, 500), 0.05))
+            totals['builds'] += 1
+            totals['lines'] += count + deploy_count
+    info = dict(
+        seed=seed,
+        builds_per_job=builds_per_job,
+        min_lines=min_lines,
+        max_lines=max_lines,
+        gzip_fraction=gzip_fraction,
+        failure_rate=failure_rate,
+        junit_fraction=junit_fraction,
+        **totals)
+    with open(os.path.join(root, TREE_INFO), 'w') as f:
+        json.dump(info, f, indent=2, sort_keys=True)
+    return info
+
+
+class Timer(object):
+    """Collect the time of each stage of a benchmark run."""
+
+    def __init__(self):
+        self.timings = {}
+
+    def time(self, name, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.timings[name] = time.perf_counter() - start
+        return result
+
+
+def discover(root):
+    return list(find_builds(root, JOB_RE))
+
+
+def parse_xml(builds):
+    for path_groups in builds:
+        read_build_xml(os.path.join(path_groups['build_folder'],
+                                    'build.xml'))
+
+
+def load_builds(builds):
+    return [Build(build_folder=path_groups['build_folder'],
+                  job_name=path_groups['job_name'],
+                  build_num=path_groups['build_num'])
+            for path_groups in builds]
+
+
+def read_lines(builds):
+    for build in builds:
+        build.read_logs().drain()
+
+
+def read_blocks(builds):
+    for build in builds:
+        for log_file in build.read_logs().log_blocks():
+            for data in log_file.forward():
+                pass
+
+
+def scan(builds, classes):
+    """Scan the logs of builds for some failure types."""
+    for build in builds:
+        build.log_lines = build.read_logs()
+        Failure.scan_logs(build, classes)
+        discard_failures(build)
+
+
+def scan_junit(builds):
+    for build in builds:
+        junit = build.read_junit()
+        if junit is not None:
+            Failure.scan_junit(build, junit)
+        discard_failures(build)
+
+
+def discard_failures(build):
+    for id in build.failures:
+        Failure.failures.pop(id, None)
+    build.failures = []
+    build.log_lines = None
+
+
+def summarise(root, builds):
+    """Scan builds as the summary does, returns the exported data."""
+    age_limit = (datetime.datetime.now()
+                 - datetime.timedelta(days=RETENTION_DAYS))
+    # the store is never written, so its file doesn't exist
+    store = JSONStore(os.path.join(root, 'benchmark-data.json'))
+    for path_groups in builds:
+        result = scan_build(path_groups, age_limit)
+        if 'build' in result:
+            store.add(result['build'], result['failures'])
+    data = store.export()
+    return dict(data, timestamp=datetime.datetime.now(),
+                retention_days=RETENTION_DAYS)
+
+
+def run_once(root):
+    """Time each stage of the summary once, returns a dict of timings."""
+    timer = Timer()
+    path_groups = timer.time('discovery', discover, root)
+    timer.time('xml', parse_xml, path_groups)
+    builds = timer.time('build', load_builds, path_groups)
+    try:
+        timer.time('read_lines', read_lines, builds)
+        timer.time('read_blocks', read_blocks, builds)
+        timer.time('scan_all', scan, builds, None)
+        for subtype in Failure.__subclasses__():
+            if subtype is JunitFailure:
+                continue
+            timer.time('scan_' + subtype.__name__, scan, builds, [subtype])
+        timer.time('scan_junit', scan_junit, builds)
+    finally:
+        for build in builds:
+            Build.builds.pop(build.id, None)
+    data = timer.time('summarise', summarise, root, path_groups)
+    timer.time('serialise', serialise, data)
+    timer.time('serialise_compact', lambda: serialise(
+        compact.encode(data, build_url=BUILD_URL)))
+    return timer.timings
+
+
+def compare(timings, baseline, threshold):
+    """Print timings against a baseline, returns the stages that regressed.
+
+    A stage has regressed if it took more than threshold times as long as
+    in the baseline.
+    """
+    regressed = []
+    print("{:<32} {:>10} {:>10} {:>7}".format(
+        "stage", "seconds", "baseline", "ratio"))
+    for name in sorted(timings):
+        base = baseline.get(name)
+        if base:
+            ratio = timings[name] / base
+            flag = ''
+            if ratio > threshold:
+                flag = ' REGRESSED'
+                regressed.append(name)
+            print("{:<32} {:>10.4f} {:>10.4f} {:>7.2f}{}".format(
+                name, timings[name], base, ratio, flag))
+        else:
+            print("{:<32} {:>10.4f} {:>10} {:>7}".format(
+                name, timings[name], '-', '-'))
+    return regressed
+
+
+@click.group()
+def benchmark():
+    pass
+
+
+@benchmark.command(help='Generate a synthetic jenkins jobs dir in ROOT')
+@click.argument('root')
+@click.option('--builds-per-job', default=20,
+              help='Number of builds of each job')
+@click.option('--min-lines', default=1000,
+              help='Minimum number of lines in the console log of a build')
+@click.option('--max-lines', default=100000,
+              help='Maximum number of lines in the console log of a build')
+@click.option('--gzip-fraction', default=0.5,
+              help='Fraction of console logs that are gzipped')
+@click.option('--failure-rate', default=0.001,
+              help='Probability of each log line indicating a failure')
+@click.option('--junit-fraction', default=0.3,
+              help='Fraction of builds with junit results')
+@click.option('--seed', default=1, help='Seed for the random generator')
+def generate(root, builds_per_job, min_lines, max_lines, gzip_fraction,
+             failure_rate, junit_fraction, seed):
+    info = generate_tree(root, builds_per_job, min_lines, max_lines,
+                         gzip_fraction, failure_rate, junit_fraction, seed)
+    print("Generated {builds} builds with {lines} log lines in {root}"
+          .format(root=root, **info))
+
+
+@benchmark.command(help='Time each stage of the summary of the jobs dir'
+                        ' ROOT')
+@click.argument('root')
+@click.option('--repeat', default=3,
+              help='Number of runs, the fastest time of each stage is used')
+@click.option('--baseline', default=None,
+              help='Compare timings with those saved in this file')
+@click.option('--save-baseline', default=None,
+              help='Save timings to this file')
+@click.option('--threshold', default=1.2,
+              help='Ratio of a timing to its baseline above which a stage'
+                   ' has regressed. The exit status is 1 if any have')
+def run(root, repeat, baseline, save_baseline, threshold):
+    tree = None
+    if os.path.exists(os.path.join(root, TREE_INFO)):
+        with open(os.path.join(root, TREE_INFO)) as f:
+            tree = json.load(f)
+    timings = {}
+    for count in range(repeat):
+        for name, seconds in run_once(root).items():
+            timings[name] = min(seconds, timings.get(name, seconds))
+
+    base_timings = {}
+    if baseline is not None:
+        with open(baseline) as f:
+            saved = json.load(f)
+        if saved.get('tree') != tree:
+            print("Warning: baseline was taken with a different tree:"
+                  " {}".format(saved.get('tree')))
+        base_timings = saved['timings']
+    regressed = compare(timings, base_timings, threshold)
+
+    if save_baseline is not None:
+        with open(save_baseline, 'w') as f:
+            json.dump(dict(tree=tree, repeat=repeat, timings=timings), f,
+                      indent=2, sort_keys=True)
+        print("Baseline saved to {}".format(save_baseline))
+    if regressed:
+        print("Regressed: {}".format(", ".join(regressed)))
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    benchmark()
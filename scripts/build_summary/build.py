@@ -1,19 +1,33 @@
 # Stdlib import
 import datetime
-import gzip
 import re
 import uuid
 
-# 3rd Party imports
-# Imports with C deps
-# remember to install all the apt xml stuff - not just the pip packages.
-from lxml import etree
+# Project imports
+from buildxml import read_build_xml
+from junit import read_junit_cases
+from logsource import LogSource
+from signature import normalise
+from taskindex import TaskIndex
+
+JENKINS_BASE = "https://rpc.jenkins.cit.rackspace.net"
+# url of a build, the url of the last entry of each build hierachy
+BUILD_URL = JENKINS_BASE + "/job/{job_name}/{build_num}"
 
 
 class FilterException(Exception):
     pass
 
 
+def job_os(job_name):
+    """Get the OS a job runs on, from its name."""
+    for candidate in ['trusty', 'xenial', 'bionic']:
+        if candidate in job_name:
+            return candidate
+    else:
+        return "os_unknown"
+
+
 class Build(object):
     """Build Object.
 
@@ -29,31 +43,25 @@ class Build(object):
         self.build_start = datetime.datetime.now()
         self.stdlib_path_re = re.compile(
             "/usr/lib/python[0-9]*.[0-9]*/[^ /]*\.pyc?")
-        self.parser = etree.XMLParser(recover=True)
-        self.tree = etree.parse('{bf}/build.xml'.format(bf=build_folder),
-                                self.parser)
-        self.result = self.tree.find('./result').text
-        # jenkins uses miliseconds not seconds
+        # Only the fields that are needed are extracted from build.xml,
+        # the document itself is not retained.
+        self.record = read_build_xml(
+            '{bf}/build.xml'.format(bf=build_folder))
+        self.result = self.record.result
         self.timestamp = datetime.datetime.fromtimestamp(
-            float(self.tree.find('startTime').text) / 1000)
-        self.duration = float(self.tree.find('duration').text) / 1000
+            self.record.start_time)
+        self.duration = self.record.duration
         self.build_folder = build_folder
         self.job_name = job_name
         self.build_num = build_num
-        self.raw_branch = self.xpath_pm_pr(
-            pmpath=('//hudson.model.StringParameterValue' +
-                    '[name/text()="BRANCH"]/value'),
-            prpath='//org.jenkinsci.plugins.ghprb.GhprbCause/targetBranch'
-        )
+        self.raw_branch = self.param_pm_pr(pmparam='BRANCH',
+                                           prfield='targetBranch')
         self.branch = self.raw_branch.replace('-', '_').replace('.', '_')
         self.series = re.sub('-.*$', '', self.raw_branch)
         self.get_parent_info()
         self.os = self.get_os()
-        self.repo_url = self.xpath_pm_pr(
-            pmpath='//hudson.model.StringParameterValue' +
-            '[name/text()="REPO_URL"]/value',
-            prpath='//org.jenkinsci.plugins.ghprb.GhprbCause/repoName'
-        )
+        self.repo_url = self.param_pm_pr(pmparam='REPO_URL',
+                                         prfield='repoName')
         if "internal" in self.repo_url:
             raise Exception("can't parse internal: repo urls")
         repo_dict = re.match(
@@ -63,15 +71,10 @@ class Build(object):
         self.org = repo_dict['org']
         self.repo = repo_dict['repo']
         self.failures = []
+        self.task_index = TaskIndex()
         self.stage = self.get_stage()
         if self.result != 'SUCCESS':
             self.failed = True
-        try:
-            self.junit = etree.parse('{bf}/junitResult.xml'.format(
-                bf=build_folder), self.parser)
-        except IOError:
-            # junitResult.xml won't exist in lots of cases
-            self.junit = None
         Build.builds[self.id] = self
 
     def get_serialisation_dict(self):
@@ -97,22 +100,30 @@ class Build(object):
             raise Exception("Job stage unknown: {}".format(self.job_name))
 
     def get_os(self):
-        for candidate in ['trusty', 'xenial', 'bionic']:
-            if candidate in self.job_name:
-                return candidate
-        else:
-            return "os_unknown"
+        return job_os(self.job_name)
 
-    def xpath_pm_pr(self, pmpath, prpath):
-        """Get a value using different xpaths for pm and pr.
+    def param_pm_pr(self, pmparam, prfield):
+        """Get a value from a parameter for pm, or the ghprb cause for pr.
 
         PM = post merge, PR = pull request.
         """
         if self.get_stage() == "PR":
-            return self.tree.xpath(prpath)[0].text
+            return self.record.ghprb[prfield]
         else:
-            # use PM path for PM and others (eg RELEASE)
-            return self.tree.xpath(pmpath)[0].text
+            # use PM parameter for PM and others (eg RELEASE)
+            return self.record.parameters[pmparam]
+
+    def read_junit(self):
+        """Read the failing cases of junitResult.xml.
+
+        Returns a list of junit.JunitCase, or None if it doesn't exist.
+        """
+        try:
+            return read_junit_cases('{bf}/junitResult.xml'.format(
+                bf=self.build_folder))
+        except IOError:
+            # junitResult.xml won't exist in lots of cases
+            return None
 
     def normalise_failure(self, failure_string):
         """Remove identifiers from failures.
@@ -120,56 +131,37 @@ class Build(object):
         This prevents multiple incidents of the same failure being counted as
         multiple failures
         """
-        normalisers = [
-            (self.uuid_re, '**UUID**'),
-            (self.ip_re, '**IPv4**'),
-            (self.colour_code_re, ''),
-            (self.maas_tx_id_re, '**TX_ID**'),
-            (self.maas_entity_uri_re, '**Entity**'),
-            (self.maas_httpd_tx_id_re,
-                '**HTTP_TX_ID**'),
-            (self.ansible_tmp_re, 'ansible-tmp-**Removed**'),
-            (self.node_name_re, '**node-name**')
-        ]
-
-        for pattern, sub in normalisers:
-            failure_string = pattern.sub(sub, failure_string)
-
-        return failure_string
+        return normalise(failure_string)
 
     def get_parent_info(self):
-        jenkins_base = "https://rpc.jenkins.cit.rackspace.net"
+        jenkins_base = JENKINS_BASE
         self.trigger = "periodic"
         self.build_hierachy = []
-        cause_elem = self.tree.xpath(
-            '//causes | //causeBag/entry')[0].getchildren()[0]
 
         def normalise_job_name(name):
             # ensure that long names can be wrapped by inserting spaces
             return re.sub('([/=,.])', '\\1 ', name)
-        while True:
+        for cause in self.record.causes:
             cause_dict = {}
-            tag = cause_elem.tag
+            tag = cause['tag']
             if tag == 'hudson.model.Cause_-UpstreamCause':
                 cause_dict['name'] = normalise_job_name(
-                    cause_elem.find('./upstreamProject').text)
-                cause_dict['build_num'] = \
-                    cause_elem.find('./upstreamBuild').text
+                    cause['upstreamProject'])
+                cause_dict['build_num'] = cause['upstreamBuild']
                 cause_dict['url'] = (
                     "{jenkins}/{job}/{build}".format(
                         jenkins=jenkins_base,
-                        job=cause_elem.find('./upstreamUrl').text,
+                        job=cause['upstreamUrl'],
                         build=cause_dict['build_num']))
                 self.build_hierachy.append(cause_dict)
             elif tag == 'org.jenkinsci.plugins.ghprb.GhprbCause':
-                pullID = cause_elem.find('./pullID')
                 cause_dict['name'] = "PR: {title}".format(
-                    title=normalise_job_name(cause_elem.find('./title').text))
-                cause_dict['build_num'] = pullID.text
-                cause_dict['url'] = cause_elem.find('./url').text
+                    title=normalise_job_name(cause['title']))
+                cause_dict['build_num'] = cause['pullID']
+                cause_dict['url'] = cause['url']
                 self.trigger = "pr"
-                self.gh_pull = pullID.text
-                self.gh_target = cause_elem.find('./targetBranch').text
+                self.gh_pull = cause['pullID']
+                self.gh_target = cause['targetBranch']
                 self.gh_title = cause_dict['name']
                 self.build_hierachy.append(cause_dict)
             elif tag == 'hudson.triggers.TimerTrigger_-TimerTriggerCause':
@@ -179,7 +171,7 @@ class Build(object):
                     'url': '#'
                 })
             elif tag == 'hudson.model.Cause_-UserIdCause':
-                user = cause_elem.find('./userId').text
+                user = cause['userId']
                 self.trigger = "user"
                 self.build_hierachy.append({
                     'name': 'Manual Trigger by {user}'.format(user=user),
@@ -189,7 +181,7 @@ class Build(object):
                         user=user),
                 })
             elif tag == 'com.cloudbees.jenkins.GitHubPushCause':
-                user = cause_elem.find('./pushedBy').text
+                user = cause['pushedBy']
                 self.build_hierachy.append({
                     'name': "Github Push by {user}".format(user=user),
                     'build_num': '',
@@ -203,15 +195,6 @@ class Build(object):
                     'url': '#'
                 })
 
-            # Go round again if the current cause has upstream causes
-            upstream_causes = cause_elem.find('./upstreamCauses')
-            if upstream_causes is not None:
-                cause_elem = upstream_causes.getchildren()[0]
-                continue
-
-            # Otherwise found the root cause, exit loop.
-            break
-
         # causes are collected from the AIO job working up to the root causes
         # reverse the list to have the root cause as the first item.
         self.build_hierachy.reverse()
@@ -220,45 +203,18 @@ class Build(object):
         self.build_hierachy.append(dict(
             name=self.job_name,
             build_num=self.build_num,
-            url="{jenkins}/job/{job}/{build_num}".format(
-                jenkins=jenkins_base,
-                job=self.job_name,
+            url=BUILD_URL.format(
+                job_name=self.job_name,
                 build_num=self.build_num)))
 
     def read_logs(self):
-        def open_log(filename):
-            log_file = '{build_folder}/{filename}'.format(
-                build_folder=self.build_folder,
-                filename=filename)
-            lines = []
-            try:
-                with open(log_file, 'rt') as f:
-                    lines = f.readlines()
-            except IOError:
-                try:
-                    with gzip.open(log_file + ".gz", 'rt') as f:
-                        lines = f.readlines()
-                except IOError:
-                    return []
-
-            if isinstance(lines[0], bytes):
-                templines = []
-                for line in lines:
-                    templines.append(line.decode('utf-8'))
-                lines = templines
+        """Get a stream of lines from the logs of this build.
 
-            try:
-                post_build = lines.index(
-                    '[PostBuildScript] - Execution post build scripts.\n')
-                return lines[0: post_build]
-            except ValueError:
-                return lines
-
-        lines = []
-        lines += open_log('log')
-        lines += open_log('archive/artifacts/runcmd-bash.log')
-        lines += open_log('archive/artifacts/deploy.sh.log')
-        return lines
+        The task index of the build is populated as the stream is read.
+        """
+        source = LogSource(self.build_folder)
+        self.task_index = source.task_index
+        return source
 
     def __str__(self):
         return ("{timestamp} {result} {job_name}/{build_num}"
@@ -2,13 +2,14 @@
 from __future__ import print_function
 
 # Stdlib import
+import collections
+import concurrent.futures
 import datetime
-import dateutil.parser
 import functools
-import gc
 import json
 import os
 import re
+import time
 import traceback
 import uuid
 
@@ -17,8 +18,17 @@ import click
 import lxml
 
 # Project imports
-from build import Build
+import compact
+from build import Build, BUILD_URL
+from discovery import find_builds
 from failure import Failure
+from instrument import (BuildStats, profile_stage, profiled, RunReport,
+                        stage, StageProfiler)
+from publish import publish_shards, write_file
+from rollup import rollups
+from store import JSONStore, STORES
+from timeline import line_protocol as timeline_line_protocol, timeline
+from watch import is_finished, make_watcher
 
 # # Jenkins Build Summary Script
 # This script reads all the build.xml files specified and prints a summary of
@@ -30,6 +40,16 @@ from failure import Failure
 # builds. This value should be the same as the jenkins retain days value.
 RETENTION_DAYS = 60
 
+# Jobs whose builds are summarised
+JOB_RE = re.compile("(P[MR]|RE(LEASE)?|Pull)[-_]")
+
+# Number of rows in the top recurring failures table
+RECURRING_LIMIT = 100
+# Number of rows in each of the flaky and still failing tests tables
+TESTS_LIMIT = 100
+# Number of recent pipelines whose critical paths are published
+PIPELINES_LIMIT = 100
+
 
 # The following methods are for serialising various types of objects that
 # the default JSONEncoder can't handle. Single dispatch is used to add
@@ -62,218 +82,466 @@ def _uuid(uuid):
     return str(uuid)
 
 
-def serialise(obj):
-    return json.dumps(obj, default=to_serializable)
+def serialise(obj, **kwargs):
+    return json.dumps(obj, default=to_serializable, **kwargs)
+
+
+def scan_build(path_groups, age_limit, types=None, instrument=False,
+               profile=False):
+    """Read and scan one build.
+
+    types is a list of the names of the failure types to scan for, all types
+    are used if it is None.
+
+    Returns a dict containing the serialisation dicts for the build and its
+    failures, so that only plain data crosses process boundaries when
+    builds are scanned by a pool of workers. The Build and Failure objects
+    are released before returning.
+
+    If instrument is true the dict also contains the stats of the scan (see
+    instrument.BuildStats), and if profile is true its cProfile stats.
+    """
+    stats = BuildStats() if instrument else None
+    with profiled(profile) as profile_stats:
+        result = read_build(path_groups, age_limit, types, stats)
+    if stats is not None and "build" in result:
+        result["stats"] = stats.as_dict()
+    if profile_stats is not None:
+        result["profile"] = profile_stats
+    return result
+
+
+def read_build(path_groups, age_limit, types, stats):
+    key = "{job_name}_{build_num}".format(**path_groups)
+    build = None
+    try:
+        with stage(stats, 'read'):
+            build = Build(
+                build_folder=path_groups['build_folder'],
+                job_name=path_groups['job_name'],
+                build_num=path_groups['build_num'])
+        if build.timestamp <= age_limit:
+            return dict(key=key, status="o")
+        if build.result is None:
+            # still running, scanned once it has finished
+            return dict(key=key, status="u")
+        # if build.failed:
+        # failed check removed, as not all failures are fatal
+        # especially those that relate to re infrastructure
+        # as we attempt to insulate those from affecting the
+        # build reult. However measuring their frequency is
+        # still useful
+
+        # logs are streamed, only lines that match a failure are retained
+        build.log_lines = build.read_logs()
+        classes = None
+        if types is not None:
+            classes = [Failure.subclass(name) for name in types]
+        Failure.scan_build(build, classes, stats)
+        build.log_lines = None
+        build.task_index = None
+        build_dict = build.get_serialisation_dict()
+        build_dict['rules'] = Failure.rules()
+        return dict(
+            key=key,
+            status=".",
+            build=build_dict,
+            failures={id: Failure.failures[id].get_serialisation_dict()
+                      for id in build.failures})
+    except lxml.etree.XMLSyntaxError as e:
+        return dict(key=key, error=str(e))
+    except Exception as e:
+        result = dict(key=key, error=str(e))
+        if ("can't parse internal" not in str(e)):
+            result["traceback"] = traceback.format_exc()
+        return result
+    finally:
+        if build is not None:
+            Build.builds.pop(build.id, None)
+            for id, failure in list(Failure.failures.items()):
+                if failure.build is build:
+                    del Failure.failures[id]
+
+
+def scan_builds(jobs, age_limit, workers=1, instrument=False,
+                profile=False):
+    """Scan builds, yielding results in the same order as the input.
+
+    jobs is a list of (path_groups, types) tuples, see scan_build.
+    If workers is greater than one, builds are scanned by a pool of
+    processes. Only a few builds per worker are submitted ahead of the
+    results being consumed, so memory use doesn't grow with the number of
+    builds.
+    """
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers) as executor:
+            pending = collections.deque()
+            for path_groups, types in jobs:
+                pending.append(executor.submit(
+                    scan_build, path_groups, age_limit, types, instrument,
+                    profile))
+                if len(pending) >= workers * 4:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    else:
+        for path_groups, types in jobs:
+            yield scan_build(path_groups, age_limit, types, instrument,
+                             profile)
+
+
+def merge_rescan(stored_build, stored_failures, result, types):
+    """Merge the result of rescanning a stored build for some failure types.
+
+    Stored failures of the rescanned types, and of types that no longer
+    exist, are replaced by the failures found by the rescan. The stored
+    build id is kept. Returns the merged build and failures dicts.
+    """
+    current = Failure.fingerprints()
+    failures = collections.OrderedDict(
+        (id, stored_failures[id]) for id in stored_build['failures']
+        if id in stored_failures
+        and stored_failures[id]['type'] in current
+        and stored_failures[id]['type'] not in types)
+    for id in result['build']['failures']:
+        failure = dict(result['failures'][id], build=stored_build['id'])
+        failures[id] = failure
+    build = dict(stored_build,
+                 failures=list(failures.keys()),
+                 rules=result['build']['rules'])
+    return build, dict(failures)
+
+
+def open_store(store_type, jsonfile, dbfile):
+    if store_type == 'json':
+        return JSONStore(jsonfile)
+    store = STORES[store_type](dbfile)
+    if not store.build_keys() and os.path.exists(jsonfile):
+        # Seed a new store from an existing data file to avoid
+        # rescanning every build.
+        print("Importing builds from {}".format(jsonfile))
+        store.import_data(JSONStore(jsonfile).export())
+    return store
+
+
+def ingest(store, jobs, rescan_types, age_limit, workers, report=None,
+           profiler=None):
+    """Scan builds and add the results to the store.
+
+    jobs is a list of (path_groups, types) tuples, see scan_builds.
+    rescan_types is a dict of (job_name, build_num) to the failure types
+    a stored build is being rescanned for.
+    Results are added to the store in the order of jobs, so the output
+    doesn't depend on the number of workers. Returns a Counter of
+    new_builds, new_failures, rescanned and parse_failures.
+    The stats of each scanned build are added to report, and the profile
+    of each scan to the scan stage of profiler, if they are given.
+    """
+    counts = collections.Counter()
+    total = len(jobs)
+    for count, result in enumerate(scan_builds(
+            jobs, age_limit, workers, instrument=report is not None,
+            profile=profiler is not None)):
+        if "profile" in result:
+            profiler.add('scan', result.pop("profile"))
+        if (count % 100 == 0):
+            print("{}/{} ({:.2f} %)".format(
+                count,
+                total,
+                float(count / total) * 100
+            ))
+        if "error" in result:
+            counts["parse_failures"] += 1
+            print("\nFAIL: {key} {e}\n".format(key=result["key"],
+                                               e=result["error"]))
+            if "traceback" in result:
+                print(result["traceback"])
+        elif "build" in result:
+            key = (result["build"]["job_name"], result["build"]["build_num"])
+            if "stats" in result:
+                report.add(key, result.pop("stats"))
+            if key in rescan_types:
+                stored_build, stored_failures = store.get(key)
+                build, failures = merge_rescan(
+                    stored_build, stored_failures, result, rescan_types[key])
+                store.add(build, failures)
+                counts["rescanned"] += 1
+                result["status"] = "r"
+            else:
+                store.add(result["build"], result["failures"])
+                counts["new_builds"] += 1
+                counts["new_failures"] += len(result["failures"])
+        # . = build read ok, o = old, r = rescanned, u = unfinished
+        print(result.get("status", ""), end="")
+    store.commit()
+    return counts
+
+
+def publish(store, jsonfile, compact_format):
+    """Export the store to the data file, shards and rollups of the web UI.
+
+    The top recurring failures, failing tests, duration sketches,
+    concurrency timeline and pipeline latencies are also written next to
+    the data file.
+    Returns the exported data.
+    """
+    directory = os.path.dirname(os.path.abspath(jsonfile))
+    cache_dict = store.export()
+    # dump data out to json file, builds older than RETENTION_DAYS
+    # have already been pruned from the store.
+    timestamp = datetime.datetime.now()
+    out = dict(cache_dict,
+               timestamp=timestamp,
+               retention_days=RETENTION_DAYS)
+    encode = None
+    if compact_format:
+        encode = functools.partial(compact.encode, build_url=BUILD_URL)
+    # the json store only rewrites the data file when its journal is
+    # compacted, see journal.py.
+    if store.needs_compaction():
+        if encode is not None:
+            cache_string = serialise(encode(out))
+        else:
+            cache_string = serialise(out)
+        write_file(jsonfile, cache_string)
+        store.compacted()
+        print("Data file written: {}".format(jsonfile))
+
+    # publish per day shards next to the data file, only shards that have
+    # changed since the last run are rewritten.
+    written, removed = publish_shards(
+        cache_dict,
+        directory,
+        serialise,
+        encode,
+        timestamp=timestamp,
+        retention_days=RETENTION_DAYS)
+    print("Shards written: {written} removed: {removed}".format(
+        written=written, removed=removed))
+
+    # counts used by the web UI charts and tables
+    rollup_dict = rollups(cache_dict)
+    rollup_dict.update(timestamp=timestamp, retention_days=RETENTION_DAYS)
+    write_file(os.path.join(directory, 'rollups.json'),
+               serialise(rollup_dict))
+
+    # failures grouped by signature, so that a failure with one cause that
+    # is reported with many different details is counted once.
+    write_file(os.path.join(directory, 'recurring.json'),
+               serialise(dict(failures=store.recurring(RECURRING_LIMIT),
+                              timestamp=timestamp,
+                              retention_days=RETENTION_DAYS)))
+
+    # junit tests that fail intermittently or are still failing, from the
+    # failedSince build numbers recorded with junit failures.
+    write_file(os.path.join(directory, 'tests.json'),
+               serialise(dict(store.tests(TESTS_LIMIT),
+                              timestamp=timestamp,
+                              retention_days=RETENTION_DAYS)))
+
+    # percentiles of build durations, read with
+    # sketch.py report.
+    write_file(os.path.join(directory, 'sketches.json'),
+               serialise(dict(store.sketches().as_dict(),
+                              timestamp=timestamp,
+                              retention_days=RETENTION_DAYS)))
+
+    # number of builds running over time, overall and by os, stage and
+    # repo, for charts and influxdb.
+    concurrency = timeline(cache_dict['builds'].values())
+    write_file(os.path.join(directory, 'concurrency.json'),
+               serialise(dict(concurrency,
+                              timestamp=timestamp,
+                              retention_days=RETENTION_DAYS)))
+    write_file(os.path.join(directory, 'concurrency.influx'),
+               ''.join(line + '\n'
+                       for line in timeline_line_protocol(concurrency)))
+
+    # end to end latency of pipelines of upstream and downstream builds,
+    # and the critical paths of recent pipelines.
+    write_file(os.path.join(directory, 'pipelines.json'),
+               serialise(dict(store.pipelines().report(PIPELINES_LIMIT),
+                              timestamp=timestamp,
+                              retention_days=RETENTION_DAYS)))
+    return cache_dict
+
+
+def write_report(report, report_path, profiler):
+    """Write the instrumentation report and profiles, if requested."""
+    if report is not None:
+        report.write(report_path, datetime.datetime.now(), serialise)
+        print("Scan report written to {}".format(report_path))
+    if profiler is not None:
+        profiler.dump()
+        print("Profiles written to {}".format(profiler.directory))
+
+
+def watch_builds(store, jobsdir, jsonfile, compact_format, workers,
+                 poll_interval, polling, report_path=None, profiler=None):
+    """Scan builds as they finish, and publish them.
+
+    Runs until interrupted. Builds that finish at around the same time are
+    scanned and published together. If report_path is given a report is
+    written for each batch of builds, profiles accumulate over batches.
+    """
+    known = store.build_keys()
+    watcher = make_watcher(jobsdir, JOB_RE, known, poll_interval, polling)
+    print("Watching {jobsdir} ({watcher})".format(
+        jobsdir=jobsdir, watcher=type(watcher).__name__))
+    try:
+        while True:
+            try:
+                candidates = watcher.poll()
+                # collect the rest of a burst of builds
+                candidates.extend(watcher.poll(timeout=2))
+            except OSError as e:
+                # eg the limit on the number of inotify watches has been
+                # reached
+                print("Watch failed, polling instead: {}".format(e))
+                watcher.close()
+                watcher = make_watcher(jobsdir, JOB_RE, known,
+                                       poll_interval, polling=True)
+                continue
+            jobs = {}
+            for path_groups in candidates:
+                key = (path_groups['job_name'], path_groups['build_num'])
+                if key not in known and is_finished(
+                        path_groups['build_folder']):
+                    jobs[key] = (path_groups, None)
+            if not jobs:
+                continue
+            age_limit = (datetime.datetime.now()
+                         - datetime.timedelta(days=RETENTION_DAYS))
+            store.prune(age_limit)
+            report = RunReport() if report_path else None
+            counts = ingest(store, list(jobs.values()), {}, age_limit,
+                            workers, report, profiler)
+            # builds that failed to scan are not retried
+            for key in jobs:
+                watcher.done(key)
+            print("\n{time} New Builds: {builds} New Failures: {failures}"
+                  .format(time=datetime.datetime.now(),
+                          builds=counts["new_builds"],
+                          failures=counts["new_failures"]))
+            with profile_stage(profiler, 'publish'):
+                publish(store, jsonfile, compact_format)
+            write_report(report, report_path, profiler)
+    finally:
+        watcher.close()
 
 
 @click.command(help='arg is a jenkins jobs dir')
 @click.argument('jobsdir')
 @click.option('--newerthan', default=0,
               help='Build IDs older than this will not be shown')
-@click.option('--jsonfile', default='/opt/jenkins/www/.cache')
-def summary(jobsdir, newerthan, jsonfile):
+@click.option('--jsonfile', default='/opt/jenkins/www/.cache',
+              help='Data file for the web UI. This is also the cache when'
+                   ' the json store is used, with changes since it was'
+                   ' last written in <jsonfile>.journal')
+@click.option('--store', 'store_type', default='json',
+              type=click.Choice(sorted(STORES.keys())),
+              help='Backend used to store build summary data')
+@click.option('--dbfile', default='/opt/jenkins/www/summary.db',
+              help='Database file for the sqlite store')
+@click.option('--workers', default=1,
+              help='Number of processes used to scan new builds')
+@click.option('--compact/--no-compact', 'compact_format', default=True,
+              help='Write the data file and shards in the compact format')
+@click.option('--rescan/--no-rescan', default=True,
+              help='Rescan stored builds for failure types whose rules have'
+                   ' changed since the build was scanned')
+@click.option('--watch', is_flag=True,
+              help='After scanning, keep running and scan builds as they'
+                   ' finish')
+@click.option('--poll-interval', default=30,
+              help='Seconds between checks for new builds when watching'
+                   ' without inotify')
+@click.option('--poll', 'polling', is_flag=True,
+              help='Watch by polling, even if inotify is available')
+@click.option('--report', 'report_path', default=None,
+              help='Write the time, lines and bytes read and matches of'
+                   ' each failure type and build to this json file, and'
+                   ' as influxdb line protocol to <report>.influx')
+@click.option('--profile', 'profile_dir', default=None,
+              help='Write cProfile stats for each stage of the run to'
+                   ' <stage>.prof files in this directory')
+def summary(jobsdir, newerthan, jsonfile, store_type, dbfile, workers,
+            compact_format, rescan, watch, poll_interval, polling,
+            report_path, profile_dir):
 
     # calculate age limit based on retention days,
     # builds older than this will be ignored weather
-    # they are found in json or jobdir.
+    # they are found in the store or jobdir.
     age_limit = (datetime.datetime.now()
                  - datetime.timedelta(days=RETENTION_DAYS))
 
-    data = dict(builds={})
-    # read data from json input file
-    if os.path.exists(jsonfile):
-        try:
-            with open(jsonfile, 'r') as f:
-                data = json.load(f)
-        except Exception as e:
-            print(
-                "Failed to read json file: {jsonfile}"
-                .format(jsonfile=jsonfile))
-            traceback.print_exc()
-
-    # Current production data.json has some extremely long failure detail
-    # fields. This commit includes a change to failure.py to ensure
-    # that doesn't happen in future. However to deal with the problem
-    # on disk, we load and truncate the fields here.
-    # At the end of this run, the data file will be rewritten with
-    # truncated values, so this fix code will only be needed once.
-    if "failures" in data:
-        for id, failure in data['failures'].items():
-                failure['detail'] = failure['detail'][:1000]
-
-    # create set of build ids so we don't scan builds
-    # we already have summary information about
-    if "builds" in data:
-        build_dict = {"{jn}_{bn}".format(jn=b['job_name'], bn=b['build_num']):
-                      b for b in data['builds'].values()}
-    else:
-        build_dict = {}
-
-    # These dicts store builds and failures read in from
-    # the input json file that will also be written
-    # to the output json file.
-    cached_builds = {}
-    cached_failures = {}
-
-    # walk the supplied dir, scan new builds
-    parse_failures = 0
-    build_files = list(enumerate(["{}/build.xml".format(root)
-                       for root, dirs, files
-                       in os.walk(jobsdir)
-                       if "build.xml" in files
-                       and re.match("(P[MR]|RE(LEASE)?|Pull)[-_]", root)]))
-    for count, build in build_files:
-        path_groups_match = re.search(
-            ('^(?P<build_folder>.*/(?P<job_name>[^/]+)/'
-             'builds/(?P<build_num>[0-9]+))/'), build)
-        if path_groups_match:
-            if (count % 100 == 0):
-                gc.collect()
-                total = len(build_files)
-                print("{}/{} ({:.2f} %)".format(
-                    count,
-                    total,
-                    float(count / total) * 100
-                ))
-            path_groups = path_groups_match.groupdict()
-            job_name = path_groups['job_name']
-            build_num = path_groups['build_num']
-            key = "{job_name}_{build_num}".format(
-                job_name=job_name,
-                build_num=build_num
-            )
-            if key in build_dict:
-                try:
-                    # build already cached, don't need to rescan
-                    # But we do need to ensure that the cached data is age
-                    # checked and added to a dict of cached items to be
-                    # written out at the end.
-                    b = build_dict[key]
-                    if dateutil.parser.parse(b["timestamp"]) > age_limit:
-                        cached_builds[b["id"]] = build_dict[key]
-                        # ensure all referenced failures are also stored
-                        for failure_id in b["failures"]:
-                            print("f", end="")
-                            f = data["failures"][failure_id]
-                            cached_failures[f["id"]] = f
-                    print("c", end="")
-                    continue
-                except Exception as e:
-                    # failed to process cache, read the build log
-                    # as if it wasn't cached.
-                    # ! = cache read failure
-                    print("cache failure: " + str(e))
-                    print("!", end="")
-            try:
-                build = Build(
-                    build_folder=path_groups['build_folder'],
-                    job_name=path_groups['job_name'],
-                    build_num=path_groups['build_num'])
-                if build.timestamp > age_limit:
-                    # if build.failed:
-                    # failed check removed, as not all failures are fatal
-                    # especially those that relate to re infrastructure
-                    # as we attempt to insulate those from affecting the
-                    # build reult. However measuring their frequency is
-                    # still useful
-
-                    # store the log in memory only as long as necessary
-                    build.log_lines = build.read_logs()
-                    Failure.scan_build(build)
-                    build.log_lines = []
-                    build_dict[key] = build
-                    # . = build read ok
-                    print(".", end="")
-                    # print("OK: {key}\n".format(key=key))
-                else:
-                    # o = old
-                    print("o", end="")
-                    # print("Old Build: {key}\n" .format(key=key))
-            except lxml.etree.XMLSyntaxError as e:
-                print("\nFAIL: {key} {e}\n".format(key=key, e=e))
-                parse_failures += 1
-            except Exception as e:
-                parse_failures += 1
-                print("\nFAIL: {key} {e}\n".format(key=key, e=e))
-                if ("can't parse internal" not in str(e)):
-                    traceback.print_exc()
-
-    print("\nbuilds: {} failures: {}".format(len(build_dict.keys()),
-                                             parse_failures))
-
-    # dump data out to json file
-    # remove builds older than RETENTION_DAYS
-    # ensure we only dump data newer than RETENTION_DAYS
-
-    with open(jsonfile, "w") as f:
-
-        cache_dict = dict(
-            builds={id: build for id, build in Build.builds.items()
-                    if build.timestamp > age_limit},
-            failures={id: f for id, f in Failure.failures.items()
-                      if f.build.timestamp > age_limit},
-            timestamp=datetime.datetime.now(),
-            retention_days=RETENTION_DAYS
-        )
-        # debug statements for combining previously cached
-        # builds and failures with builds and failures
-        # detected on this run
-        print("\nNew Builds: {lcdb}"
-              "\nNew Failures: {lcdf}"
-              "\nBuilds carried forward: {lcb}"
-              "\nFailures carried forward: {lcf}"
-              .format(lcdb=len(cache_dict["builds"]),
-                      lcdf=len(cache_dict["failures"]),
-                      lcb=len(cached_builds),
-                      lcf=len(cached_failures)))
-
-        cache_dict["builds"].update(cached_builds)
-        cache_dict["failures"].update(cached_failures)
-
-        # convert objects to dicts for storage, this would be done
-        # by serialise() but its easier to do the integrity
-        # check when all the values are of the same type.
-        for id, build in cache_dict["builds"].items():
-            if type(build) is not dict:
-                cache_dict["builds"][id] = build.get_serialisation_dict()
-        for id, failure in cache_dict["failures"].items():
-            if type(failure) is not dict:
-                cache_dict["failures"][id] = failure.get_serialisation_dict()
-
-        def build_integrity_fail(id):
-            print("Integrity fail for build: {}".format(id))
-            del cache_dict["builds"][id]
-
-        def failure_integrity_fail(id):
-            print("Integrity fail for failure: {}".format(id))
-            del cache_dict["failures"][id]
-
-        # integrity check
-        # its important the data set is consistent as the
-        # UI assumes consistency. Its better to remove a few
-        # inconsistent items than have the whole UI die.
-        for id, build in cache_dict["builds"].copy().items():
-            try:
-                if build["id"] != id:
-                    build_integrity_fail(id)
-                for failure in build["failures"]:
-                    if failure not in cache_dict["failures"]:
-                        build_integrity_fail(id)
-                        break
-            except Exception as e:
-                    print("Build integrity exception: " + str(e))
-                    build_integrity_fail(id)
-
-        for id, failure in cache_dict["failures"].copy().items():
-            try:
-                if (failure["id"] != id
-                        or failure["build"] not in cache_dict["builds"]):
-                    failure_integrity_fail(id)
-            except Exception:
-                    failure_integrity_fail(id)
-
-        cache_string = serialise(cache_dict)
-        f.write(cache_string)
+    report = RunReport() if report_path else None
+    profiler = StageProfiler(profile_dir) if profile_dir else None
+
+    with profile_stage(profiler, 'load'):
+        store = open_store(store_type, jsonfile, dbfile)
+        store.prune(age_limit)
+
+        # find the types of failure each stored build needs to be
+        # rescanned for, builds are not rescanned if the rules they were
+        # scanned with haven't changed.
+        stale = {}
+        # types of failures to rescan for, by job
+        rescan_types = {}
+        cached = set()
+        for key, rules in store.build_rules().items():
+            if rules not in stale:
+                changed, removed = Failure.stale_rules(rules)
+                stale[rules] = ([subtype.__name__ for subtype in changed]
+                                if changed or removed else None)
+            if rescan and stale[rules] is not None:
+                rescan_types[key] = stale[rules]
+            else:
+                cached.add(key)
+
+    # find new builds and builds that need rescanning, builds that are
+    # already stored are skipped without reading anything from their dir.
+    to_scan = []
+    with profile_stage(profiler, 'discover'):
+        for path_groups in find_builds(
+                jobsdir, JOB_RE, skip=cached,
+                newer_than=time.mktime(age_limit.timetuple())):
+            key = (path_groups['job_name'], path_groups['build_num'])
+            to_scan.append((path_groups, rescan_types.get(key)))
+
+    counts = ingest(store, to_scan, rescan_types, age_limit, workers,
+                    report, profiler)
+    new_builds = counts["new_builds"]
+    new_failures = counts["new_failures"]
+
+    print("\nbuilds: {} failures: {} rescanned: {}".format(
+        len(cached) + new_builds + counts["rescanned"],
+        counts["parse_failures"],
+        counts["rescanned"]))
+
+    with profile_stage(profiler, 'publish'):
+        cache_dict = publish(store, jsonfile, compact_format)
+    write_report(report, report_path, profiler)
+
+    # debug statements for combining previously stored
+    # builds and failures with builds and failures
+    # detected on this run
+    print("\nNew Builds: {lcdb}"
+          "\nNew Failures: {lcdf}"
+          "\nBuilds carried forward: {lcb}"
+          "\nFailures carried forward: {lcf}"
+          .format(lcdb=new_builds,
+                  lcdf=new_failures,
+                  lcb=len(cache_dict["builds"]) - new_builds,
+                  lcf=len(cache_dict["failures"]) - new_failures))
+
+    try:
+        if watch:
+            watch_builds(store, jobsdir, jsonfile, compact_format, workers,
+                         poll_interval, polling, report_path, profiler)
+    finally:
+        store.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,116 @@
+# 3rd Party imports
+# Imports with C deps
+# remember to install all the apt xml stuff - not just the pip packages.
+from lxml import etree
+
+# Tags of the build.xml elements that are read
+STRING_PARAM = 'hudson.model.StringParameterValue'
+GHPRB_CAUSE = 'org.jenkinsci.plugins.ghprb.GhprbCause'
+UPSTREAM_CAUSE = 'hudson.model.Cause_-UpstreamCause'
+
+# Children of each type of cause that are copied into the cause dicts.
+CAUSE_FIELDS = {
+    UPSTREAM_CAUSE: ['upstreamProject', 'upstreamBuild', 'upstreamUrl'],
+    GHPRB_CAUSE: ['pullID', 'title', 'url', 'targetBranch'],
+    'hudson.model.Cause_-UserIdCause': ['userId'],
+    'com.cloudbees.jenkins.GitHubPushCause': ['pushedBy'],
+}
+
+# Parameters whose values are kept.
+PARAMETERS = ['BRANCH', 'REPO_URL']
+
+# Fields of the first ghprb cause whose values are kept.
+GHPRB_FIELDS = ['targetBranch', 'repoName']
+
+
+class BuildRecord(object):
+    """The fields of a build.xml that are used to summarise a build."""
+
+    __slots__ = ['result', 'start_time', 'duration', 'parameters', 'ghprb',
+                 'causes']
+
+    def __init__(self):
+        self.result = None
+        # start_time and duration are in seconds
+        self.start_time = None
+        self.duration = None
+        self.parameters = {}
+        self.ghprb = {}
+        # List of cause dicts, starting with the cause of this build and
+        # following the first upstream cause of each cause up to the root.
+        # Each dict contains the tag of the cause element, and the text of
+        # the children listed in CAUSE_FIELDS for that tag.
+        self.causes = []
+
+
+def _child_text(elem, tag):
+    child = elem.find(tag)
+    return child.text if child is not None else None
+
+
+def _cause_chain(causes_elem):
+    chain = []
+    children = causes_elem.getchildren()
+    cause_elem = children[0] if children else None
+    while cause_elem is not None:
+        cause = {'tag': cause_elem.tag}
+        for field in CAUSE_FIELDS.get(cause_elem.tag, []):
+            cause[field] = _child_text(cause_elem, field)
+        chain.append(cause)
+        upstream_causes = cause_elem.find('./upstreamCauses')
+        if upstream_causes is None or not len(upstream_causes):
+            break
+        cause_elem = upstream_causes[0]
+    return chain
+
+
+def read_build_xml(path):
+    """Extract a BuildRecord from a build.xml in one incremental pass.
+
+    Interesting elements are read as soon as they are complete. Subtrees
+    below the second level of the document are discarded once read, so the
+    whole document is never held in memory.
+    """
+    record = BuildRecord()
+    causes_found = False
+    for event, elem in etree.iterparse(path, events=('end',),
+                                       recover=True):
+        tag = elem.tag
+        parent = elem.getparent()
+        if parent is None:
+            continue
+        grandparent = parent.getparent()
+        if grandparent is None:
+            # Child of the root element
+            if tag == 'result':
+                record.result = elem.text
+            elif tag == 'startTime':
+                # jenkins uses miliseconds not seconds
+                record.start_time = float(elem.text) / 1000
+            elif tag == 'duration':
+                record.duration = float(elem.text) / 1000
+        elif tag == STRING_PARAM:
+            name = _child_text(elem, 'name')
+            if (name in PARAMETERS and name not in record.parameters
+                    and elem.find('value') is not None):
+                record.parameters[name] = _child_text(elem, 'value')
+        elif tag == GHPRB_CAUSE:
+            for field in GHPRB_FIELDS:
+                if (field not in record.ghprb
+                        and elem.find(field) is not None):
+                    record.ghprb[field] = _child_text(elem, field)
+        elif (not causes_found
+                and (tag == 'causes'
+                     or (tag == 'entry' and parent.tag == 'causeBag'))):
+            # The first element matching "//causes | //causeBag/entry"
+            # holds the cause chain.
+            causes_found = True
+            record.causes = _cause_chain(elem)
+
+        if grandparent is None or grandparent.getparent() is None:
+            # Discard the element and any preceding siblings, anything
+            # of interest within it has already been read.
+            elem.clear()
+            while elem.getprevious() is not None:
+                del parent[0]
+    return record
@@ -1,23 +1,30 @@
-import json
-import dateutil.parser
+import datetime
+
+from query import read_data
+from store import to_datetime
 
 # These functions are not called anywhere directly, but are useful for
 # loading into an interactive environment for inspecting a json build
-# data file.
+# data file. For repeated queries, index the data with query.load, see
+# query.py.
 
 
 # load build data
 def loadbd(filename):
-    data = json.load(open(filename))
+    # builds added and removed since the data file was written are
+    # replayed from its journal
+    data = read_data(filename)
+    # convert iso 8601 timestamps into date objects.
+    for b in data['builds'].values():
+        if not isinstance(b['timestamp'], datetime.datetime):
+            b['timestamp'] = to_datetime(b['timestamp'])
     builds = data['builds']
     failures = data['failures']
 
     # transform the uuids used to reference objects in json, back into
     # object references
-    # also convert iso 8601 timestamps into date objects.
     for b in builds.values():
         b['failures'] = [failures[uuid] for uuid in b['failures']]
-        b['timestamp'] = dateutil.parser.parse(b['timestamp'])
     for f in failures.values():
         f['build'] = builds[f['build']]
     return (data, builds.values(), failures.values())
@@ -25,12 +32,8 @@ def loadbd(filename):
 
 # get builds and failures for one day
 def objectsForDay(data, year, month, day):
-    def istd(b):
-        return (b['timestamp'].day == day
-                and b['timestamp'].month == month
-                and b['timestamp'].year == year)
-    builds = data['builds'].values()
-    failures = data['failures'].values()
-    daybuilds = [b for b in builds if istd(b)]
-    dayfailures = [f for f in failures if istd(f['build'])]
+    date = datetime.date(year, month, day)
+    daybuilds = [b for b in data['builds'].values()
+                 if b['timestamp'].date() == date]
+    dayfailures = [f for b in daybuilds for f in b['failures']]
     return (daybuilds, dayfailures)
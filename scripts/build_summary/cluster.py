@@ -0,0 +1,244 @@
+# Stdlib import
+import base64
+import hashlib
+import json
+import os
+import re
+import struct
+
+# Failures whose normalised details are nearly the same, eg that differ
+# only in a path, hostname or counter, are grouped into clusters.
+#
+# Each detail is reduced to a MinHash of its word shingles, the proportion
+# of equal values in the MinHashes of two details estimates the Jaccard
+# similarity of their shingles. MinHashes are split into bands, and details
+# are only compared with those that have an equal band (locality sensitive
+# hashing), rather than with every other detail. Similar details are
+# merged into the same cluster.
+#
+# Clusters are built from failure signatures (see signature.py) rather than
+# individual failures, as failures with the same signature are always in
+# the same cluster. Signatures are only compared with others of the same
+# failure type.
+#
+# MinHashes are stored so that they are only computed once per signature:
+# the sqlite store keeps them in its signatures table, the json store in a
+# file next to its data file (see read_minhashes).
+
+# One permutation hashing: each shingle is hashed once, the hash selects a
+# bin and the MinHash keeps the minimum value for each bin. Empty bins are
+# filled from the next bin that isn't empty.
+NUM_BINS = 64
+BANDS = 16
+ROWS = NUM_BINS // BANDS
+# Estimated similarity above which two signatures are in the same cluster.
+# Pairs with a similarity of 0.5 share a band with a probability of about
+# 0.65, and 0.75 with a probability of 0.99.
+SIMILARITY = 0.5
+SHINGLE_SIZE = 3
+# Added to values borrowed from other bins, so that an empty bin only
+# matches a bin that was filled from the same distance.
+EMPTY_OFFSET = 1 << 56
+
+# Identifies the MinHash parameters, stored MinHashes computed with
+# different parameters need to be recomputed.
+MINHASH_ID = hashlib.sha1(repr(
+    ('oph-md5', NUM_BINS, SHINGLE_SIZE, EMPTY_OFFSET)
+).encode('utf-8')).hexdigest()[:12]
+
+MINHASH_SUFFIX = '.minhash'
+
+token_re = re.compile(r'\w+')
+minhash_struct = struct.Struct('<{}Q'.format(NUM_BINS))
+
+
+def shingles(detail):
+    """Get the set of word shingles of a detail string."""
+    tokens = token_re.findall(detail)
+    if len(tokens) <= SHINGLE_SIZE:
+        return {' '.join(tokens)}
+    return {' '.join(tokens[i:i + SHINGLE_SIZE])
+            for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+
+def minhash(detail):
+    """Get the MinHash of a normalised detail string, a tuple of ints."""
+    bins = [None] * NUM_BINS
+    for shingle in shingles(detail):
+        value = struct.unpack(
+            '<Q', hashlib.md5(shingle.encode('utf-8')).digest()[:8])[0]
+        pos = value % NUM_BINS
+        value //= NUM_BINS
+        if bins[pos] is None or value < bins[pos]:
+            bins[pos] = value
+    filled = []
+    for pos in range(NUM_BINS):
+        distance = 0
+        while bins[(pos + distance) % NUM_BINS] is None:
+            distance += 1
+        filled.append(bins[(pos + distance) % NUM_BINS]
+                      + distance * EMPTY_OFFSET)
+    return tuple(filled)
+
+
+def pack_minhash(values):
+    return minhash_struct.pack(*values)
+
+
+def unpack_minhash(data):
+    return minhash_struct.unpack(bytes(data))
+
+
+def minhash_path(path):
+    """Get the path of the stored MinHashes of a data file."""
+    return path + MINHASH_SUFFIX
+
+
+def read_minhashes(path):
+    """Read MinHashes written by write_minhashes.
+
+    Returns a dict of signature to (failure type, MinHash), which is empty
+    if the file can't be read or was written with other parameters.
+    """
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    if data.get('id') != MINHASH_ID:
+        return {}
+    return {key: (failure_type,
+                  unpack_minhash(base64.b64decode(values)))
+            for key, (failure_type, values) in data['minhashes'].items()}
+
+
+def write_minhashes(path, minhashes):
+    """Write a dict of signature to (failure type, MinHash) to a file."""
+    content = json.dumps(dict(id=MINHASH_ID, minhashes={
+        key: (failure_type,
+              base64.b64encode(pack_minhash(values)).decode('ascii'))
+        for key, (failure_type, values) in minhashes.items()}))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+
+def similarity(a, b):
+    """Estimate the Jaccard similarity of the shingles of two details."""
+    return sum(1 for x, y in zip(a, b) if x == y) / float(NUM_BINS)
+
+
+def band_keys(failure_type, values):
+    return [(failure_type, band, values[band * ROWS:(band + 1) * ROWS])
+            for band in range(BANDS)]
+
+
+class ClusterIndex(object):
+    """Index of failure signatures clustered by similarity of their details.
+
+    Clusters are updated as signatures are added and removed. Removing a
+    signature may split its cluster, so the rest of that cluster is
+    clustered again, other clusters are unchanged. The id of a cluster is
+    its smallest signature, so ids don't depend on the order signatures
+    were added in.
+    """
+
+    def __init__(self):
+        # signature to (failure type, MinHash)
+        self.minhashes = {}
+        # band key to the set of signatures with that band
+        self.buckets = {}
+        # union find forest of signatures, roots are cluster ids
+        self.parents = {}
+        # cluster id to the signatures in the cluster
+        self.members = {}
+
+    def add(self, key, failure_type, detail=None, values=None):
+        """Add a signature, with its normalised detail or its MinHash.
+
+        Returns the MinHash of the signature.
+        """
+        if key in self.minhashes:
+            return self.minhashes[key][1]
+        if values is None:
+            values = minhash(detail)
+        self.minhashes[key] = (failure_type, values)
+        self.parents[key] = key
+        self.members[key] = {key}
+        for band in band_keys(failure_type, values):
+            bucket = self.buckets.setdefault(band, set())
+            self.merge(key, bucket)
+            bucket.add(key)
+        return values
+
+    def remove(self, key):
+        entry = self.minhashes.pop(key, None)
+        if entry is None:
+            return
+        for band in band_keys(*entry):
+            bucket = self.buckets[band]
+            bucket.discard(key)
+            if not bucket:
+                del self.buckets[band]
+        # the rest of the cluster may no longer be connected, cluster its
+        # signatures again.
+        members = self.members.pop(self.find(key))
+        members.discard(key)
+        del self.parents[key]
+        for member in members:
+            self.parents[member] = member
+            self.members[member] = {member}
+        added = set()
+        for member in sorted(members):
+            self.merge(member, set(
+                other for band in band_keys(*self.minhashes[member])
+                for other in self.buckets[band] if other in added))
+            added.add(member)
+
+    def find(self, key):
+        root = key
+        while self.parents[root] != root:
+            root = self.parents[root]
+        # path compression
+        while self.parents[key] != root:
+            self.parents[key], key = root, self.parents[key]
+        return root
+
+    def merge(self, key, candidates):
+        """Merge a signature with the similar signatures in candidates."""
+        values = self.minhashes[key][1]
+        for other in candidates:
+            root = self.find(key)
+            other_root = self.find(other)
+            if (root == other_root
+                    or similarity(values, self.minhashes[other][1])
+                    < SIMILARITY):
+                continue
+            # the smallest signature is the root
+            if other_root < root:
+                root, other_root = other_root, root
+            self.parents[other_root] = root
+            self.members[root].update(self.members.pop(other_root))
+
+    def cluster(self, key):
+        """Get the cluster id of a signature."""
+        return self.find(key)
+
+    def resemblance(self, builds):
+        """Count the other builds each signature resembles.
+
+        builds is a dict of signature to the ids of the builds it occurred
+        in. Returns a dict of signature to (cluster id, number of distinct
+        builds with failures in the same cluster that the signature didn't
+        occur in).
+        """
+        clusters = {key: self.cluster(key) for key in builds}
+        cluster_builds = {}
+        for key, ids in builds.items():
+            cluster_builds.setdefault(clusters[key], set()).update(ids)
+        return {key: (clusters[key],
+                      len(cluster_builds[clusters[key]]) - len(builds[key]))
+                for key in builds}
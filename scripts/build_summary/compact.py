@@ -0,0 +1,211 @@
+# Stdlib import
+import datetime
+
+# Project imports
+import store
+
+# Compact encoding of exported build data (a dict of builds and failures
+# keyed by id, see Store.export).
+#
+# Builds and failures are stored as rows of values, with the column names
+# stored once per table. Strings in columns that only contain strings are
+# replaced by their index in a shared string table, as job names, repos,
+# branches, failure types and descriptions repeat across thousands of
+# builds. Timestamps are stored as integer epoch milliseconds.
+#
+# Build hierachies are stored once in a shared table and referenced by
+# index. The last entry of each hierachy is the build itself, which is
+# omitted when it can be generated from the build_url template.
+# The failures of each build are not stored with the build, the build of
+# each failure is stored as the index of its row, and the failures list
+# of each build is regenerated in order when decoding.
+#
+# Columns are the union of the fields of all rows of a table. Columns that
+# some rows don't have (eg failed_since, which only junit failures have)
+# are listed as sparse, and each row ends with a bitmask of the sparse
+# columns it doesn't have, so rows decode to the fields they were encoded
+# from. Tables without sparse columns have no bitmask.
+#
+# Any other top level fields (eg timestamp) are copied as is.
+
+FORMAT = 'compact'
+VERSION = 1
+
+
+def epoch_ms(timestamp):
+    return int(round(store.to_epoch(timestamp) * 1000))
+
+
+def is_compact(data):
+    return data.get('format') == FORMAT
+
+
+class StringTable(object):
+
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def intern(self, string):
+        try:
+            return self.index[string]
+        except KeyError:
+            self.index[string] = len(self.strings)
+            self.strings.append(string)
+            return self.index[string]
+
+
+def encode_table(items, special, strings):
+    """Encode a list of dicts as rows.
+
+    special is a dict of column name to function that encodes the value
+    of that column. Other columns are interned if every value is a string
+    or None, except for the id column.
+    """
+    columns = sorted(set(key for item in items for key in item)
+                     - set(special.keys()) - {'id'})
+    sparse = [column for column in columns
+              if not all(column in item for item in items)]
+    interned = [column for column in columns
+                if all(isinstance(item.get(column), (str, type(None)))
+                       for item in items)]
+    columns = ['id'] + sorted(special.keys()) + columns
+    rows = []
+    for item in items:
+        row = []
+        for column in columns:
+            if column in special:
+                row.append(special[column](item))
+            elif column in interned:
+                row.append(strings.intern(item.get(column)))
+            else:
+                row.append(item.get(column))
+        if sparse:
+            row.append(sum(1 << bit for bit, column in enumerate(sparse)
+                           if column not in item))
+        rows.append(row)
+    return dict(columns=columns, interned=interned, sparse=sparse,
+                rows=rows)
+
+
+def encode(data, build_url=None):
+    """Encode exported build data in the compact format.
+
+    build_url is a format string for the url of a build, with job_name and
+    build_num fields. It is used to omit the last entry of the hierachy of
+    each build.
+    """
+    strings = StringTable()
+    hierachies = []
+    hierachy_index = {}
+    builds = sorted(data['builds'].values(),
+                    key=lambda b: (epoch_ms(b['timestamp']), b['id']))
+    build_rows = {build['id']: row for row, build in enumerate(builds)}
+
+    def encode_hierachy(build):
+        hierachy = build['build_hierachy']
+        own = 0
+        if build_url is not None and hierachy and hierachy[-1] == dict(
+                name=build['job_name'],
+                build_num=build['build_num'],
+                url=build_url.format(job_name=build['job_name'],
+                                     build_num=build['build_num'])):
+            hierachy = hierachy[:-1]
+            own = 1
+        entries = tuple((strings.intern(cause['name']),
+                         strings.intern(cause['build_num']),
+                         strings.intern(cause['url']))
+                        for cause in hierachy)
+        if entries not in hierachy_index:
+            hierachy_index[entries] = len(hierachies)
+            hierachies.append([list(entry) for entry in entries])
+        return [hierachy_index[entries], own]
+
+    # failures are regenerated from the build of each failure
+    build_table = encode_table(
+        [{key: value for key, value in build.items() if key != 'failures'}
+         for build in builds],
+        dict(timestamp=lambda b: epoch_ms(b['timestamp']),
+             build_hierachy=encode_hierachy),
+        strings)
+
+    failures = [data['failures'][id]
+                for build in builds for id in build['failures']]
+    failure_table = encode_table(
+        failures,
+        dict(build=lambda f: build_rows[f['build']]),
+        strings)
+
+    encoded = {key: value for key, value in data.items()
+               if key not in ('builds', 'failures')}
+    encoded.update(
+        format=FORMAT,
+        version=VERSION,
+        build_url=build_url,
+        strings=strings.strings,
+        hierachies=hierachies,
+        builds=build_table,
+        failures=failure_table)
+    return encoded
+
+
+def decode_table(table, strings):
+    columns = table['columns']
+    interned = set(table['interned'])
+    sparse = table.get('sparse', [])
+    items = []
+    for row in table['rows']:
+        item = {column: strings[value] if column in interned else value
+                for column, value in zip(columns, row)}
+        if sparse:
+            missing = row[len(columns)]
+            for bit, column in enumerate(sparse):
+                if missing & (1 << bit):
+                    del item[column]
+        items.append(item)
+    return items
+
+
+def decode(encoded):
+    """Decode compact build data to the format returned by Store.export.
+
+    Timestamps are decoded to datetimes.
+    """
+    if encoded.get('version') != VERSION:
+        raise ValueError("Unsupported compact format version: {}".format(
+            encoded.get('version')))
+    strings = encoded['strings']
+    build_url = encoded['build_url']
+    hierachies = [[dict(name=strings[name],
+                        build_num=strings[build_num],
+                        url=strings[url])
+                   for name, build_num, url in hierachy]
+                  for hierachy in encoded['hierachies']]
+
+    builds = decode_table(encoded['builds'], strings)
+    for build in builds:
+        hierachy_id, own = build['build_hierachy']
+        build['build_hierachy'] = [dict(cause)
+                                   for cause in hierachies[hierachy_id]]
+        if own:
+            build['build_hierachy'].append(dict(
+                name=build['job_name'],
+                build_num=build['build_num'],
+                url=build_url.format(job_name=build['job_name'],
+                                     build_num=build['build_num'])))
+        build['timestamp'] = datetime.datetime.fromtimestamp(
+            build['timestamp'] / 1000.0)
+        build['failures'] = []
+
+    failures = decode_table(encoded['failures'], strings)
+    for failure in failures:
+        build = builds[failure['build']]
+        failure['build'] = build['id']
+        build['failures'].append(failure['id'])
+
+    data = {key: value for key, value in encoded.items()
+            if key not in ('format', 'version', 'build_url', 'strings',
+                           'hierachies', 'builds', 'failures')}
+    data.update(builds={b['id']: b for b in builds},
+                failures={f['id']: f for f in failures})
+    return data
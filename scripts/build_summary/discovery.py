@@ -0,0 +1,65 @@
+# Stdlib import
+import heapq
+import os
+
+# Builds are found in <jobsdir>/<job>/builds/<build_num>/build.xml. Only
+# the top level job dirs that match a job name regex, and their builds dirs
+# are listed, so workspaces, artifacts and other files in the jobs dir are
+# never visited. Builds are listed newest first, so that builds older than
+# the retention period aren't visited either.
+
+
+def path_groups(jobsdir, job_name, build_num):
+    return dict(
+        build_folder=os.path.join(jobsdir, job_name, 'builds', build_num),
+        job_name=job_name,
+        build_num=build_num)
+
+
+def job_builds(jobsdir, job_name, skip=(), newer_than=None):
+    """Yield (-mtime, job_name, build_num) for the builds of a job.
+
+    Builds are listed by build number, newest first, and listing stops at
+    the first build whose build.xml was last modified before newer_than.
+    Builds finish roughly in build number order, so older builds are
+    never stat'ed, each run stats at most one build beyond the retention
+    period per job. A build that finished after a newer build of the same
+    job, both just before newer_than, may be missed, it is about to leave
+    the retention period anyway.
+    """
+    try:
+        entries = os.scandir(os.path.join(jobsdir, job_name, 'builds'))
+    except OSError:
+        return
+    # builds dirs also contain symlinks such as lastSuccessfulBuild
+    entries = sorted((entry for entry in entries if entry.name.isdigit()),
+                     key=lambda entry: int(entry.name), reverse=True)
+    for entry in entries:
+        if ((job_name, entry.name) in skip
+                or not entry.is_dir(follow_symlinks=False)):
+            continue
+        try:
+            mtime = os.stat(os.path.join(entry.path, 'build.xml')).st_mtime
+        except OSError:
+            continue
+        if newer_than is not None and mtime <= newer_than:
+            return
+        yield -mtime, job_name, entry.name
+
+
+def find_builds(jobsdir, job_re, skip=(), newer_than=None):
+    """Yield path groups for the builds in a jobs dir, newest first.
+
+    skip is a collection of (job_name, build_num) tuples of builds to
+    ignore, nothing is read from the dirs of those builds. Builds whose
+    build.xml was last modified before newer_than (epoch seconds) are
+    ignored, as they can't have started after it.
+    The builds of each job are listed lazily by build number (see
+    job_builds), and the jobs are merged by the modification time of
+    their build.xml.
+    """
+    jobs = [job_builds(jobsdir, job.name, skip, newer_than)
+            for job in os.scandir(jobsdir)
+            if job_re.match(job.name) and job.is_dir()]
+    for mtime, job_name, build_num in heapq.merge(*jobs):
+        yield path_groups(jobsdir, job_name, build_num)
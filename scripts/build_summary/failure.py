@@ -1,15 +1,34 @@
 from abc import ABC, abstractmethod
 import datetime
-import itertools
+import hashlib
 import re
 import uuid
 
+from instrument import stage
+from logsource import LogSource
+from scanner import LogScanner, MATCH_ALL, MATCH_FIRST, MATCH_LAST
+
 
 class Failure(ABC):
     description = "Failure Base Class"
     failures = {}
     console_note_re = re.compile(r'\[8mha:[^\s]*\s?\[0m(.\[[0-9];[0-9]{2}m)?')
     max_detail_length = 1000
+    # Lists of regex patterns and literal strings that indicate this
+    # failure. These are compiled into a single LogScanner shared by all
+    # subclasses, see scanner.py.
+    patterns = []
+    literals = []
+    match_mode = MATCH_FIRST
+    # Versions of the code that handles hits, part of the fingerprint of
+    # each failure type along with its declared rules (see rule_data).
+    # Bump rules_version of a failure type when its on_match or accept
+    # changes, and scan_version when the handling shared by all types
+    # changes (the scanner, the task index or scan_logs).
+    rules_version = 1
+    scan_version = 1
+    _scanners = {}
+    _fingerprints = None
 
     def __init__(self, build):
         self.id = str(uuid.uuid4())
@@ -41,44 +60,37 @@ class Failure(ABC):
                                "", detail)[:Failure.max_detail_length]
 
     @classmethod
-    def scan_build(cls, build):
-        cls.scan_logs(build)
-        if (build.junit is not None):
-            cls.scan_junit(build)
+    def scan_build(cls, build, classes=None, stats=None):
+        """Scan a build for failures.
+
+        classes is a list of the Failure subclasses to scan for, all
+        subclasses are used if it is None. stats is an optional
+        instrument.BuildStats to record the scan in.
+        """
+        with stage(stats, 'logs'):
+            cls.scan_logs(build, classes, stats)
+        if classes is None or JunitFailure in classes:
+            with stage(stats, 'junit'):
+                junit = build.read_junit()
+                if (junit is not None):
+                    cls.scan_junit(build, junit)
 
     @classmethod
-    def scan_junit(cls, build):
-        failed_cases = build.junit.xpath('//failedSince[text()!="0"]/..')
-        for case in failed_cases:
-
-            # don't count failures if they are skipped
-            try:
-                skipped = case.find('skipped')
-                if skipped.text == "true":
-                    continue
-            except Exception:
-                pass
-
-            # extract information from the xml element
-            class_name = case.find('className').text
-            if class_name is None:
-                class_name = ""
-            test_name = case.find('testName').text
-            if test_name is None:
-                test_name = ""
-            # try:
-            #     errorDetails = case.find('errorDetails').text
-            # except Exception as e:
-            #     errorDetails = ""
-            # errorStackTrace = case.find('errorStackTrace').text
-            # try:
-            #     stdout = case.find('stdout').text
-            # except Exception as e:
-            #     stdout = ""
+    def scan_junit(cls, build, cases):
+        """Add a JunitFailure for each failing case of a junit result.
+
+        cases is a list of junit.JunitCase, as returned by
+        Build.read_junit. Bump JunitFailure.rules_version when this
+        changes.
+        """
+        for case in cases:
+            class_name = case.class_name
+            test_name = case.test_name
 
             # create a failure object
             f = JunitFailure(build)
             f.detail = "{}.{}".format(class_name, test_name)
+            f.failed_since = case.failed_since
             if ("key" in test_name):
                 f.category = "C4 Keys"
             elif("bootstrap" in test_name or "bootstrap" in class_name):
@@ -91,158 +103,196 @@ class Failure(ABC):
             build.failures.append(f.id)
 
     @classmethod
-    def scan_logs(cls, build):
-        job_start_time = datetime.datetime.now()
+    def scanner(cls, classes=None):
+        """Get a LogScanner for a list of Failure subclasses.
+
+        All registered subclasses are used if classes is None. Scanners are
+        cached by the set of classes they scan for.
+        """
+        if classes is None:
+            classes = Failure.__subclasses__()
+        classes = tuple(classes)
+        if classes not in Failure._scanners:
+            Failure._scanners[classes] = LogScanner(classes)
+        return Failure._scanners[classes]
+
+    @classmethod
+    def rule_data(cls):
+        """Get the declared rules that define how this failure is detected."""
+        return repr((cls.__name__, cls.description, cls.category,
+                     cls.patterns, cls.literals, cls.match_mode,
+                     cls.rules_version, Failure.scan_version))
+
+    @classmethod
+    def fingerprint(cls):
+        """Get a short hash of the rule data of this failure type.
+
+        Builds record the fingerprint of each failure type they were
+        scanned with, so that they can be rescanned when the rules change.
+        """
+        return hashlib.sha1(
+            cls.rule_data().encode('utf-8')).hexdigest()[:12]
+
+    @classmethod
+    def fingerprints(cls):
+        """Get a dict of failure type name to fingerprint for all types."""
+        subclasses = tuple(Failure.__subclasses__())
+        if (Failure._fingerprints is None
+                or Failure._fingerprints[0] != subclasses):
+            Failure._fingerprints = (subclasses, {
+                subtype.__name__: subtype.fingerprint()
+                for subtype in subclasses})
+        return Failure._fingerprints[1]
+
+    @classmethod
+    def rules(cls):
+        """Get the fingerprints of all failure types as a string.
+
+        This is stored with each build, it is a string so that the many
+        builds scanned with the same rules can share one copy of it.
+        """
+        return ";".join("{}={}".format(name, fingerprint)
+                        for name, fingerprint
+                        in sorted(cls.fingerprints().items()))
+
+    @classmethod
+    def stale_rules(cls, rules):
+        """Compare rules recorded for a build with the current rules.
+
+        Returns a tuple of a list of the failure types that have changed or
+        been added, and a list of the names of failure types that have been
+        removed, since the build was scanned.
+        """
+        recorded = dict(item.split("=", 1)
+                        for item in (rules or "").split(";") if item)
+        current = cls.fingerprints()
+        changed = [subtype for subtype in Failure.__subclasses__()
+                   if recorded.get(subtype.__name__)
+                   != current[subtype.__name__]]
+        removed = [name for name in recorded if name not in current]
+        return changed, removed
+
+    @classmethod
+    def subclass(cls, name):
         for subtype in Failure.__subclasses__():
-            filter_start_time = datetime.datetime.now()
-            failure = subtype(build)
-            failure.scan()
-            filter_end_time = datetime.datetime.now()
-            if (filter_end_time - filter_start_time >
-                    datetime.timedelta(seconds=1)):
-                print("Slow filter: {d} on build {b}"
-                      .format(d=subtype.description,
-                              b=build))
+            if subtype.__name__ == name:
+                return subtype
+        raise KeyError("Unknown failure type: {}".format(name))
+
+    @classmethod
+    def scan_logs(cls, build, classes=None, stats=None):
+        job_start_time = datetime.datetime.now()
+        scanner = Failure.scanner(classes)
+        if not scanner.classes:
+            # Nothing to scan the logs for
+            return
+        failures = {subtype: subtype(build)
+                    for subtype, matchers in scanner.classes}
+        if (scanner.block_re is not None
+                and isinstance(build.log_lines, LogSource)):
+            # Logs are searched backwards when that allows the search to
+            # stop early, see LogScanner.search_blocks.
+            hits = scanner.search_blocks(failures,
+                                         build.log_lines.log_blocks(),
+                                         build.task_index, stats=stats)
+        else:
+            hits = scanner.search(failures, build.log_lines, stats)
+            # The search may stop before the end of the log, but hits
+            # are interpreted using the task index which must be complete.
+            build.log_lines.drain()
+        scanner.deliver(hits, stats)
+        for failure in failures.values():
             if failure.matches:
                 build.failures.append(failure.id)
-                Failure.failures[failure.id] = failure
+            else:
+                # Only failures that matched are retained
+                del Failure.failures[failure.id]
         job_end_time = datetime.datetime.now()
         if job_end_time - job_start_time > datetime.timedelta(seconds=5):
-            print("Slow Build: build {b}"
-                  .format(d=subtype.description,
-                          b=build))
-
-    def get_previous_task(self, line, order=-1, get_line_num=False):
-        previous_task_re = re.compile(
-            'TASK:? \[((?P<role>.*)\|)?(?P<task>.*)\]')
-        previous_play_re = re.compile(
-            'PLAY \[(?P<play>.*)\]')
-        task_match = None
-        play_match = None
-        lines = self.build.log_lines
-        if order == -1:
-            end = 0
-        else:
-            end = len(lines)
-        for index in range(line, end, order):
-            if not task_match:
-                task_match = previous_task_re.search(lines[index])
-            if task_match and get_line_num:
-                return index
-            play_match = previous_play_re.search(lines[index])
-            if task_match and play_match:
-                task_groups = task_match.groupdict()
-                play_groups = play_match.groupdict()
-                # If we match the last task to be executed
-                # chances are the failure happened post-ansible,
-                # so the last task indicator isn't that useful.
-                if (task_groups['task'].strip()
-                        == 'Deploy RPC HAProxy configuration files'):
-                    return 'N/A'
-                if 'role' in task_groups and task_groups['role']:
-                    return '{play} / {role} / {task}'.format(
-                        role=task_groups['role'],
-                        play=play_groups['play'],
-                        task=task_groups['task'])
-                else:
-                    return '{play} / {task}'.format(
-                        play=play_groups['play'],
-                        task=task_groups['task'])
-
-        return ""
+            print("Slow Build: build {b}".format(b=build))
+
+    def get_previous_task(self, line_num):
+        return self.build.task_index.previous_task(line_num)
 
     def failure_ignored(self, fail_line):
-        lines = self.build.log_lines
-        next_task_line = self.get_previous_task(fail_line,
-                                                order=1,
-                                                get_line_num=True)
+        return self.build.task_index.failure_ignored(fail_line)
 
-        if next_task_line == "":
-            return False
+    def accept(self, line, match):
+        """Filter hits using only the content of the matching line.
 
-        for line in lines[fail_line:next_task_line]:
-            if '...ignoring' in line:
-                return True
-        return False
+        Called during the scan, so must not depend on context from the
+        rest of the log. Hits that are not accepted do not count towards
+        the match_mode of the class.
+        """
+        return True
 
     @abstractmethod
-    def scan(self):
+    def on_match(self, line_num, line, match):
+        """Handle a hit selected by the scanner.
+
+        match is the re match object for a pattern, or the literal
+        string that was found in the line.
+        """
         pass
 
 
 class GitFetchFailure(Failure):
     description = "Failed to fetch from remote git repo"
     category = "C1 Remote Dependency"
+    patterns = [
+        r'Failed to fetch (\s*from\s*)?([^\s]*)\.git',
+        r'hudson\.plugins\.git'
+    ]
 
-    def scan(self):
-        match_res = [
-            re.compile(r'Failed to fetch (\s*from\s*)?([^\s]*)\.git'),
-            re.compile(r'hudson\.plugins\.git')
-        ]
-        for line, match_re in itertools.product(self.build.log_lines,
-                                                match_res):
-            match = match_re.search(line)
-            if match:
-                self.matches = True
-                self.detail = "Git Fetch Fail: {fail}".format(
-                    fail=match.string)
-                break
+    def on_match(self, line_num, line, match):
+        self.matches = True
+        self.detail = "Git Fetch Fail: {fail}".format(fail=line)
 
 
 class AptFailure(Failure):
     description = "Failures relating to APT"
     category = "C1 Remote Dependency"
+    patterns = [
+        r"Failed to fetch (\s*from\s*)?([^\s]*)( Hash Sum mismatch)?",
+        ("E: (?:Unable to locate package ([a-zA-Z-_]+)"
+         "|Package '([a-zA-Z-_]+)' has "
+         "no installation candidate)")
+    ]
+
+    def accept(self, line, match):
+        return ".git" not in line
 
-    def scan(self):
-        match_res = [
-            re.compile(
-                r"Failed to fetch (\s*from\s*)?([^\s]*)( Hash Sum mismatch)?"),
-            re.compile("E: (?:Unable to locate package ([a-zA-Z-_]+)"
-                       "|Package '([a-zA-Z-_]+)' has "
-                       "no installation candidate)")
-        ]
-        for line, match_re in itertools.product(self.build.log_lines,
-                                                match_res):
-            match = match_re.search(line)
-            if match and ".git" not in line:
-                self.matches = True
-                self.detail = "Apt Fetch Fail: {fail}".format(
-                    fail=match.string)
-                break
+    def on_match(self, line_num, line, match):
+        self.matches = True
+        self.detail = "Apt Fetch Fail: {fail}".format(fail=line)
 
 
 class AptMirrorFailure(Failure):
     description = "Mirror is not in a consistent state"
     category = "C2 Mirror"
+    match_str = ("WARNING: The following packages cannot be "
+                 "authenticated!\n")
+    literals = [match_str.strip()]
 
-    def scan(self):
-        match_str = ("WARNING: The following packages cannot be "
-                     "authenticated!\n")
-        try:
-            i = self.build.log_lines.index(match_str)
-            previous_task = self.get_previous_task(i)
-            self.matches = True
-            self.detail = "Apt Mirror Fail: {line} {task}".format(
-                line=match_str.strip(),
-                task=previous_task)
-        except ValueError:
-            return
+    def accept(self, line, match):
+        # Only whole line matches count
+        return line == self.match_str
+
+    def on_match(self, line_num, line, match):
+        previous_task = self.get_previous_task(line_num)
+        self.matches = True
+        self.detail = "Apt Mirror Fail: {line} {task}".format(
+            line=self.match_str.strip(),
+            task=previous_task)
 
 
 class ServiceUnavailableFailure(Failure):
     description = "HTTP 503"
     category = "C7 Uncategorised"
+    literals = ['ERROR: Service Unavailable (HTTP 503)']
 
-    def scan(self):
-        match_str = ('ERROR: Service Unavailable (HTTP 503)')
-        for i, line in enumerate(self.build.log_lines):
-            if match_str in line:
-                fail_line = i
-                break
-        else:
-            # didn't find a match
-            return
-        previous_task = self.get_previous_task(fail_line)
+    def on_match(self, line_num, line, match):
+        previous_task = self.get_previous_task(line_num)
         self.matches = True
         self.detail = ('Service Unavailable 503. PrevTask: {previous_task}'
                        .format(previous_task=previous_task))
@@ -251,201 +301,175 @@ class ServiceUnavailableFailure(Failure):
 class TempestFailure(Failure):
     description = "A tempest test failed"
     category = "C8 Tempest"
+    patterns = [r'\{0\} (?P<test>tempest[^ ]*).*\.\.\. FAILED']
+    match_mode = MATCH_LAST
 
-    def scan(self):
-        match_re = re.compile('\{0\} (?P<test>tempest[^ ]*).*\.\.\. FAILED')
-        for i, line in enumerate(self.build.log_lines):
-            match = match_re.search(line)
-            if match:
-                self.matches = True
-                test = match.groupdict()['test']
-                self.detail = 'Tempest Test Failed: {test}'.format(
-                    test=test)
+    def on_match(self, line_num, line, match):
+        self.matches = True
+        test = match.groupdict()['test']
+        self.detail = 'Tempest Test Failed: {test}'.format(
+            test=test)
 
 
 class SlaveOfflineFailure(Failure):
     description = ("Slave executing the build went offline before the "
                    "build completed")
     category = "C7 Uncategorised"
+    patterns = ['Agent went offline during the build']
 
-    def scan(self):
-        match_re = ('Agent went offline during the build')
-        pattern = re.compile(match_re)
-        for i, line in enumerate(self.build.log_lines):
-            if pattern.search(line):
-                previous_task = self.get_previous_task(i)
-                self.matches = True
-                self.detail = ('Slave Died / Agent went offline'
-                               ' during the build: {previous_task}'.format(
-                                   previous_task=previous_task))
-                break
+    def on_match(self, line_num, line, match):
+        previous_task = self.get_previous_task(line_num)
+        self.matches = True
+        self.detail = ('Slave Died / Agent went offline'
+                       ' during the build: {previous_task}'.format(
+                           previous_task=previous_task))
 
 
 class DpkgLock(Failure):
     description = "Multiple processes attempting to use dpkg db simultaneously"
     category = "C5 Local Task"
-
-    def scan(self):
-        match_str = 'dpkg status database is locked by another process'
-        alt_match_str = 'Could not get lock /var/lib/dpkg/lock'
-        for i, line in enumerate(self.build.log_lines):
-            if match_str in line or alt_match_str in line:
-                previous_task = self.get_previous_task(i)
-                self.matches = True
-                self.detail = "dpkg locked. PrevTask: {task}".format(
-                              task=previous_task)
+    literals = [
+        'dpkg status database is locked by another process',
+        'Could not get lock /var/lib/dpkg/lock'
+    ]
+    match_mode = MATCH_LAST
+
+    def on_match(self, line_num, line, match):
+        previous_task = self.get_previous_task(line_num)
+        self.matches = True
+        self.detail = "dpkg locked. PrevTask: {task}".format(
+                      task=previous_task)
 
 
 class PipFailure(Failure):
     description = "Failures relating to Python Pip"
     category = "C1 Remote Dependency"
+    patterns = ["Could not find a version that satisfies "
+                "the requirement ([^ ]*)"]
 
-    def scan(self):
-        match_re = re.compile("Could not find a version that satisfies "
-                              "the requirement ([^ ]*)")
-        for i, line in enumerate(self.build.log_lines):
-            match = match_re.search(line)
-            if match:
-                if not self.failure_ignored(i):
-                    self.matches = True
-                    self.detail = "Can't find pip package: {fail}".format(
-                                  fail=match.group(1))
-                break
+    def on_match(self, line_num, line, match):
+        # Only the first occurrence is considered, even if it was ignored.
+        if not self.failure_ignored(line_num):
+            self.matches = True
+            self.detail = "Can't find pip package: {fail}".format(
+                          fail=match.group(1))
 
 
 class JenkinsException(Failure):
     description = "An Exception in a Jenkins Class"
     category = "C7 Uncategorised"
+    patterns = [r"hudson\.[^ ]*Exception.*"]
+    excludes = [
+        "script returned exit code",
+        "hudson.plugins.git"
+    ]
+    match_mode = MATCH_LAST
 
-    def scan(self):
-        match_re = re.compile("hudson\.[^ ]*Exception.*")
-        excludes = [
-            "script returned exit code",
-            "hudson.plugins.git"
-        ]
-        for line in self.build.log_lines:
-            match = match_re.search(line)
-            exclude_match = any(e in line for e in excludes)
-            if match and not exclude_match:
-                self.matches = True
-                self.detail = match.group()
+    def accept(self, line, match):
+        return not any(e in line for e in self.excludes)
+
+    def on_match(self, line_num, line, match):
+        self.matches = True
+        self.detail = match.group()
 
 
 class AnsibleSyntaxFailure(Failure):
     description = "An Ansible syntax failure"
     category = "C5 Local Task"
+    patterns = ["ERROR:.*is not a legal parameter in an "
+                "Ansible task or handler"]
+    match_mode = MATCH_LAST
 
-    def scan(self):
-        match_re = re.compile("ERROR:.*is not a legal parameter in an "
-                              "Ansible task or handler")
-        for line in self.build.log_lines:
-            match = match_re.search(line)
-            if match:
-                self.matches = True
-                self.detail = match.group()
+    def on_match(self, line_num, line, match):
+        self.matches = True
+        self.detail = match.group()
 
 
 class AnsibleTaskFailure(Failure):
     description = "An ansible task failed"
     category = "C5 Local Task"
+    patterns = ['(fatal|failed):.*=>']
+    # All matches are needed as the category is sticky across matches
+    match_mode = MATCH_ALL
 
-    def scan(self):
-        match_re = re.compile('(fatal|failed):.*=>')
-        lines = self.build.log_lines
-        for i, line in enumerate(lines):
-            match = match_re.search(line)
-            if match:
-                previous_task = self.get_previous_task(i)
-                if not self.failure_ignored(i):
-                    self.matches = True
-                    self.detail = 'Task Failed: {task}'.format(
-                        task=previous_task)
-                    if re.search("apt|download|package|retrieve", self.detail,
-                                 re.I):
-                        self.category = "C1 Remote Dependency"
-                    elif re.search("key", self.detail, re.I):
-                        self.category = "C4 Keys"
-                    elif re.search("ssh", self.detail, re.I):
-                        self.category = "C3 SSH"
-                    elif re.search("bootstrap", self.detail, re.I):
-                        self.category = "C6 Bootstrap"
+    def on_match(self, line_num, line, match):
+        previous_task = self.get_previous_task(line_num)
+        if not self.failure_ignored(line_num):
+            self.matches = True
+            self.detail = 'Task Failed: {task}'.format(
+                task=previous_task)
+            if re.search("apt|download|package|retrieve", self.detail,
+                         re.I):
+                self.category = "C1 Remote Dependency"
+            elif re.search("key", self.detail, re.I):
+                self.category = "C4 Keys"
+            elif re.search("ssh", self.detail, re.I):
+                self.category = "C3 SSH"
+            elif re.search("bootstrap", self.detail, re.I):
+                self.category = "C6 Bootstrap"
 
 
 class BuildTimeoutFailure(Failure):
     description = "Build ran over the time limit"
     category = "C7 Uncategorised"
-
-    def scan(self):
-        match_re = ('Build timed out \(after [0-9]* minutes\). '
-                    'Marking the build as aborted.'
-                    '|Timeout has been exceeded'
-                    '|Cancelling nested steps due to timeout'
-                    '|Timeout waiting for NodePool ZNode '
-                    '/requests/.* to reach state fulfilled')
-        pattern = re.compile(match_re)
-        for i, line in enumerate(self.build.log_lines):
-            if pattern.search(line):
-                previous_task = self.get_previous_task(i)
-                self.matches = True
-                self.detail = 'Build Timeout: {previous_task}'.format(
-                    previous_task=previous_task)
-                break
+    patterns = [r'Build timed out \(after [0-9]* minutes\). '
+                'Marking the build as aborted.'
+                '|Timeout has been exceeded'
+                '|Cancelling nested steps due to timeout'
+                '|Timeout waiting for NodePool ZNode '
+                '/requests/.* to reach state fulfilled']
+
+    def on_match(self, line_num, line, match):
+        previous_task = self.get_previous_task(line_num)
+        self.matches = True
+        self.detail = 'Build Timeout: {previous_task}'.format(
+            previous_task=previous_task)
 
 
 class SSHFailure(Failure):
     description = "SSH communication failure"
     category = "C3 SSH"
-
-    def scan(self):
-        match_strings = [
-            ("SSH Error: data could not be sent to the remote host. "
-             "Make sure this host can be reached over ssh"),
-            "Failed to connect to the host via ssh",
-            "Timeout when waiting for search string OpenSSH",
-        ]
-        match_res = [
-            re.compile("Timeout when waiting for (.*):22")
-        ]
-        for line in self.build.log_lines:
-            for str_ in match_strings:
-                if str_ in line:
-                    self.matches = True
-                    self.detail = str_.strip()
-                    break
-            if self.matches:
-                break
-            for p in match_res:
-                m = p.search(line)
-                if m:
-                    self.matches = True
-                    self.detail = m.string.strip()
-                    break
-            if self.matches:
-                break
+    literals = [
+        ("SSH Error: data could not be sent to the remote host. "
+         "Make sure this host can be reached over ssh"),
+        "Failed to connect to the host via ssh",
+        "Timeout when waiting for search string OpenSSH",
+    ]
+    patterns = ["Timeout when waiting for (.*):22"]
+
+    def on_match(self, line_num, line, match):
+        self.matches = True
+        if match in self.literals:
+            self.detail = match.strip()
+        else:
+            self.detail = line.strip()
 
 
 class JunitFailure(Failure):
     description = "Junit Failure"
     category = "C7 Uncategorised"
+    # number of the build the test has been failing since
+    failed_since = None
+
+    def on_match(self, line_num, line, match):
+        # not used for scanning logs, see Failure.scan_junit
+        pass
 
-    def scan(self):
-        # not used for scanning logs so return false
-        return False
+    def get_serialisation_dict(self):
+        data = super(JunitFailure, self).get_serialisation_dict()
+        data['failed_since'] = self.failed_since
+        return data
 
 
 class ArtifactArchiveFailure(Failure):
     description = "Failure related to storing data generated by a build"
     category = "C8 RE Infra"
+    literals = [
+        "Warning: failed to create container",
+        ("This server could not verify that you are authorized to "
+         "access the document you requested"),
+    ]
 
-    def scan(self):
-        match_strings = [
-            "Warning: failed to create container",
-            ("This server could not verify that you are authorized to "
-             "access the document you requested"),
-        ]
-        for line, match_string in itertools.product(self.build.log_lines,
-                                                    match_strings):
-                if match_string in line:
-                    self.matches = True
-                    self.detail = str.strip()
-                    break
+    def on_match(self, line_num, line, match):
+        self.matches = True
+        self.detail = match
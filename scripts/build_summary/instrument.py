@@ -0,0 +1,241 @@
+# Stdlib import
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import time
+
+# Instrumentation of summary runs. Scanning a build records wall and cpu
+# time for each stage of the scan, and for each failure class the time
+# spent testing candidate lines and handling hits, with counts of lines
+# scanned, bytes read and matches found. Stats are plain dicts so that they
+# can be returned from scan worker processes.
+#
+# The stats of a run are written as a json report and as an influxdb line
+# protocol file, so that regressions after a rule change and pathological
+# logs can be found.
+
+clock = time.perf_counter
+cpu_clock = time.process_time
+
+# Names of the measurements in the line protocol file
+RUN_MEASUREMENT = 'build_summary_run'
+BUILD_MEASUREMENT = 'build_summary_build'
+CLASS_MEASUREMENT = 'build_summary_class'
+
+
+class BuildStats(object):
+    """Counters for the scan of one build."""
+
+    def __init__(self):
+        self.lines = 0
+        self.bytes = 0
+        # stage name to [wall, cpu]
+        self.stages = {}
+        # failure class name to [wall, cpu, candidate lines, matches]
+        self.classes = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a stage of the scan."""
+        start = clock()
+        cpu_start = cpu_clock()
+        try:
+            yield
+        finally:
+            totals = self.stages.setdefault(name, [0.0, 0.0])
+            totals[0] += clock() - start
+            totals[1] += cpu_clock() - cpu_start
+
+    def add_class(self, name, wall, cpu, lines=0, matches=0):
+        totals = self.classes.setdefault(name, [0.0, 0.0, 0, 0])
+        totals[0] += wall
+        totals[1] += cpu
+        totals[2] += lines
+        totals[3] += matches
+
+    def count(self, lines):
+        """Count the lines and bytes of an iterable of lines."""
+        for line in lines:
+            self.lines += 1
+            self.bytes += len(line)
+            yield line
+
+    def as_dict(self):
+        return dict(
+            wall=sum(wall for wall, cpu in self.stages.values()),
+            cpu=sum(cpu for wall, cpu in self.stages.values()),
+            lines=self.lines,
+            bytes=self.bytes,
+            matches=sum(c[3] for c in self.classes.values()),
+            stages={name: dict(wall=wall, cpu=cpu)
+                    for name, (wall, cpu) in self.stages.items()},
+            classes={name: dict(wall=c[0], cpu=c[1], lines=c[2],
+                                matches=c[3])
+                     for name, c in self.classes.items()})
+
+
+@contextlib.contextmanager
+def stage(stats, name):
+    """Time a stage of a scan, if stats isn't None."""
+    if stats is None:
+        yield
+        return
+    with stats.stage(name):
+        yield
+
+
+class RunReport(object):
+    """Stats of the builds scanned by a summary run."""
+
+    def __init__(self):
+        self.start = clock()
+        self.cpu_start = cpu_clock()
+        self.builds = []
+
+    def add(self, key, stats):
+        """Add the stats of a scanned build.
+
+        key is the (job_name, build_num) of the build, stats is the result
+        of BuildStats.as_dict.
+        """
+        self.builds.append(dict(stats, job_name=key[0], build_num=key[1]))
+
+    def classes(self):
+        """Total the stats of each failure class over all builds."""
+        totals = {}
+        for build in self.builds:
+            for name, stats in build['classes'].items():
+                total = totals.setdefault(
+                    name, dict(wall=0.0, cpu=0.0, lines=0, matches=0))
+                for field, value in stats.items():
+                    total[field] += value
+        return totals
+
+    def summary(self):
+        return dict(
+            wall=clock() - self.start,
+            # cpu time of the main process, scan workers are counted in
+            # the build stats.
+            cpu=cpu_clock() - self.cpu_start,
+            builds=len(self.builds),
+            scan_wall=sum(b['wall'] for b in self.builds),
+            scan_cpu=sum(b['cpu'] for b in self.builds),
+            lines=sum(b['lines'] for b in self.builds),
+            bytes=sum(b['bytes'] for b in self.builds),
+            matches=sum(b['matches'] for b in self.builds))
+
+    def as_dict(self, timestamp):
+        return dict(timestamp=timestamp,
+                    run=self.summary(),
+                    classes=self.classes(),
+                    builds=self.builds)
+
+    def write(self, path, timestamp, serialise=json.dumps):
+        """Write the json report to path, and line protocol to path.influx.
+
+        timestamp is the datetime of the run.
+        """
+        report = self.as_dict(timestamp)
+        with open(path, 'w') as f:
+            f.write(serialise(report))
+        with open(path + '.influx', 'w') as f:
+            for line in line_protocol(report, timestamp):
+                f.write(line + '\n')
+
+
+def escape_tag(value):
+    value = str(value)
+    for char in '\\, =':
+        value = value.replace(char, '\\' + char)
+    return value
+
+
+def format_fields(fields):
+    # integers are suffixed with i, so that they aren't stored as floats
+    return ','.join(
+        '{}={}'.format(name, '{}i'.format(value) if isinstance(value, int)
+                       else repr(float(value)))
+        for name, value in sorted(fields.items())
+        if isinstance(value, (int, float)))
+
+
+def line_protocol(report, timestamp):
+    """Yield influxdb line protocol lines for a report dict."""
+    ns = int(time.mktime(timestamp.timetuple())) * 10 ** 9
+    yield '{} {} {}'.format(RUN_MEASUREMENT,
+                            format_fields(report['run']), ns)
+    for name, stats in sorted(report['classes'].items()):
+        yield '{},class={} {} {}'.format(
+            CLASS_MEASUREMENT, escape_tag(name), format_fields(stats), ns)
+    for build in report['builds']:
+        yield '{},job_name={},build_num={} {} {}'.format(
+            BUILD_MEASUREMENT, escape_tag(build['job_name']),
+            escape_tag(build['build_num']), format_fields(build), ns)
+
+
+class StageProfiler(object):
+    """cProfile stats for each stage of a run.
+
+    Stages run in the main process are profiled with stage, stats of
+    stages run by workers are returned by them and merged with add. The
+    stats of each stage are dumped to <directory>/<stage>.prof, and can be
+    read with pstats or snakeviz.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.stats = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        with profiled(True) as raw_stats:
+            yield
+        self.add(name, raw_stats)
+
+    def add(self, name, raw_stats):
+        """Merge raw stats, the stats attribute of a cProfile.Profile."""
+        stats = pstats.Stats()
+        stats.stats = raw_stats
+        stats.get_top_level_stats()
+        if name in self.stats:
+            self.stats[name].add(stats)
+        else:
+            self.stats[name] = stats
+
+    def dump(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        for name, stats in self.stats.items():
+            stats.dump_stats(os.path.join(self.directory, name + '.prof'))
+
+
+@contextlib.contextmanager
+def profile_stage(profiler, name):
+    """Profile a stage of a run, if profiler isn't None."""
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
+
+
+@contextlib.contextmanager
+def profiled(enabled):
+    """Profile a block if enabled, yields the raw stats dict or None.
+
+    The dict is filled in when the block exits.
+    """
+    if not enabled:
+        yield None
+        return
+    raw_stats = {}
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield raw_stats
+    finally:
+        profile.disable()
+        profile.create_stats()
+        raw_stats.update(profile.stats)
@@ -0,0 +1,137 @@
+# Stdlib import
+import json
+import os
+
+# The json store is persisted as a snapshot, the data file, and a journal
+# of the changes made since the snapshot was written. Each run appends the
+# builds it scanned and the builds it removed to the journal, so the cost
+# of saving a run depends on the number of new builds rather than the size
+# of the data set.
+#
+# The journal is compacted when it grows large relative to the snapshot:
+# the store (with old builds already pruned) is written to a new data
+# file, which is renamed over the old one, then the journal is removed. If
+# a run stops between the two, replaying the journal over the new snapshot
+# gives the same data, as adding a build replaces any stored build with the
+# same job and number, and removing a build that isn't stored does nothing.
+#
+# Entries are json objects, one per line:
+#   {"op": "add", "build": <build dict>, "failures": {<id>: <failure>}}
+#   {"op": "remove", "id": <build id>}
+# A run that stops while appending may leave a partial last line, lines
+# that can't be read are skipped.
+
+JOURNAL_SUFFIX = '.journal'
+# The journal is compacted when it is larger than this fraction of the
+# snapshot.
+COMPACT_RATIO = 0.5
+
+
+def journal_path(path):
+    """Get the path of the journal of a data file."""
+    return path + JOURNAL_SUFFIX
+
+
+class Journal(object):
+    """Append only journal of changes to a json store."""
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = []
+
+    def add(self, build, failures):
+        self.pending.append(dict(op='add', build=build, failures=failures))
+
+    def remove(self, id):
+        self.pending.append(dict(op='remove', id=id))
+
+    def flush(self):
+        """Append pending entries to the journal, and sync it to disk."""
+        if not self.pending:
+            return
+        lines = ''.join(json.dumps(entry, default=str) + '\n'
+                        for entry in self.pending)
+        if self.size() and not self.ends_line():
+            # a partial entry from a run that stopped while appending
+            lines = '\n' + lines
+        with open(self.path, 'a') as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending = []
+
+    def ends_line(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def replay(self):
+        """Yield the entries in the journal, oldest first."""
+        try:
+            f = open(self.path, 'r')
+        except IOError:
+            return
+        with f:
+            for num, line in enumerate(f, 1):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    print("Skipping unreadable journal entry: {path}:{num}"
+                          .format(path=self.path, num=num))
+                    continue
+                yield entry
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def needs_compaction(self, snapshot_path):
+        """Check if the journal is large relative to its snapshot."""
+        try:
+            snapshot_size = os.path.getsize(snapshot_path)
+        except OSError:
+            return True
+        return self.size() > snapshot_size * COMPACT_RATIO
+
+    def truncate(self):
+        """Remove the journal, once its snapshot has been rewritten."""
+        self.pending = []
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def apply_entries(data, entries):
+    """Apply journal entries to exported build data.
+
+    data is a dict of builds and failures keyed by id, as returned by
+    Store.export, and is updated in place.
+    """
+    builds = data['builds']
+    failures = data['failures']
+    keys = {(build['job_name'], str(build['build_num'])): id
+            for id, build in builds.items()}
+
+    def remove(id):
+        build = builds.pop(id, None)
+        if build is None:
+            return
+        keys.pop((build['job_name'], str(build['build_num'])), None)
+        for failure_id in build['failures']:
+            failures.pop(failure_id, None)
+
+    for entry in entries:
+        if entry['op'] == 'add':
+            build = entry['build']
+            key = (build['job_name'], str(build['build_num']))
+            if key in keys:
+                remove(keys[key])
+            keys[key] = build['id']
+            builds[build['id']] = build
+            failures.update(entry['failures'])
+        elif entry['op'] == 'remove':
+            remove(entry['id'])
+    return data
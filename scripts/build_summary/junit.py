@@ -0,0 +1,172 @@
+# Stdlib import
+import collections
+import datetime
+
+# 3rd Party imports
+# Imports with C deps
+# remember to install all the apt xml stuff - not just the pip packages.
+from lxml import etree
+
+# junitResult.xml files are read incrementally, each test case is read as
+# soon as it is complete and then discarded, so that the results of large
+# test runs are never held in memory. Only failing cases that weren't
+# skipped are kept.
+#
+# The failing tests of stored builds are indexed by test and job, so that
+# flaky tests and tests that are still failing can be reported without
+# reading the junit files again. junitResult.xml records the build each
+# failing test has been failing since, failures of a test with different
+# failedSince builds are separate runs of failures, with passing builds
+# between them.
+
+JunitCase = collections.namedtuple(
+    'JunitCase', ['class_name', 'test_name', 'failed_since'])
+
+
+def _child_text(elem, tag):
+    child = elem.find(tag)
+    return child.text if child is not None else None
+
+
+def read_junit_cases(path):
+    """Read the failing cases of a junitResult.xml in one incremental pass.
+
+    Returns a list of JunitCase, failed_since is the build number the test
+    has been failing since. Raises IOError if the file can't be read.
+    """
+    cases = []
+    for event, elem in etree.iterparse(path, events=('end',), tag='case',
+                                       recover=True):
+        failed_since = (_child_text(elem, 'failedSince') or '').strip()
+        if (failed_since and failed_since != '0'
+                and _child_text(elem, 'skipped') != 'true'):
+            cases.append(JunitCase(
+                _child_text(elem, 'className') or '',
+                _child_text(elem, 'testName') or '',
+                int(failed_since) if failed_since.isdigit() else None))
+        # discard the case, and the cases before it
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+    return cases
+
+
+def build_number(build_num):
+    try:
+        return int(build_num)
+    except (TypeError, ValueError):
+        return None
+
+
+def test_row(test, job_name, builds, latest=None):
+    """Build a row of the test outcome reports.
+
+    builds is a dict of build id to (build_num, epoch timestamp,
+    failed_since) for each build of the job the test failed in. latest is
+    the number of the newest stored build of the job.
+    """
+    ids = sorted(builds, key=lambda id: (-builds[id][1], id))
+    last = builds[ids[0]]
+    streaks = set(since for num, timestamp, since in builds.values()
+                  if since is not None)
+    return dict(
+        test=test,
+        job_name=job_name,
+        count=len(builds),
+        streaks=len(streaks),
+        flaky=len(streaks) > 1,
+        failing=latest is not None and build_number(last[0]) == latest,
+        # the failedSince of the most recent failure
+        failing_since=last[2],
+        first_failed=datetime.datetime.fromtimestamp(
+            min(timestamp for num, timestamp, since in builds.values())),
+        last_failed=datetime.datetime.fromtimestamp(last[1]),
+        # most recent first
+        builds=ids)
+
+
+def test_report(rows, limit=None):
+    """Split test rows into the flaky and still failing test reports.
+
+    Flaky tests are those with the most separate runs of failures, still
+    failing tests are those that failed in the newest build of their job,
+    longest failing first.
+    """
+    flaky = sorted((row for row in rows if row['flaky']),
+                   key=lambda row: (-row['streaks'], -row['count'],
+                                    row['test'], row['job_name']))
+    failing = sorted((row for row in rows if row['failing']),
+                     key=lambda row: (row['failing_since'] is None,
+                                      row['failing_since'] or 0,
+                                      row['test'], row['job_name']))
+    if limit is not None:
+        flaky = flaky[:limit]
+        failing = failing[:limit]
+    return dict(flaky=flaky, failing=failing)
+
+
+class TestIndex(object):
+    """In memory index of the failing tests of each job.
+
+    Kept up to date as builds are added to and removed from a store.
+    """
+
+    def __init__(self):
+        # (test id, job name) to {build id: (build_num, epoch timestamp,
+        # failed_since)}
+        self.tests = {}
+        # build id to the (test id, job name) keys of its failures
+        self.build_tests = {}
+        # build id to (job name, build number) of every indexed build
+        self.build_numbers = {}
+
+    def add(self, build, timestamp, failures):
+        """Add the junit failures of a build.
+
+        build is a build serialisation dict, timestamp is its epoch
+        timestamp and failures is a list of failure serialisation dicts.
+        """
+        self.remove(build['id'])
+        self.build_numbers[build['id']] = (build['job_name'],
+                                           build_number(build['build_num']))
+        keys = set()
+        for failure in failures:
+            if failure['type'] != 'JunitFailure':
+                continue
+            key = (failure['detail'], build['job_name'])
+            self.tests.setdefault(key, {})[build['id']] = (
+                str(build['build_num']), timestamp,
+                failure.get('failed_since'))
+            keys.add(key)
+        if keys:
+            self.build_tests[build['id']] = keys
+
+    def remove(self, build_id):
+        self.build_numbers.pop(build_id, None)
+        for key in self.build_tests.pop(build_id, ()):
+            builds = self.tests[key]
+            builds.pop(build_id, None)
+            if not builds:
+                del self.tests[key]
+
+    def latest(self):
+        """Get a dict of job name to the number of its newest build."""
+        latest = {}
+        for job_name, num in self.build_numbers.values():
+            if num is not None and num > latest.get(job_name, -1):
+                latest[job_name] = num
+        return latest
+
+    def rows(self, latest=None):
+        """Get a row for each failing test of each job.
+
+        latest is a dict of job name to the number of its newest build, it
+        is taken from the indexed builds if it is None.
+        """
+        if latest is None:
+            latest = self.latest()
+        return [test_row(test, job_name, builds, latest.get(job_name))
+                for (test, job_name), builds in self.tests.items()]
+
+    def report(self, limit=None):
+        return test_report(self.rows(), limit)
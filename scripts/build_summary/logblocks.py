@@ -0,0 +1,324 @@
+# Stdlib import
+import mmap
+import zlib
+
+# Log files read as blocks of bytes rather than lines of text, so that the
+# scanner can search whole blocks with one regex and only decode the lines
+# that may be of interest. Blocks always contain whole lines, and can be
+# read from the start of a file or backwards from its end.
+#
+# Lines end with \n, \r\n or \r, the same as reading a file in text mode
+# with universal newlines, so that line numbers and content match those
+# read by LogSource.
+#
+# Plain logs are memory mapped and searched in place, so they are never
+# copied into blocks. The lines of a mapped log are only counted up to the
+# positions that are needed, see LogScanner.block_lines.
+#
+# Gzipped logs can't be read backwards directly. They are decompressed
+# once from the start, saving the state of the decompressor at intervals,
+# then each section is decompressed again from its saved state as it is
+# needed.
+
+BLOCK_SIZE = 1 << 20
+# Size of the compressed input between saved decompressor states, logs
+# typically compress by a factor of 10 or more.
+CHECKPOINT_INTERVAL = 1 << 18
+# wbits for zlib to read gzip headers and trailers
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def line_count(data, start=0, end=None):
+    """Count the line terminators in a section of a block or mmap."""
+    if end is None:
+        end = len(data)
+    if not isinstance(data, bytes):
+        # mmaps can't count, so count a copy of the section, a block at a
+        # time if it is large.
+        if end - start > BLOCK_SIZE:
+            count = 0
+            for pos in range(start, end, BLOCK_SIZE):
+                stop = min(pos + BLOCK_SIZE, end)
+                # with the next byte, to find a \r\n split between blocks
+                block = data[pos:stop + 1]
+                count += line_count(block, 0, stop - pos)
+                if stop < end and block.endswith(b'\r\n'):
+                    count -= 1
+            return count
+        data, start, end = data[start:end], 0, end - start
+    return (data.count(b'\n', start, end) + data.count(b'\r', start, end)
+            - data.count(b'\r\n', start, end))
+
+
+def ends_line(data, end):
+    """Check if the byte before end is a line terminator."""
+    return data[end - 1:end] in (b'\n', b'\r')
+
+
+def window_lines(data, start, end):
+    """Count the lines in a window, including a last unterminated line."""
+    count = line_count(data, start, end)
+    if end > start and not ends_line(data, end):
+        count += 1
+    return count
+
+
+def last_line_end(data):
+    """Find the end of the last whole line in data.
+
+    A trailing \r isn't treated as the end of a line, as it may be followed
+    by \n at the start of the next block.
+    """
+    end = len(data)
+    if data.endswith(b'\r'):
+        end -= 1
+    return max(data.rfind(b'\n', 0, end), data.rfind(b'\r', 0, end)) + 1
+
+
+def first_line_start(data):
+    """Find the start of the first whole line in data.
+
+    Returns 0 if data doesn't contain the end of a line.
+    """
+    newline = data.find(b'\n')
+    carriage = data.find(b'\r')
+    if carriage != -1 and (newline == -1 or carriage < newline):
+        if data[carriage + 1:carriage + 2] == b'\n':
+            return carriage + 2
+        return carriage + 1
+    return newline + 1
+
+
+def line_start(data, pos):
+    """Find the start of the line containing pos."""
+    start = max(data.rfind(b'\n', 0, pos), data.rfind(b'\r', 0, pos)) + 1
+    if start == pos and pos and data[pos - 1:pos + 1] == b'\r\n':
+        # pos is the \n of a \r\n, which ends the line before it
+        return line_start(data, pos - 1)
+    return start
+
+
+def mapped_backward(data, end):
+    """Yield windows of whole lines of an mmap before end, last first."""
+    stop = end
+    while stop > 0:
+        start = 0
+        if stop > BLOCK_SIZE:
+            start = line_start(data, stop - BLOCK_SIZE)
+        yield data, start, stop
+        stop = start
+
+
+class LogFile(object):
+    """A plain text log file, read as blocks up to the post build marker.
+
+    marker is the text of the post build marker line, without its line
+    terminator.
+    """
+
+    def __init__(self, path, marker):
+        self.path = path
+        self.marker = marker.encode('utf-8')
+        self._end = None
+        self._lines = None
+
+    def raw_blocks(self):
+        """Yield the content of the file in order, in blocks."""
+        with open(self.path, 'rb') as f:
+            while True:
+                block = f.read(BLOCK_SIZE)
+                if not block:
+                    return
+                yield block
+
+    def reversed_raw_blocks(self, end):
+        """Yield the content of the file before offset end, last first."""
+        with open(self.path, 'rb') as f:
+            while end > 0:
+                start = max(0, end - BLOCK_SIZE)
+                f.seek(start)
+                yield f.read(end - start)
+                end = start
+
+    def find_marker(self, data):
+        """Find the start of the first marker line in a block."""
+        pos = data.find(self.marker)
+        while pos != -1:
+            # The marker must be a whole line, blocks always start at the
+            # start of a line.
+            end = pos + len(self.marker)
+            if ((pos == 0 or data[pos - 1:pos] in (b'\n', b'\r'))
+                    and data[end:end + 1] in (b'\n', b'\r')):
+                return pos
+            pos = data.find(self.marker, pos + 1)
+        return None
+
+    def forward(self):
+        """Yield blocks of whole lines, from the start of the file."""
+        carry = b''
+        for block in self.raw_blocks():
+            data = carry + block
+            cut = last_line_end(data)
+            carry = data[cut:]
+            data = data[:cut]
+            marker = self.find_marker(data)
+            if marker is not None:
+                if marker:
+                    yield data[:marker]
+                return
+            if data:
+                yield data
+        if carry:
+            marker = self.find_marker(carry)
+            if marker is not None:
+                carry = carry[:marker]
+            if carry:
+                yield carry
+
+    def end(self):
+        """Offset of the post build marker, or the size of the file."""
+        if self._end is None:
+            self._end = 0
+            self._lines = 0
+            for data in self.forward():
+                self._end += len(data)
+                self._lines += window_lines(data, 0, len(data))
+        return self._end
+
+    def lines(self):
+        """Number of lines before the post build marker."""
+        if self._lines is None:
+            self._lines = sum(window_lines(data, start, end)
+                              for data, start, end in self.windows())
+        return self._lines
+
+    def backward(self):
+        """Yield blocks of whole lines, from the marker to the start.
+
+        The blocks are yielded last first, the lines in each block are in
+        file order.
+        """
+        carry = b''
+        for block in self.reversed_raw_blocks(self.end()):
+            data = block + carry
+            cut = first_line_start(data)
+            if not cut:
+                # The block is part of a single line
+                carry = data
+                continue
+            carry = data[:cut]
+            data = data[cut:]
+            if data:
+                yield data
+        if carry:
+            yield carry
+
+    def block_windows(self, reverse=False):
+        for data in (self.backward() if reverse else self.forward()):
+            yield data, 0, len(data)
+
+    def windows(self, reverse=False):
+        """Yield (data, start, end) windows of whole lines.
+
+        data is an mmap of the file, or a block of it if it can't be
+        mapped. Windows cover the file up to the post build marker, in
+        file order or last first if reverse is true. When reading forwards
+        the whole file is one window.
+        """
+        with open(self.path, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                # eg an empty file, which can't be mapped
+                data = None
+            if data is None:
+                for window in self.block_windows(reverse):
+                    yield window
+                return
+            try:
+                marker = self.find_marker(data)
+                end = len(data) if marker is None else marker
+                if reverse:
+                    for window in mapped_backward(data, end):
+                        yield window
+                elif end:
+                    yield data, 0, end
+            finally:
+                data.close()
+
+
+class GzipLogFile(LogFile):
+    """A gzipped log file, with an index of decompressor states.
+
+    The index is built as the file is read forwards, so it covers the
+    file up to the post build marker once end() has been called.
+    """
+
+    def __init__(self, path, marker):
+        super(GzipLogFile, self).__init__(path, marker)
+        # (compressed offset, decompressed offset, decompressor) tuples,
+        # the decompressor is None at the start of the file.
+        self.checkpoints = [(0, 0, None)]
+
+    def inflate(self, checkpoint, record=False):
+        """Yield decompressed blocks, starting at a checkpoint.
+
+        Decompression stops at the end of the file, or at data that isn't
+        valid, so a truncated or corrupt file is read as far as possible.
+        """
+        in_offset, out_offset, state = checkpoint
+        if state is None:
+            decompressor = zlib.decompressobj(GZIP_WBITS)
+        else:
+            decompressor = state.copy()
+        with open(self.path, 'rb') as f:
+            f.seek(in_offset)
+            while True:
+                chunk = f.read(CHECKPOINT_INTERVAL)
+                if not chunk:
+                    return
+                try:
+                    block = decompressor.decompress(chunk)
+                    # A gzip file may contain several members
+                    while decompressor.eof and decompressor.unused_data:
+                        unused = decompressor.unused_data
+                        decompressor = zlib.decompressobj(GZIP_WBITS)
+                        block += decompressor.decompress(unused)
+                except zlib.error:
+                    return
+                in_offset += len(chunk)
+                out_offset += len(block)
+                if record and in_offset > self.checkpoints[-1][0]:
+                    self.checkpoints.append(
+                        (in_offset, out_offset, decompressor.copy()))
+                if block:
+                    yield block
+
+    def raw_blocks(self):
+        return self.inflate(self.checkpoints[0], record=True)
+
+    def windows(self, reverse=False):
+        return self.block_windows(reverse)
+
+    def lines(self):
+        self.end()
+        return self._lines
+
+    def reversed_raw_blocks(self, end):
+        checkpoints = [c for c in self.checkpoints if c[1] < end]
+        for pos in range(len(checkpoints) - 1, -1, -1):
+            start = checkpoints[pos][1]
+            if pos + 1 < len(checkpoints):
+                stop = checkpoints[pos + 1][1]
+            else:
+                stop = end
+            if start == stop:
+                continue
+            blocks = []
+            size = 0
+            for block in self.inflate(checkpoints[pos]):
+                blocks.append(block)
+                size += len(block)
+                if start + size >= stop:
+                    break
+            yield b''.join(blocks)[:stop - start]
@@ -0,0 +1,113 @@
+# Stdlib import
+import bisect
+import gzip
+import os
+
+# Project imports
+from logblocks import GzipLogFile, LogFile
+from taskindex import TaskIndex
+
+
+class LogSource(object):
+    """Lazily read the logs of a build as a single stream of lines.
+
+    Each log file is read one line at a time, falling back to the gzipped
+    version if the plain file doesn't exist. Reading stops at the post build
+    marker, so lines from post build scripts aren't scanned. The file each
+    line came from is tracked so line numbers in the stream can be mapped
+    back to a position in a file, and the ansible structure of the log is
+    indexed as lines are read.
+
+    A LogSource can only be iterated once. Alternatively the files can be
+    read as blocks, see log_blocks.
+    """
+
+    log_files = [
+        'log',
+        'archive/artifacts/runcmd-bash.log',
+        'archive/artifacts/deploy.sh.log'
+    ]
+    post_build_marker = '[PostBuildScript] - Execution post build scripts.\n'
+
+    def __init__(self, build_folder, log_files=None):
+        self.build_folder = build_folder
+        if log_files is not None:
+            self.log_files = log_files
+        self.task_index = TaskIndex()
+        # Paths of the files that have been read, and the line number
+        # within the stream of the first line of each.
+        self.files = []
+        self.file_starts = []
+        self.line_count = 0
+        self._lines = self._read()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._lines)
+
+    def open_log(self, filename):
+        log_file = os.path.join(self.build_folder, filename)
+        try:
+            return open(log_file, 'rt'), log_file
+        except IOError:
+            try:
+                return gzip.open(log_file + ".gz", 'rt'), log_file + ".gz"
+            except IOError:
+                return None, None
+
+    def _read(self):
+        marker = self.post_build_marker
+        index_line = self.task_index.add
+        for filename in self.log_files:
+            f, path = self.open_log(filename)
+            if f is None:
+                continue
+            self.files.append(path)
+            self.file_starts.append(self.line_count)
+            with f:
+                try:
+                    for line in f:
+                        if line == marker:
+                            break
+                        # cheap check before calling into the index, as
+                        # this runs for every line of every log.
+                        if ('TASK' in line or 'PLAY [' in line
+                                or '...ignoring' in line):
+                            index_line(self.line_count, line)
+                        self.line_count += 1
+                        yield line
+                except IOError:
+                    # Truncated or corrupt gzip, use what could be read.
+                    pass
+
+    def log_blocks(self):
+        """Get a logblocks.LogFile for each log file that exists.
+
+        These can be searched by LogScanner.search_blocks, rather than
+        iterating over this source, lines are then added to the task index
+        by the search.
+        """
+        marker = self.post_build_marker.rstrip('\n')
+        log_files = []
+        for filename in self.log_files:
+            path = os.path.join(self.build_folder, filename)
+            if os.path.isfile(path):
+                log_files.append(LogFile(path, marker))
+            elif os.path.isfile(path + ".gz"):
+                log_files.append(GzipLogFile(path + ".gz", marker))
+        return log_files
+
+    def drain(self):
+        """Read the rest of the logs so the task index is complete."""
+        for line in self:
+            pass
+
+    def locate(self, line_num):
+        """Map a line number in the stream to (file path, line in file)."""
+        file_pos = bisect.bisect_right(self.file_starts, line_num) - 1
+        if file_pos < 0:
+            raise IndexError("line {} not read".format(line_num))
+        return (self.files[file_pos],
+                line_num - self.file_starts[file_pos])
@@ -0,0 +1,328 @@
+# Stdlib import
+import datetime
+import re
+
+# End to end latency of pipelines, from the build hierachies of stored
+# builds.
+#
+# Each build records its chain of upstream causes (see
+# Build.get_parent_info), from the root cause to the build itself. The
+# chains are joined into a graph as builds are stored: each upstream build
+# and PR is a node, and each step of a chain links a parent to a child, so
+# adding or removing a build costs the length of its chain. Links are
+# counted, as every build below an upstream build repeats its part of the
+# chain, and are dropped with the last build that asserts them.
+#
+# A pipeline is the tree below a root node (usually a PR or a push trigger
+# job). Its latency is from the earliest time any of its builds started to
+# the latest time one finished. The critical path is the chain from the
+# root to the build that finished last, and its time is split into time
+# when a build on the path was executing, time when one was queued and
+# time when neither was (eg upstream jobs that aren't stored were
+# running), to show whether queueing or execution makes a pipeline slow.
+#
+# Jenkins doesn't record when a build was triggered, so waits are taken
+# from the links of the graph: a build that started after its upstream
+# build finished was triggered when the upstream build finished, and
+# queued until it started. A build that started while its upstream build
+# was running (eg a build step that waits for downstream builds) has no
+# wait that can be told apart from the upstream build executing, and
+# neither has a build whose upstream build isn't stored.
+#
+# Only the builds of summarised jobs (see JOB_RE in build_summary_gh.py)
+# are stored, other nodes have no times and are shown in critical paths by
+# name only. The pipelines command of query.py reports pipelines from a
+# data file.
+
+# Number of pipelines in a report, most recently finished first
+LIMIT = 100
+PERCENTILES = [50, 90]
+
+
+def node_key(entry):
+    """Get the key of the node of a build hierachy entry.
+
+    Upstream job names have spaces inserted to allow wrapping, which are
+    removed so that they match the job names of stored builds. PRs are
+    keyed by url, as PR numbers are only unique within a repo.
+    """
+    if entry['name'].startswith('PR: '):
+        return (entry['url'], str(entry['build_num']))
+    return (re.sub('([/=,.]) ', '\\1', entry['name']),
+            str(entry['build_num']))
+
+
+def build_times(build, timestamp):
+    """Get the start and end epoch times of a stored build.
+
+    timestamp is the start of the build in epoch seconds.
+    """
+    return timestamp, timestamp + max(build.get('duration') or 0, 0)
+
+
+def trigger_time(upstream_times, start):
+    """Get when a build was triggered, see the comment above.
+
+    upstream_times is the start and end of its upstream build, or None if
+    that isn't stored. start is the start of the build. Returns None if
+    the wait before the build started isn't known.
+    """
+    if upstream_times is None or upstream_times[1] > start:
+        return None
+    return upstream_times[1]
+
+
+def percentile(values, p):
+    """Nearest rank percentile of a sorted list."""
+    if not values:
+        return None
+    return values[min(len(values) - 1,
+                      max(0, int(round(p / 100.0 * len(values))) - 1))]
+
+
+def split_time(path, start, end):
+    """Split the time from start to end by what the critical path was doing.
+
+    path is a list of (triggered, start, end) tuples, triggered may be
+    None. Returns the seconds when a build was executing, when one was
+    queued but none executing, and when neither.
+    """
+    events = []
+    for triggered, started, finished in path:
+        if triggered is not None:
+            events.append((triggered, 'queued', 1))
+            events.append((started, 'queued', -1))
+        events.append((started, 'executing', 1))
+        events.append((finished, 'executing', -1))
+    events.sort(key=lambda event: (event[0], event[2]))
+    counts = dict(queued=0, executing=0)
+    totals = dict(queued=0.0, executing=0.0, other=0.0)
+    previous = start
+    for time, state, delta in events + [(end, None, 0)]:
+        time = min(max(time, start), end)
+        if counts['executing']:
+            totals['executing'] += time - previous
+        elif counts['queued']:
+            totals['queued'] += time - previous
+        else:
+            totals['other'] += time - previous
+        previous = time
+        if state is not None:
+            counts[state] += delta
+    return totals
+
+
+class PipelineGraph(object):
+    """Graph of upstream and downstream builds, see the comment above.
+
+    Kept up to date as builds are added to and removed from a store.
+    """
+
+    def __init__(self):
+        # node key to the hierachy entry (name, build_num and url) of an
+        # upstream node, stored builds use their own entry
+        self.nodes = {}
+        # node key to {parent or child key: number of builds linking them}
+        self.parents = {}
+        self.children = {}
+        # node key to the stored build of the node, its epoch timestamp and
+        # its own hierachy entry
+        self.builds = {}
+        # node key to the cause of a root node, eg a push or timer trigger
+        self.causes = {}
+
+    def chain(self, build):
+        """Get the entries of a build hierachy that are nodes.
+
+        Entries without a build number are causes, such as pushes, rather
+        than builds. Returns the cause before the first node, if any, and
+        a list of (key, entry) tuples.
+        """
+        cause = None
+        chain = []
+        for entry in build.get('build_hierachy') or []:
+            if entry.get('build_num') in (None, ''):
+                if not chain:
+                    cause = entry['name']
+                continue
+            key = node_key(entry)
+            if not entry['name'].startswith('PR: '):
+                entry = dict(entry, name=key[0])
+            chain.append((key, entry))
+        key = (build['job_name'], str(build['build_num']))
+        if not chain or chain[-1][0] != key:
+            chain.append((key, dict(name=build['job_name'],
+                                    build_num=str(build['build_num']),
+                                    url=None)))
+        return cause, chain
+
+    def link(self, parent, child, delta):
+        for links, node, other in ((self.children, parent, child),
+                                   (self.parents, child, parent)):
+            counts = links.setdefault(node, {})
+            counts[other] = counts.get(other, 0) + delta
+            if not counts[other]:
+                del counts[other]
+                if not counts:
+                    del links[node]
+
+    def add(self, build, timestamp):
+        """Add a build, a build serialisation dict.
+
+        timestamp is the start of the build in epoch seconds.
+        """
+        cause, chain = self.chain(build)
+        for key, entry in chain[:-1]:
+            self.nodes.setdefault(key, entry)
+        for (parent, _), (child, _) in zip(chain, chain[1:]):
+            self.link(parent, child, 1)
+        if cause is not None:
+            self.causes[chain[0][0]] = cause
+        key, entry = chain[-1]
+        self.builds[key] = (build, timestamp, entry)
+
+    def remove(self, build):
+        cause, chain = self.chain(build)
+        self.builds.pop(chain[-1][0], None)
+        for (parent, _), (child, _) in zip(chain, chain[1:]):
+            self.link(parent, child, -1)
+        for key, _ in chain:
+            if key not in self.parents and key not in self.children:
+                self.nodes.pop(key, None)
+                if key not in self.builds:
+                    self.causes.pop(key, None)
+
+    def parent(self, key):
+        parents = self.parents.get(key)
+        if not parents:
+            return None
+        # builds have one chain of upstream causes, so nodes normally have
+        # one parent, use the most common if chains disagree.
+        return max(sorted(parents), key=lambda parent: parents[parent])
+
+    def entry(self, key):
+        if key in self.builds:
+            return self.builds[key][2]
+        return self.nodes[key]
+
+    def roots(self):
+        return [key for key in set(self.nodes) | set(self.builds)
+                if self.parent(key) is None]
+
+    def tree(self, root):
+        """Get the keys of a node and its descendants, parents first."""
+        keys = [root]
+        seen = set(keys)
+        for key in keys:
+            for child in sorted(self.children.get(key, ())):
+                if child not in seen and self.parent(child) == key:
+                    seen.add(child)
+                    keys.append(child)
+        return keys
+
+    def times(self, key):
+        """Get the triggered, start and end epoch times of a stored build.
+
+        The build is triggered by its parent, see trigger_time.
+        """
+        start, end = build_times(*self.builds[key][:2])
+        parent = self.parent(key)
+        upstream_times = None
+        if parent in self.builds:
+            upstream_times = build_times(*self.builds[parent][:2])
+        return trigger_time(upstream_times, start), start, end
+
+    def hop(self, key, times):
+        """Get a row for a node on a critical path.
+
+        times is a dict of the times of the stored builds of the pipeline.
+        """
+        entry = self.entry(key)
+        row = dict(name=entry['name'], build_num=key[1], url=entry['url'])
+        if key not in times:
+            return row
+        triggered, started, finished = times[key]
+        build = self.builds[key][0]
+        row.update(
+            id=build['id'],
+            result=build.get('result'),
+            triggered=(None if triggered is None
+                       else datetime.datetime.fromtimestamp(triggered)),
+            started=datetime.datetime.fromtimestamp(started),
+            finished=datetime.datetime.fromtimestamp(finished),
+            queued=None if triggered is None else started - triggered,
+            executing=finished - started)
+        return row
+
+    def pipeline(self, root):
+        """Get the latency and critical path of the pipeline below a root.
+
+        Returns None if none of the builds in the pipeline are stored.
+        """
+        keys = self.tree(root)
+        times = {key: self.times(key) for key in keys if key in self.builds}
+        if not times:
+            return None
+        start = min(started for _, started, _ in times.values())
+        depth = {root: 0}
+        for key in keys[1:]:
+            depth[key] = depth[self.parent(key)] + 1
+        # the last build to finish, the deepest if several finish together
+        last = max(times, key=lambda key: (times[key][2], depth[key], key))
+        end = times[last][2]
+        path = [last]
+        while path[-1] != root:
+            path.append(self.parent(path[-1]))
+        path.reverse()
+        hops = [self.hop(key, times) for key in path]
+        split = split_time([times[key] for key in path if key in times],
+                           start, end)
+        root_entry = self.entry(root)
+        return dict(
+            root=root_entry['name'],
+            root_url=root_entry['url'],
+            cause=self.causes.get(root),
+            started=datetime.datetime.fromtimestamp(start),
+            finished=datetime.datetime.fromtimestamp(end),
+            latency=end - start,
+            queued=split['queued'],
+            executing=split['executing'],
+            other=split['other'],
+            builds=len(times),
+            failed=sum(1 for key in times
+                       if self.builds[key][0].get('result') != 'SUCCESS'),
+            critical_path=hops)
+
+    def pipelines(self):
+        """Get every pipeline, most recently finished first."""
+        pipelines = filter(None, (self.pipeline(root)
+                                  for root in self.roots()))
+        return sorted(pipelines, key=lambda row: (row['finished'],
+                                                  row['root']),
+                      reverse=True)
+
+    def report(self, limit=LIMIT):
+        """Get the most recent pipelines, and a summary of each kind.
+
+        Pipelines are grouped by the job of their root, or PR for PRs.
+        Summary rows have latency percentiles and the fractions of the
+        latency of critical paths spent executing, queued and otherwise.
+        """
+        pipelines = self.pipelines()
+        groups = {}
+        for row in pipelines:
+            name = 'PR' if row['root'].startswith('PR: ') else row['root']
+            groups.setdefault(name, []).append(row)
+        summary = []
+        for name, rows in groups.items():
+            latencies = sorted(row['latency'] for row in rows)
+            total = sum(latencies)
+            summary_row = dict(root=name, count=len(rows))
+            for p in PERCENTILES:
+                summary_row['p{}'.format(p)] = percentile(latencies, p)
+            for part in ('executing', 'queued', 'other'):
+                summary_row[part] = (sum(row[part] for row in rows) / total
+                                     if total else None)
+            summary.append(summary_row)
+        summary.sort(key=lambda row: (-row['count'], row['root']))
+        return dict(summary=summary, pipelines=pipelines[:limit])
@@ -0,0 +1,117 @@
+# Stdlib import
+import hashlib
+import json
+import os
+
+# Project imports
+from store import to_datetime
+
+# The web UI can read build data as per day shards rather than one data
+# file. A manifest lists the shards with a hash of their content, so the UI
+# can fetch only the days it displays, and browsers can cache shards that
+# haven't changed between runs.
+
+MANIFEST = 'manifest.json'
+SHARD_DIR = 'shards'
+
+
+def shard_day(build):
+    """Return the day a build belongs to, as an iso format date string."""
+    return to_datetime(build['timestamp']).date().isoformat()
+
+
+def split_days(data):
+    """Split exported build data into a dict of day to shard dict."""
+    shards = {}
+    for id, build in data['builds'].items():
+        shard = shards.setdefault(shard_day(build),
+                                  dict(builds={}, failures={}))
+        shard['builds'][id] = build
+        for failure_id in build['failures']:
+            shard['failures'][failure_id] = data['failures'][failure_id]
+    return shards
+
+
+def read_manifest(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_file(path, content):
+    """Write a file by renaming a temporary file into place.
+
+    The web server may be reading the published files while they are
+    written, this ensures a partial file is never served. The file and
+    the rename are synced to disk before returning, so that a file that
+    replaces a journal (see journal.py) is durable before the journal is
+    removed.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+    fsync_dir(os.path.dirname(path) or '.')
+
+
+def fsync_dir(path):
+    """Sync a directory to disk, making renames within it durable."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def publish_shards(data, directory, serialise, encode=None, **fields):
+    """Write per day shards of data, and a manifest of the shards.
+
+    Shards are only written when their content has changed since the last
+    run, and shards for days that no longer have any builds are removed.
+    If encode is given, each shard is passed through it before being
+    serialised. Extra fields (eg timestamp) are added to the manifest.
+    Returns a tuple of the number of shards written and removed.
+    """
+    shard_dir = os.path.join(directory, SHARD_DIR)
+    if not os.path.isdir(shard_dir):
+        os.makedirs(shard_dir)
+    manifest_path = os.path.join(directory, MANIFEST)
+    previous = read_manifest(manifest_path).get('shards', {})
+
+    shards = {}
+    written = 0
+    for day, shard in split_days(data).items():
+        counts = dict(builds=len(shard['builds']),
+                      failures=len(shard['failures']))
+        if encode is not None:
+            shard = encode(shard)
+        # keys are sorted so that identical shards serialise identically
+        content = serialise(shard, sort_keys=True)
+        digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        filename = '{shard_dir}/{day}.json'.format(shard_dir=SHARD_DIR,
+                                                   day=day)
+        path = os.path.join(directory, filename)
+        if (previous.get(day, {}).get('hash') != digest
+                or not os.path.exists(path)):
+            write_file(path, content)
+            written += 1
+        shards[day] = dict(counts, file=filename, hash=digest)
+
+    removed = 0
+    for day, entry in previous.items():
+        if day not in shards:
+            try:
+                os.remove(os.path.join(directory, entry['file']))
+                removed += 1
+            except (OSError, KeyError):
+                pass
+
+    # The manifest is written last, so that it never refers to a shard
+    # that hasn't been written yet.
+    manifest = dict(fields, shards=shards)
+    write_file(manifest_path, serialise(manifest, sort_keys=True))
+    return written, removed
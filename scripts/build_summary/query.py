@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+# Stdlib import
+import bisect
+import collections
+import json
+import os
+
+# 3rd Party imports
+import click
+import dateutil.parser
+
+# Project imports
+import compact
+from journal import apply_entries, Journal, journal_path
+from pipeline import PipelineGraph
+from publish import MANIFEST, read_manifest
+from sketch import format_seconds
+from store import to_datetime, to_epoch
+
+# Ad hoc queries of build summary data, for analysis in a notebook or from
+# the command line.
+#
+# Builds are indexed once into day buckets, each sorted by timestamp, and
+# by the values of the build and failure attributes that queries filter
+# and group by. Range queries only visit the buckets of the days in the
+# range, and filters intersect the sets of ids with each value rather than
+# testing every build.
+#
+# Data can be read from a data file (replaying its journal), or from the
+# per day shards published next to it. Shards are loaded as queries need
+# the days they cover, so a query of the last few days doesn't read the
+# whole retention period.
+#
+# The pipelines command reports the end to end latency of pipelines of
+# upstream and downstream builds, see pipeline.py.
+
+BUILD_ATTRIBUTES = ['repo', 'branch', 'stage', 'job_name', 'result']
+FAILURE_ATTRIBUTES = ['category', 'type']
+# Columns that builds and failures can be grouped by
+BUILD_COLUMNS = ['day'] + BUILD_ATTRIBUTES
+FAILURE_COLUMNS = BUILD_COLUMNS + FAILURE_ATTRIBUTES
+
+
+def read_data(path):
+    """Read a data file, and replay the journal of changes to it.
+
+    Returns a dict of builds and failures keyed by id, as returned by
+    Store.export.
+    """
+    data = dict(builds={}, failures={})
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            data = json.load(f)
+    if compact.is_compact(data):
+        data = compact.decode(data)
+    return apply_entries(data, Journal(journal_path(path)).replay())
+
+
+def as_list(values):
+    if isinstance(values, (list, tuple, set, frozenset)):
+        return values
+    return [values]
+
+
+class ShardSource(object):
+    """Loads the shards listed in a manifest as they are needed."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.shards = read_manifest(
+            os.path.join(directory, MANIFEST)).get('shards', {})
+        self.days = sorted(self.shards)
+        self.loaded = set()
+
+    def load(self, index, start=None, end=None):
+        """Add the shards of the days from start to end to an index."""
+        lo = 0 if start is None else bisect.bisect_left(
+            self.days, start.date().isoformat())
+        hi = len(self.days) if end is None else bisect.bisect_right(
+            self.days, end.date().isoformat())
+        for day in self.days[lo:hi]:
+            if day in self.loaded:
+                continue
+            with open(os.path.join(self.directory,
+                                   self.shards[day]['file'])) as f:
+                data = json.load(f)
+            if compact.is_compact(data):
+                data = compact.decode(data)
+            index.add(data)
+            self.loaded.add(day)
+
+
+class SummaryIndex(object):
+    """Time bucketed and attribute indexes of build summary data.
+
+    Queries take an optional range of datetimes, start is inclusive and
+    end exclusive, and filters of attribute names to a value or a list of
+    values. Filters on build attributes apply to failures through their
+    build.
+    """
+
+    def __init__(self, source=None):
+        self.builds = {}
+        self.failures = {}
+        # build id to epoch timestamp and to day
+        self.epochs = {}
+        self.build_days = {}
+        # day to a sorted list of (epoch timestamp, build id)
+        self.days = {}
+        self.day_keys = []
+        # attribute to {value: set of ids}
+        self.build_index = {attr: {} for attr in BUILD_ATTRIBUTES}
+        self.failure_index = {attr: {} for attr in FAILURE_ATTRIBUTES}
+        self.source = source
+
+    def add(self, data):
+        """Index exported build data."""
+        new_days = set()
+        for id, build in data['builds'].items():
+            if id in self.builds:
+                continue
+            timestamp = to_datetime(build['timestamp'])
+            epoch = to_epoch(timestamp)
+            day = timestamp.date().isoformat()
+            self.builds[id] = build
+            self.epochs[id] = epoch
+            self.build_days[id] = day
+            if day not in self.days:
+                self.days[day] = []
+                new_days.add(day)
+            bisect.insort(self.days[day], (epoch, id))
+            for attr, values in self.build_index.items():
+                values.setdefault(build.get(attr), set()).add(id)
+            for failure_id in build['failures']:
+                failure = data['failures'].get(failure_id)
+                if failure is None:
+                    continue
+                self.failures[failure_id] = failure
+                for attr, values in self.failure_index.items():
+                    values.setdefault(failure.get(attr), set()).add(
+                        failure_id)
+        if new_days:
+            self.day_keys = sorted(self.days)
+
+    def ensure(self, start=None, end=None):
+        """Load the data for a range, if it is read lazily."""
+        if self.source is not None:
+            self.source.load(self, start, end)
+
+    def matching(self, index, filters):
+        """Intersect the ids with each filtered attribute value."""
+        ids = None
+        for attr, values in sorted(filters.items(),
+                                   key=lambda item: len(as_list(item[1]))):
+            if attr not in index:
+                raise ValueError("Can't filter by {}".format(attr))
+            matches = set()
+            for value in as_list(values):
+                matches.update(index[attr].get(value, ()))
+            ids = matches if ids is None else ids & matches
+            if not ids:
+                break
+        return ids
+
+    def build_ids(self, start=None, end=None, **filters):
+        """Get the ids of matching builds, in time order."""
+        self.ensure(start, end)
+        ids = self.matching(self.build_index, filters)
+        lo = None if start is None else to_epoch(start)
+        hi = None if end is None else to_epoch(end)
+        if ids is not None:
+            # filtered builds are usually fewer than those in the range
+            return sorted(
+                (id for id in ids
+                 if (lo is None or self.epochs[id] >= lo)
+                 and (hi is None or self.epochs[id] < hi)),
+                key=lambda id: (self.epochs[id], id))
+        first = 0 if start is None else bisect.bisect_left(
+            self.day_keys, start.date().isoformat())
+        last = len(self.day_keys) if end is None else bisect.bisect_right(
+            self.day_keys, end.date().isoformat())
+        result = []
+        for day in self.day_keys[first:last]:
+            bucket = self.days[day]
+            # only the first and last days can be partly in the range
+            begin = 0 if lo is None else bisect.bisect_left(bucket, (lo,))
+            stop = len(bucket) if hi is None else bisect.bisect_left(
+                bucket, (hi,))
+            result.extend(id for epoch, id in bucket[begin:stop])
+        return result
+
+    def failure_ids(self, start=None, end=None, **filters):
+        """Get the ids of matching failures, in time order of builds."""
+        build_filters = {attr: values for attr, values in filters.items()
+                         if attr not in self.failure_index}
+        failure_filters = {attr: values for attr, values in filters.items()
+                           if attr in self.failure_index}
+        self.ensure(start, end)
+        ids = self.matching(self.failure_index, failure_filters)
+        if (ids is not None and start is None and end is None
+                and not build_filters):
+            return sorted(ids, key=lambda id: (
+                self.epochs[self.failures[id]['build']], id))
+        result = []
+        for build_id in self.build_ids(start, end, **build_filters):
+            for failure_id in self.builds[build_id]['failures']:
+                if (failure_id in self.failures
+                        and (ids is None or failure_id in ids)):
+                    result.append(failure_id)
+        return result
+
+    def builds_in(self, start=None, end=None, **filters):
+        return [self.builds[id]
+                for id in self.build_ids(start, end, **filters)]
+
+    def failures_in(self, start=None, end=None, **filters):
+        return [self.failures[id]
+                for id in self.failure_ids(start, end, **filters)]
+
+    def value(self, build_id, failure, column):
+        if column == 'day':
+            return self.build_days[build_id]
+        if column in self.failure_index:
+            return failure[column]
+        return self.builds[build_id].get(column)
+
+    def count(self, kind, by, start=None, end=None, **filters):
+        """Count builds or failures grouped by some columns.
+
+        kind is 'builds' or 'failures', by is a list of column names from
+        BUILD_COLUMNS, or FAILURE_COLUMNS for failures. Returns a Counter
+        of tuples of column values.
+        """
+        columns = BUILD_COLUMNS if kind == 'builds' else FAILURE_COLUMNS
+        for column in by:
+            if column not in columns:
+                raise ValueError("Can't group {} by {}".format(kind, column))
+        if kind == 'builds':
+            return collections.Counter(
+                tuple(self.value(id, None, column) for column in by)
+                for id in self.build_ids(start, end, **filters))
+        counts = collections.Counter()
+        for id in self.failure_ids(start, end, **filters):
+            failure = self.failures[id]
+            counts[tuple(self.value(failure['build'], failure, column)
+                         for column in by)] += 1
+        return counts
+
+    def top(self, kind, by, limit=10, start=None, end=None, **filters):
+        """Get the most common groups, as (column values, count) tuples."""
+        return self.count(kind, by, start, end, **filters).most_common(limit)
+
+
+def load(path):
+    """Index a data file, or the shards in a directory as they are needed."""
+    if os.path.isdir(path):
+        return SummaryIndex(ShardSource(path))
+    index = SummaryIndex()
+    index.add(read_data(path))
+    return index
+
+
+def parse_filters(where):
+    filters = {}
+    for condition in where:
+        attr, sep, value = condition.partition('=')
+        if not sep:
+            raise click.BadParameter(
+                "expected attribute=value: {}".format(condition))
+        filters.setdefault(attr, []).append(value)
+    return filters
+
+
+def parse_range(start, end):
+    return (dateutil.parser.parse(start) if start else None,
+            dateutil.parser.parse(end) if end else None)
+
+
+def query_options(f):
+    options = [
+        click.argument('path'),
+        click.option('--start', default=None,
+                     help='Only builds at or after this date and time'),
+        click.option('--end', default=None,
+                     help='Only builds before this date and time'),
+        click.option('--where', multiple=True,
+                     help='attribute=value filter, may be repeated. Values'
+                          ' of the same attribute are alternatives'),
+        click.option('--failures', 'kind', flag_value='failures',
+                     help='Query failures'),
+        click.option('--builds', 'kind', flag_value='builds', default=True,
+                     help='Query builds (the default)'),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return f
+
+
+@click.group(help='Query build summary data. PATH is a data file, or a'
+                  ' directory of published shards')
+def query():
+    pass
+
+
+@query.command(help='Count builds or failures, grouped by columns')
+@query_options
+@click.option('--by', multiple=True,
+              help='Column to group by, may be repeated. One of: {}'
+                   .format(', '.join(FAILURE_COLUMNS)))
+@click.option('--limit', default=None, type=int,
+              help='Only show the largest groups')
+def count(path, start, end, where, kind, by, limit):
+    start, end = parse_range(start, end)
+    try:
+        counts = load(path).count(kind, list(by), start, end,
+                                  **parse_filters(where))
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    for values, total in counts.most_common(limit):
+        print("\t".join([str(total)] + [str(value) for value in values]))
+
+
+@query.command('list', help='List builds or failures')
+@query_options
+def list_items(path, start, end, where, kind):
+    start, end = parse_range(start, end)
+    index = load(path)
+    try:
+        if kind == 'builds':
+            items = index.builds_in(start, end, **parse_filters(where))
+        else:
+            items = index.failures_in(start, end, **parse_filters(where))
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    for item in items:
+        if kind == 'builds':
+            values = [item['timestamp'], item['job_name'], item['build_num'],
+                      item['result']]
+        else:
+            build = index.builds[item['build']]
+            values = [build['timestamp'], build['job_name'],
+                      build['build_num'], item['type'], item['detail']]
+        print("\t".join(str(value) for value in values))
+
+
+def format_fraction(fraction):
+    if fraction is None:
+        return '-'
+    return '{:.0%}'.format(fraction)
+
+
+@query.command(help='Report the end to end latency of pipelines, and the'
+                    ' critical paths of recent pipelines')
+@click.argument('path')
+@click.option('--start', default=None,
+              help='Only builds at or after this date and time')
+@click.option('--end', default=None,
+              help='Only builds before this date and time')
+@click.option('--limit', default=10,
+              help='Number of recent pipelines to show the critical path of')
+def pipelines(path, start, end, limit):
+    start, end = parse_range(start, end)
+    index = load(path)
+    graph = PipelineGraph()
+    for id in index.build_ids(start, end):
+        graph.add(index.builds[id], index.epochs[id])
+    report = graph.report(limit)
+    width = max([len(row['root']) for row in report['summary']] + [4])
+    row_format = '{:<{width}} {:>9} {:>8} {:>8} {:>9} {:>7} {:>7}'
+    print(row_format.format('root', 'pipelines', 'p50', 'p90', 'executing',
+                            'queued', 'other', width=width))
+    for row in report['summary']:
+        print(row_format.format(
+            row['root'], row['count'], format_seconds(row['p50']),
+            format_seconds(row['p90']), format_fraction(row['executing']),
+            format_fraction(row['queued']), format_fraction(row['other']),
+            width=width))
+    for row in report['pipelines']:
+        print()
+        print("{} ({}) finished {} latency {} executing {} queued {}".format(
+            row['root'], row['cause'] or '-', row['finished'],
+            format_seconds(row['latency']), format_seconds(row['executing']),
+            format_seconds(row['queued'])))
+        for hop in row['critical_path']:
+            if 'started' not in hop:
+                print("  {} {}".format(hop['name'], hop['build_num']))
+                continue
+            print("  {} {} {}: queued {} executing {}"
+                  .format(hop['name'], hop['build_num'], hop['result'],
+                          format_seconds(hop['queued']),
+                          format_seconds(hop['executing'])))
+
+
+if __name__ == '__main__':
+    query()
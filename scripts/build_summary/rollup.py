@@ -0,0 +1,44 @@
+# Stdlib import
+import collections
+
+# Project imports
+from publish import shard_day
+
+# Rollups are counts of builds and failures grouped by day and the
+# attributes the web UI charts and tables are grouped by. The UI reads
+# these rather than counting raw builds and failures on every render.
+# Each rollup is a dict of column names and rows, the last column of each
+# row is the count.
+
+BUILD_COLUMNS = ['day', 'repo', 'branch', 'stage', 'job_name', 'result']
+FAILURE_COLUMNS = ['day', 'repo', 'job_name', 'category', 'type']
+
+
+def rollup(items, columns):
+    counts = collections.Counter(
+        tuple(item[column] for column in columns) for item in items)
+    # rows are sorted so the rollup file only changes when counts change,
+    # values may be None so are compared as strings.
+    return dict(
+        columns=columns + ['count'],
+        rows=sorted((list(key) + [count] for key, count in counts.items()),
+                    key=lambda row: [str(value) for value in row]))
+
+
+def rollups(data):
+    """Count builds and failures from exported build data."""
+    builds = []
+    failures = []
+    for build in data['builds'].values():
+        row = dict(build, day=shard_day(build))
+        builds.append(row)
+        for failure_id in build['failures']:
+            failure = data['failures'][failure_id]
+            failures.append(dict(
+                day=row['day'],
+                repo=build['repo'],
+                job_name=build['job_name'],
+                category=failure['category'],
+                type=failure['type']))
+    return dict(builds=rollup(builds, BUILD_COLUMNS),
+                failures=rollup(failures, FAILURE_COLUMNS))
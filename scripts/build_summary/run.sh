@@ -2,4 +2,9 @@
 
 export LC_ALL=C.UTF-8
 export LANG=C.UTF-8
-python3 build_summary_gh.py --jsonfile /out/data.json /in
+python3 build_summary_gh.py \
+  --store sqlite \
+  --dbfile /cache/summary.db \
+  --jsonfile /out/data.json \
+  --report /cache/scan_report.json \
+  /in
@@ -0,0 +1,447 @@
+# Stdlib import
+import re
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+# Project imports
+from instrument import clock, cpu_clock
+from logblocks import ends_line, line_count, window_lines
+from taskindex import TaskIndex
+
+# Failure classes declare which occurrence of their patterns they are
+# interested in. The scanner uses this to decide when a class can stop
+# receiving hits.
+MATCH_FIRST = "first"
+MATCH_LAST = "last"
+MATCH_ALL = "all"
+
+terminator_re = re.compile(b'[\r\n]')
+
+
+def required_literals(pattern):
+    """Find literal strings, one of which must appear in any match.
+
+    Returns a list of strings, or None if no useful literal could be
+    extracted from the pattern. The literals are used to build a cheap
+    prefilter, the full pattern is still run against candidate lines.
+    """
+    if pattern.flags & re.IGNORECASE:
+        return None
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+    return _sequence_literals(list(parsed))
+
+
+def _sequence_literals(items):
+    # Each option is a list of alternative literals, any match of the
+    # sequence contains at least one literal from every option.
+    options = []
+    run = []
+    for op, av in items + [(None, None)]:
+        if op == sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+        if run:
+            options.append(["".join(run)])
+            run = []
+        if op == sre_parse.SUBPATTERN:
+            # (group, add_flags, del_flags, pattern) or (group, pattern),
+            # literals in a group that ignores case can't be used.
+            if len(av) == 4 and av[1] & re.IGNORECASE:
+                continue
+            sub = _sequence_literals(list(av[-1]))
+            if sub:
+                options.append(sub)
+        elif op == sre_parse.BRANCH:
+            alternatives = []
+            for branch in av[1]:
+                sub = _sequence_literals(list(branch))
+                if not sub:
+                    alternatives = None
+                    break
+                alternatives.extend(sub)
+            if alternatives:
+                options.append(alternatives)
+    if not options:
+        return None
+    # The best option is the one whose shortest literal is longest,
+    # as that gives the most selective prefilter.
+    return max(options, key=lambda o: min(len(s) for s in o))
+
+
+class LogScanner(object):
+    """Single pass scanner for a set of Failure classes.
+
+    The patterns and literals of every class are compiled into one combined
+    prefilter regex. Each log line is tested against the prefilter once,
+    only lines that pass are tested against the individual matchers of each
+    class. Hits are recorded according to each class's match_mode and
+    handed back to the failure instances once the pass is complete, as
+    some classes need context from later in the log to interpret a hit.
+
+    When the prefilter consists only of literals, logs can also be searched
+    as blocks of bytes, forwards or backwards, see search_blocks.
+
+    Searches and deliver take an optional instrument.BuildStats, which
+    records the lines and bytes read, and the time each class spends
+    testing candidate lines and handling hits.
+    """
+
+    def __init__(self, failure_classes):
+        self.classes = []
+        # Scanners for subsets of the classes, see subset
+        self.subsets = {}
+        prefilter = []
+        # Literals of the prefilter, None if it isn't only literals
+        block_literals = []
+        for cls in failure_classes:
+            matchers = []
+            for literal in cls.literals:
+                matchers.append((literal, None))
+                prefilter.append(re.escape(literal))
+                if block_literals is not None:
+                    block_literals.append(literal)
+            for pattern in cls.patterns:
+                compiled = re.compile(pattern)
+                matchers.append((None, compiled))
+                literals = required_literals(compiled)
+                if literals:
+                    prefilter.extend(re.escape(s) for s in literals)
+                    if block_literals is not None:
+                        block_literals.extend(literals)
+                else:
+                    block_literals = None
+                    # No literal could be extracted, so the pattern itself
+                    # has to be part of the prefilter. Named groups are
+                    # removed as names may be repeated across classes.
+                    prefilter.append("(?:{})".format(
+                        re.sub(r'\(\?P<[^>]+>', '(?:', compiled.pattern)))
+            if matchers:
+                self.classes.append((cls, matchers))
+        if prefilter:
+            # Sort so that longer literals are tried first, and remove
+            # duplicates.
+            self.prefilter_re = re.compile("|".join(
+                sorted(set(prefilter), key=lambda p: (-len(p), p))))
+        else:
+            self.prefilter_re = None
+        # Blocks are searched for the prefilter literals and for lines
+        # that may be part of the task index. Literals are matched against
+        # the utf-8 bytes of a block, so they can't span lines.
+        if (self.prefilter_re is not None and block_literals is not None
+                and not any(terminator_re.search(s.encode('utf-8'))
+                            for s in block_literals)):
+            self.block_re = re.compile(b"|".join(
+                [TaskIndex.block_re.pattern]
+                + [re.escape(s.encode('utf-8')) for s in
+                   sorted(set(block_literals), key=lambda s: (-len(s), s))]))
+        else:
+            self.block_re = None
+
+    @staticmethod
+    def match_line(matchers, line):
+        """Return the first hit for a class on a line, or None."""
+        for literal, compiled in matchers:
+            if literal is not None:
+                if literal in line:
+                    return literal
+            else:
+                match = compiled.search(line)
+                if match:
+                    return match
+        return None
+
+    def scan(self, failures, lines, stats=None):
+        """Scan lines for all failures, then deliver the hits."""
+        self.deliver(self.search(failures, lines, stats), stats)
+
+    @staticmethod
+    def test_line(failure, matchers, line, stats=None):
+        """Return a hit for a failure on a line that it accepts, or None."""
+        if stats is None:
+            match = LogScanner.match_line(matchers, line)
+            if match is None or not failure.accept(line, match):
+                return None
+            return match
+        start = clock()
+        cpu_start = cpu_clock()
+        match = LogScanner.match_line(matchers, line)
+        if match is not None and not failure.accept(line, match):
+            match = None
+        stats.add_class(type(failure).__name__, clock() - start,
+                        cpu_clock() - cpu_start, lines=1)
+        return match
+
+    def search(self, failures, lines, stats=None):
+        """Find the hits for each failure in one pass over lines.
+
+        failures is a dict of failure class to failure instance, lines may
+        be any iterable. Returns a dict of failure instance to a list of
+        (line_num, line, match) tuples, in log order. Iteration stops early
+        once every remaining class has found its first hit.
+        """
+        active = [(failures[cls], cls.match_mode, matchers)
+                  for cls, matchers in self.classes
+                  if cls in failures]
+        hits = {failure: [] for failure, mode, matchers in active}
+        if stats is not None:
+            lines = stats.count(lines)
+        if self.prefilter_re is not None:
+            prefilter = self.prefilter_re.search
+            for index, line in enumerate(lines):
+                if not prefilter(line):
+                    continue
+                satisfied = False
+                for failure, mode, matchers in active:
+                    match = self.test_line(failure, matchers, line, stats)
+                    if match is None:
+                        continue
+                    if mode == MATCH_LAST:
+                        hits[failure] = [(index, line, match)]
+                    else:
+                        hits[failure].append((index, line, match))
+                        if mode == MATCH_FIRST:
+                            satisfied = True
+                if satisfied:
+                    active = [a for a in active
+                              if not (a[1] == MATCH_FIRST and hits[a[0]])]
+                    if not active:
+                        # Every class has found what it needs.
+                        break
+        return hits
+
+    def subset(self, classes):
+        """Get a scanner for some of the classes of this scanner."""
+        classes = tuple(classes)
+        if classes not in self.subsets:
+            self.subsets[classes] = LogScanner(classes)
+        return self.subsets[classes]
+
+    def block_lines(self, log_files, reverse=False, stats=None):
+        """Yield (line_num, line) for the lines that match block_re.
+
+        log_files is a list of logblocks.LogFile, lines are yielded in the
+        order they are read. When reading backwards line numbers are
+        negative, counting back from the end of the last file, so that
+        they are still in log order.
+
+        Lines are only counted up to the last line yielded, and when
+        reading forwards the rest of a window is only counted if the caller
+        reads past it. Stats record the lines and bytes up to the furthest
+        position read.
+        """
+        search = self.block_re.search
+        line_num = 0
+        # bytes in the windows before the current one
+        read = 0
+        if reverse:
+            log_files = reversed(log_files)
+        for log_file in log_files:
+            for data, lo, hi in log_file.windows(reverse):
+                if reverse:
+                    count = window_lines(data, lo, hi)
+                    line_num -= count
+                    if stats is not None:
+                        stats.lines += count
+                        stats.bytes += hi - lo
+                lines = []
+                line_start = lo
+                line_pos = line_num
+                match = search(data, lo, hi)
+                while match:
+                    pos = match.start()
+                    start = max(data.rfind(b'\n', line_start, pos),
+                                data.rfind(b'\r', line_start, pos),
+                                line_start - 1) + 1
+                    line_pos += line_count(data, line_start, start)
+                    line_start = start
+                    end = terminator_re.search(data, pos, hi)
+                    end = hi if end is None else end.start()
+                    line = data[start:end].decode('utf-8', 'replace')
+                    if end < hi:
+                        line += '\n'
+                        if data[end:end + 2] == b'\r\n':
+                            end += 1
+                    if reverse:
+                        lines.append((line_pos, line))
+                    else:
+                        if stats is not None:
+                            stats.lines = line_pos + 1
+                            stats.bytes = read + end - lo
+                        yield line_pos, line
+                    match = search(data, end + 1, hi)
+                read += hi - lo
+                if reverse:
+                    for line in reversed(lines):
+                        yield line
+                    continue
+                line_num = line_pos + line_count(data, line_start, hi)
+                if not ends_line(data, hi):
+                    line_num += 1
+                if stats is not None:
+                    stats.lines = line_num
+                    stats.bytes = read
+
+    def search_blocks(self, failures, log_files, task_index, reverse=None,
+                      stats=None):
+        """Find the hits for each failure by searching blocks of the logs.
+
+        Returns the same hits as search does for the lines of log_files, a
+        list of logblocks.LogFile. Only lines that may be of interest are
+        decoded. Lines needed to interpret the hits are added to
+        task_index, it may not include the whole log.
+
+        If reverse is true the logs are read backwards, and reading stops
+        once every class that needs its last hit has one and the tasks
+        those hits occurred in have been read. Otherwise reading stops once
+        every class that needs its first hit has one and the task following
+        each hit has been read.
+
+        If reverse is None, logs are read backwards if every class only
+        needs its last hit, forwards if none do, and otherwise in both
+        directions, see search_split.
+        """
+        if reverse is None:
+            modes = set(cls.match_mode for cls, matchers in self.classes
+                        if cls in failures)
+            if MATCH_LAST in modes and len(modes) > 1:
+                return self.search_split(failures, log_files, task_index,
+                                         stats)
+            reverse = modes == set([MATCH_LAST])
+        return self.search_direction(failures, log_files, task_index,
+                                     reverse, stats)[0]
+
+    def search_direction(self, failures, log_files, task_index, reverse,
+                         stats=None, leave_last=False, limit=None):
+        """Search the logs in one direction, see search_blocks.
+
+        If leave_last is true, reading forwards stops without waiting for
+        the classes that need their last hit. limit is a line number that
+        reading backwards stops at. Returns the hits, and the number of
+        the last line read if reading stopped early, or None.
+        """
+        stop_mode = MATCH_LAST if reverse else MATCH_FIRST
+        active = [(failures[cls], cls.match_mode, matchers)
+                  for cls, matchers in self.classes
+                  if cls in failures]
+        hits = {failure: [] for failure, mode, matchers in active}
+
+        def waiting(active):
+            # the classes that reading can't stop without
+            return [a for a in active
+                    if not (leave_last and a[1] == MATCH_LAST)]
+
+        pending = waiting(active)
+        prefilter = self.prefilter_re.search
+        # Index lines read backwards, added to the index once complete
+        index_lines = []
+        # Whether a hit still needs the task before it, or the play before
+        # that task, when reading backwards.
+        need_task = False
+        need_play = False
+        # The last hit when reading forwards, it needs the following task
+        # to check if it was ignored.
+        last_hit = None
+        stopped = None
+        for line_num, line in self.block_lines(log_files, reverse, stats):
+            if limit is not None and line_num <= limit:
+                stopped = line_num
+                break
+            if active and prefilter(line):
+                satisfied = False
+                for failure, mode, matchers in active:
+                    match = self.test_line(failure, matchers, line, stats)
+                    if match is None:
+                        continue
+                    hit = (line_num, line, match)
+                    if mode == MATCH_ALL:
+                        hits[failure].append(hit)
+                    else:
+                        # Later hits replace earlier ones, unless the
+                        # class stops at the hit it reads first.
+                        hits[failure] = [hit]
+                        satisfied = satisfied or mode == stop_mode
+                    need_task = True
+                    last_hit = line_num
+                if satisfied:
+                    active = [a for a in active
+                              if not (a[1] == stop_mode and hits[a[0]])]
+                    pending = waiting(active)
+            if ('TASK' in line or 'PLAY [' in line
+                    or '...ignoring' in line):
+                if reverse:
+                    index_lines.append((line_num, line))
+                    if need_task and TaskIndex.is_task(line):
+                        need_task = False
+                        need_play = True
+                    if need_play and TaskIndex.is_play(line):
+                        need_play = False
+                else:
+                    task_index.add(line_num, line)
+            if pending:
+                continue
+            # Every class has found what it needs, stop once the context
+            # of the hits has been read.
+            if reverse:
+                if not (need_task or need_play):
+                    stopped = line_num
+                    break
+            elif (last_hit is None
+                  or (task_index.task_lines
+                      and task_index.task_lines[-1] >= last_hit)):
+                stopped = line_num
+                break
+        for line_num, line in reversed(index_lines):
+            task_index.add(line_num, line)
+        if reverse:
+            for failure_hits in hits.values():
+                failure_hits.reverse()
+        return hits, stopped
+
+    def search_split(self, failures, log_files, task_index, stats=None):
+        """Search forwards, then backwards for the last hits of some classes.
+
+        The logs are read forwards until the classes that need their first
+        hit have one, matching every class. If that stops before the end of
+        the logs, the rest is read backwards until the classes that need
+        their last hit have one, so no line is read twice. Lines read
+        backwards are numbered from the end, they are renumbered from the
+        start once the lines in the logs have been counted.
+
+        When some class needs every hit the whole log is read forwards, as
+        the default rules do.
+        """
+        hits, stopped = self.search_direction(
+            failures, log_files, task_index, False, stats, leave_last=True)
+        if stopped is None:
+            return hits
+        total = sum(log_file.lines() for log_file in log_files)
+        tail_index = TaskIndex()
+        tail_hits, _ = self.subset(
+            cls for cls, matchers in self.classes
+            if cls.match_mode == MATCH_LAST).search_direction(
+                failures, log_files, tail_index, True, stats,
+                limit=stopped - total)
+        task_index.extend(tail_index, total)
+        for failure, failure_hits in tail_hits.items():
+            if failure_hits:
+                hits[failure] = [(line_num + total, line, match)
+                                 for line_num, line, match in failure_hits]
+        return hits
+
+    @staticmethod
+    def deliver(hits, stats=None):
+        """Call each failure's on_match method for its hits."""
+        for failure, failure_hits in hits.items():
+            start = clock()
+            cpu_start = cpu_clock()
+            for index, line, match in failure_hits:
+                failure.on_match(index, line, match)
+            if stats is not None:
+                stats.add_class(type(failure).__name__, clock() - start,
+                                cpu_clock() - cpu_start,
+                                matches=len(failure_hits))
@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+# Stdlib import
+import collections
+import gzip
+import hashlib
+import json
+import os
+import socketserver
+import threading
+import time
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# 3rd Party imports
+import click
+import dateutil.parser
+
+# Project imports
+from build_summary_gh import PIPELINES_LIMIT, RECURRING_LIMIT, TESTS_LIMIT
+from journal import journal_path
+from query import SummaryIndex
+from rollup import rollups
+from store import STORES
+
+# HTTP service for build summary data, so that the UI and scripts can ask
+# for the builds and failures they need rather than downloading the whole
+# data file. Only the standard library is used to serve, so the service
+# can be run and load tested anywhere the summary runs.
+#
+# The service reads a store written by build_summary_gh.py. The store is
+# opened read only and read into a snapshot, with the indexes of query.py,
+# and responses are computed from the snapshot, so requests never touch the
+# store. The store files are checked for changes at most every reload
+# interval, and a new snapshot is read when they have changed. Requests
+# are served from the previous snapshot while the new one is read.
+#
+# Each snapshot has a version. The builds added, changed and removed by
+# each new snapshot are kept for a while, so that clients can poll
+# /changes with the cursor of the last snapshot they saw and only receive
+# what changed. Cursors include an id of the service process, cursors from
+# a previous process, or older than the changes kept, get a reset response
+# and should fetch the data again.
+#
+# Responses have strong ETags (a hash of the body), requests with a
+# matching If-None-Match get 304 Not Modified. Bodies are gzipped for
+# clients that accept it. Errors have a json body with the status and a
+# message.
+
+# Page size of the builds and failures endpoints
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+# Number of snapshots whose changes are kept for /changes
+CHANGES_KEPT = 100
+# Bodies smaller than this aren't worth compressing
+GZIP_MIN_SIZE = 1024
+# Number of responses cached for each snapshot
+RESPONSE_CACHE_SIZE = 256
+
+
+def dumps(obj):
+    # keys are sorted so that equal data always has the same ETag
+    return json.dumps(obj, default=str, sort_keys=True)
+
+
+class Snapshot(object):
+    """Build summary data read from a store, and derived views of it."""
+
+    def __init__(self, version, data, recurring, tests, pipelines):
+        self.version = version
+        self.data = data
+        self.index = SummaryIndex()
+        self.index.add(data)
+        self.rollups = rollups(data)
+        self.recurring = recurring
+        self.tests = tests
+        self.pipelines = pipelines
+
+    def build_failures(self, build_ids):
+        failures = self.data['failures']
+        return [failures[id]
+                for build_id in build_ids
+                for id in self.data['builds'][build_id]['failures']
+                if id in failures]
+
+    def changes(self, previous):
+        """Diff the builds of this snapshot with a previous snapshot.
+
+        Returns a tuple of the ids of builds that are new or changed, and
+        of builds that have been removed.
+        """
+        builds = self.data['builds']
+        old_builds = previous.data['builds']
+        changed = set(id for id, build in builds.items()
+                      if old_builds.get(id) != build
+                      or self.build_failures([id])
+                      != previous.build_failures([id]))
+        removed = set(old_builds) - set(builds)
+        return changed, removed
+
+
+class SummaryService(object):
+    """Snapshots of a store, reloaded when the store changes."""
+
+    def __init__(self, store_type, path, reload_interval=10):
+        self.store_type = store_type
+        self.path = path
+        self.reload_interval = reload_interval
+        # identifies this process in cursors
+        self.generation = uuid.uuid4().hex[:8]
+        self.lock = threading.Lock()
+        # held by the thread reading a new snapshot
+        self.reload_lock = threading.Lock()
+        self.snapshot = None
+        self.signature = None
+        self.checked = 0
+        # (version, changed build ids, removed build ids), oldest first
+        self.changelog = collections.deque(maxlen=CHANGES_KEPT)
+        self.responses = collections.OrderedDict()
+
+    def files(self):
+        if self.store_type == 'json':
+            return [self.path, journal_path(self.path)]
+        return [self.path]
+
+    def store_signature(self):
+        signature = []
+        for path in self.files():
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return signature
+
+    def read_snapshot(self, version):
+        store = STORES[self.store_type](self.path, read_only=True)
+        try:
+            return Snapshot(version, store.export(),
+                            store.recurring(RECURRING_LIMIT),
+                            store.tests(TESTS_LIMIT),
+                            store.pipelines().report(PIPELINES_LIMIT))
+        finally:
+            store.close()
+
+    def current(self):
+        """Get the current snapshot, reading the store if it has changed.
+
+        The store is read without holding the lock, other requests get the
+        previous snapshot until the new one is ready.
+        """
+        with self.lock:
+            now = time.time()
+            if (self.snapshot is not None
+                    and now - self.checked < self.reload_interval):
+                return self.snapshot
+            self.checked = now
+            previous = self.snapshot
+        # only one thread reads the store, there is nothing to serve until
+        # the first snapshot is read, so others wait for that one.
+        if not self.reload_lock.acquire(previous is None):
+            return previous
+        try:
+            with self.lock:
+                previous = self.snapshot
+            signature = self.store_signature()
+            if previous is not None and signature == self.signature:
+                return previous
+            version = 1 if previous is None else previous.version + 1
+            try:
+                snapshot = self.read_snapshot(version)
+            except Exception:
+                if previous is None:
+                    raise
+                # eg the store is being rewritten, try again next time
+                print("Failed to read store: {}".format(self.path))
+                traceback.print_exc()
+                return previous
+            changes = None
+            if previous is not None:
+                changes = snapshot.changes(previous)
+            with self.lock:
+                if changes is not None:
+                    self.changelog.append((version,) + changes)
+                self.snapshot = snapshot
+                self.signature = signature
+                self.responses.clear()
+            return snapshot
+        finally:
+            self.reload_lock.release()
+
+    def cursor(self, snapshot):
+        return '{}:{}'.format(self.generation, snapshot.version)
+
+    def changes_since(self, snapshot, cursor):
+        """Get the changes between the snapshot of a cursor and snapshot.
+
+        Returns None if they aren't known.
+        """
+        generation, sep, version = (cursor or '').partition(':')
+        if generation != self.generation or not version.isdigit():
+            return None
+        version = int(version)
+        if version == snapshot.version:
+            return set(), set()
+        # changes of the versions after the cursor, up to the snapshot
+        entries = [entry for entry in list(self.changelog)
+                   if version < entry[0] <= snapshot.version]
+        if len(entries) != snapshot.version - version:
+            return None
+        changed = set()
+        removed = set()
+        for entry_version, entry_changed, entry_removed in entries:
+            changed = (changed - entry_removed) | entry_changed
+            removed = (removed - entry_changed) | entry_removed
+        return changed, removed
+
+    def cached_response(self, key, compute):
+        """Get a response body for the current snapshot, computing it once.
+
+        Returns a tuple of the body and its ETag.
+        """
+        with self.lock:
+            if key in self.responses:
+                self.responses.move_to_end(key)
+                return self.responses[key]
+        body = dumps(compute()).encode('utf-8')
+        response = (body, '"{}"'.format(hashlib.sha1(body).hexdigest()))
+        with self.lock:
+            self.responses[key] = response
+            while len(self.responses) > RESPONSE_CACHE_SIZE:
+                self.responses.popitem(last=False)
+        return response
+
+
+def parse_params(query):
+    """Parse query parameters into a dict of name to a list of values."""
+    return parse_qs(query, keep_blank_values=False)
+
+
+def single(params, name, default=None):
+    values = params.pop(name, None)
+    return values[-1] if values else default
+
+
+def page_params(params):
+    try:
+        offset = max(0, int(single(params, 'offset', 0)))
+        limit = int(single(params, 'limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise BadRequest("offset and limit must be integers")
+    return offset, max(1, min(limit, MAX_LIMIT))
+
+
+def range_params(params):
+    try:
+        start = single(params, 'start')
+        end = single(params, 'end')
+        return (dateutil.parser.parse(start) if start else None,
+                dateutil.parser.parse(end) if end else None)
+    except ValueError:
+        raise BadRequest("start and end must be dates")
+
+
+def page(ids, lookup, offset, limit):
+    return dict(items=[lookup[id] for id in ids[offset:offset + limit]],
+                total=len(ids),
+                offset=offset,
+                limit=limit,
+                next=offset + limit if offset + limit < len(ids) else None)
+
+
+class BadRequest(Exception):
+    pass
+
+
+def builds_endpoint(service, snapshot, params):
+    offset, limit = page_params(params)
+    start, end = range_params(params)
+    try:
+        ids = snapshot.index.build_ids(start, end, **params)
+    except ValueError as e:
+        raise BadRequest(str(e))
+    return page(ids, snapshot.data['builds'], offset, limit)
+
+
+def failures_endpoint(service, snapshot, params):
+    offset, limit = page_params(params)
+    start, end = range_params(params)
+    try:
+        ids = snapshot.index.failure_ids(start, end, **params)
+    except ValueError as e:
+        raise BadRequest(str(e))
+    return page(ids, snapshot.data['failures'], offset, limit)
+
+
+def rollups_endpoint(service, snapshot, params):
+    return snapshot.rollups
+
+
+def recurring_endpoint(service, snapshot, params):
+    return dict(failures=snapshot.recurring)
+
+
+def tests_endpoint(service, snapshot, params):
+    return snapshot.tests
+
+
+def pipelines_endpoint(service, snapshot, params):
+    return snapshot.pipelines
+
+
+def changes_endpoint(service, snapshot, params):
+    cursor = single(params, 'since')
+    changes = service.changes_since(snapshot, cursor)
+    if changes is None:
+        # the client needs to fetch everything again
+        return dict(cursor=service.cursor(snapshot), reset=True)
+    changed, removed = changes
+    ids = sorted(id for id in changed if id in snapshot.data['builds'])
+    return dict(cursor=service.cursor(snapshot),
+                reset=False,
+                builds=[snapshot.data['builds'][id] for id in ids],
+                failures=snapshot.build_failures(ids),
+                removed=sorted(removed))
+
+
+def index_endpoint(service, snapshot, params):
+    return dict(endpoints=sorted(ENDPOINTS),
+                cursor=service.cursor(snapshot),
+                builds=len(snapshot.data['builds']),
+                failures=len(snapshot.data['failures']))
+
+
+ENDPOINTS = {
+    '/': index_endpoint,
+    '/builds': builds_endpoint,
+    '/failures': failures_endpoint,
+    '/rollups': rollups_endpoint,
+    '/recurring': recurring_endpoint,
+    '/tests': tests_endpoint,
+    '/pipelines': pipelines_endpoint,
+    '/changes': changes_endpoint,
+}
+
+
+class SummaryHandler(BaseHTTPRequestHandler):
+    """Serves the endpoints of a SummaryService, see ENDPOINTS."""
+
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        endpoint = ENDPOINTS.get(url.path.rstrip('/') or '/')
+        if endpoint is None:
+            return self.send_json_error(404, "Unknown endpoint")
+        try:
+            snapshot = self.service.current()
+        except Exception:
+            traceback.print_exc()
+            return self.send_json_error(503, "Failed to read store")
+        params = parse_params(url.query)
+        # responses only depend on the snapshot and the request
+        key = (snapshot.version, url.path, tuple(sorted(
+            (name, tuple(values)) for name, values in params.items())))
+        try:
+            body, etag = self.service.cached_response(
+                key, lambda: endpoint(self.service, snapshot, params))
+        except BadRequest as e:
+            return self.send_json_error(400, str(e))
+        except Exception:
+            traceback.print_exc()
+            return self.send_json_error(500, "Internal error")
+        gzipped = (len(body) >= GZIP_MIN_SIZE and 'gzip' in
+                   self.headers.get('Accept-Encoding', ''))
+        if gzipped:
+            # each representation has its own strong ETag
+            etag = etag[:-1] + '-gzip"'
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
+        if gzipped:
+            body = gzip.compress(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Cache-Control', 'no-cache')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json_error(self, status, message):
+        body = dumps(dict(status=status, error=message)).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags
+
+
+class SummaryServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_server(service, host, port):
+    handler = type('Handler', (SummaryHandler,), dict(service=service))
+    return SummaryServer((host, port), handler)
+
+
+@click.command(help='Serve build summary data over HTTP')
+@click.option('--jsonfile', default='/opt/jenkins/www/.cache',
+              help='Data file of the json store')
+@click.option('--store', 'store_type', default='json',
+              type=click.Choice(sorted(STORES.keys())),
+              help='Backend the build summary data is stored in')
+@click.option('--dbfile', default='/opt/jenkins/www/summary.db',
+              help='Database file of the sqlite store')
+@click.option('--host', default='127.0.0.1', help='Address to listen on')
+@click.option('--port', default=8080, help='Port to listen on')
+@click.option('--reload-interval', default=10,
+              help='Minimum seconds between checks for changes to the'
+                   ' store')
+def serve(jsonfile, store_type, dbfile, host, port, reload_interval):
+    path = jsonfile if store_type == 'json' else dbfile
+    service = SummaryService(store_type, path, reload_interval)
+    service.current()
+    server = make_server(service, host, port)
+    print("Serving {path} on http://{host}:{port}".format(
+        path=path, host=host, port=server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,136 @@
+# Stdlib import
+import datetime
+import hashlib
+import re
+
+# Project imports
+from cluster import ClusterIndex
+
+# Failure signatures group failures that have the same root cause. The
+# detail of a failure often contains identifiers that differ between
+# builds (uuids, addresses, temp paths, node names), these are replaced so
+# that each occurrence of a failure has the same signature.
+#
+# The signature index maps each signature to the builds it occurred in, and
+# is used to find the failures that recur most often. Signatures are also
+# clustered with others whose details are similar, see cluster.py.
+
+NORMALISERS = [
+    (re.compile(r'[0-9a-fA-F]{8}-(?:[0-9a-fA-F]{4}-){3}[0-9a-fA-F]{12}'),
+     '**UUID**'),
+    (re.compile(r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b'), '**IPv4**'),
+    # ansi escape sequences, eg colour codes
+    (re.compile(r'\x1b\[[0-9;]*[A-Za-z]'), ''),
+    # MaaS api transaction ids, eg .rh-abcd.h-ord1-maas-prod-api0.r-1a2b...
+    (re.compile(r'\.rh-\w+\.h-[\w.-]+'), '**TX_ID**'),
+    (re.compile(r'https?://\S*/entities/\w+'), '**Entity**'),
+    (re.compile(r'(?i)\bhttpd[_-]?tx[_-]?id\W+[\w@.-]+'), '**HTTP_TX_ID**'),
+    (re.compile(r'ansible-tmp-[0-9.-]+'), 'ansible-tmp-**Removed**'),
+    # nodepool nodes and openstack-ansible containers
+    (re.compile(r'\b(?:[a-z0-9]+-)+[0-9]{6,}\b'
+                r'|\b\w+_container-[0-9a-f]{8}\b'), '**node-name**'),
+]
+
+# Identifies the normalisers, signatures stored by a previous version of the
+# normalisers need to be recomputed.
+NORMALISERS_ID = hashlib.sha1(repr(
+    [(pattern.pattern, sub) for pattern, sub in NORMALISERS]
+).encode('utf-8')).hexdigest()[:12]
+
+
+def normalise(detail):
+    """Remove identifiers from a failure detail string."""
+    for pattern, sub in NORMALISERS:
+        detail = pattern.sub(sub, detail)
+    return detail
+
+
+def signature(failure_type, detail):
+    """Get the signature of a failure from its type and detail."""
+    return hashlib.sha1("{}\n{}".format(
+        failure_type, normalise(detail)).encode('utf-8')).hexdigest()[:12]
+
+
+def recurring_row(key, failure, build_times, cluster=None, resembles=0):
+    """Build a row of the top recurring failures table.
+
+    key is a signature, failure is the serialisation dict of a failure with
+    that signature and build_times is a dict of the id to epoch timestamp
+    of each build the signature occurred in. cluster and resembles are as
+    returned by ClusterIndex.resemblance.
+    """
+    return dict(
+        signature=key,
+        cluster=cluster,
+        resembles=resembles,
+        type=failure['type'],
+        category=failure['category'],
+        detail=normalise(failure['detail']),
+        count=len(build_times),
+        first_seen=datetime.datetime.fromtimestamp(
+            min(build_times.values())),
+        last_seen=datetime.datetime.fromtimestamp(
+            max(build_times.values())),
+        # most recent first
+        builds=sorted(build_times, key=lambda id: (-build_times[id], id)))
+
+
+class SignatureIndex(object):
+    """In memory index of failure signature to the builds they occurred in.
+
+    Kept up to date as builds are added to and removed from a store.
+    """
+
+    def __init__(self, minhashes=None):
+        # signature to (an example failure, {build id: epoch timestamp})
+        self.signatures = {}
+        # build id to the signatures of its failures
+        self.build_signatures = {}
+        self.clusters = ClusterIndex()
+        # stored signature to (failure type, MinHash), used instead of
+        # computing the MinHash when the signature is added
+        self.stored_minhashes = minhashes or {}
+
+    def add(self, build_id, timestamp, failures):
+        """Add the failures of a build.
+
+        timestamp is the epoch timestamp of the build, failures is a list
+        of failure serialisation dicts.
+        """
+        self.remove(build_id)
+        signatures = set()
+        for failure in failures:
+            key = signature(failure['type'], failure['detail'])
+            if key not in self.signatures:
+                self.signatures[key] = (failure, {})
+                stored = self.stored_minhashes.pop(key, None)
+                if stored is not None:
+                    self.clusters.add(key, stored[0], values=stored[1])
+                else:
+                    self.clusters.add(key, failure['type'],
+                                      normalise(failure['detail']))
+            self.signatures[key][1][build_id] = timestamp
+            signatures.add(key)
+        if signatures:
+            self.build_signatures[build_id] = signatures
+
+    def remove(self, build_id):
+        for key in self.build_signatures.pop(build_id, ()):
+            failure, build_times = self.signatures[key]
+            build_times.pop(build_id, None)
+            if not build_times:
+                del self.signatures[key]
+                self.clusters.remove(key)
+
+    def top(self, limit=None):
+        """Get rows for the failures that occurred in the most builds."""
+        counts = {key: len(build_times)
+                  for key, (failure, build_times) in self.signatures.items()}
+        keys = sorted(counts, key=lambda key: (-counts[key], key))
+        if limit is not None:
+            keys = keys[:limit]
+        resemblance = self.clusters.resemblance(
+            {key: build_times for key, (failure, build_times)
+             in self.signatures.items()})
+        return [recurring_row(key, *(self.signatures[key] + resemblance[key]))
+                for key in keys]
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+# Stdlib import
+import json
+import math
+
+# 3rd Party imports
+import click
+
+# Project imports
+from build import job_os
+
+# Percentiles of build durations, by job, repo, branch, OS and stage.
+#
+# Values are counted in quantile sketches rather than kept as lists. A
+# sketch counts values in buckets whose bounds grow geometrically, so any
+# quantile it reports is within a relative error of the true value, and
+# its size depends on the range of the values rather than their number
+# (about 500 buckets for one second to ten hours). Counts can be removed
+# as well as added, so sketches are kept up to date as builds are stored
+# and pruned, and sketches of the same metric can be merged by adding
+# their counts, eg to combine the sketches of several jobs or sites.
+#
+# The sketches are published as a json file of bucket counts, that can be
+# read and merged by the report command of this module:
+#   sketch.py report sketches.json [other-site/sketches.json ...]
+
+# Relative error of reported quantiles
+RELATIVE_ACCURACY = 0.01
+# Values below this (eg builds that were aborted at once) are counted
+# together
+MIN_VALUE = 1e-3
+METRICS = ['duration']
+# Build fields that sketches are grouped by, 'all' is every build
+DIMENSIONS = ['all', 'job_name', 'repo', 'branch', 'os', 'stage']
+QUANTILES = [0.5, 0.9, 0.99]
+
+
+class QuantileSketch(object):
+    """Counts of values in geometric buckets, see the comment above."""
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # bucket key to count, bucket k holds values in
+        # (gamma ** (k - 1), gamma ** k]
+        self.buckets = {}
+        # count of values below MIN_VALUE
+        self.zero = 0
+        self.count = 0
+
+    def key(self, value):
+        return int(math.ceil(math.log(value) / self.log_gamma))
+
+    def value(self, key):
+        # the value with the same relative error to both bounds
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        if value < MIN_VALUE:
+            self.zero += count
+        else:
+            key = self.key(value)
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.count += count
+
+    def remove(self, value):
+        self.add(value, -1)
+        if value >= MIN_VALUE and not self.buckets[self.key(value)]:
+            del self.buckets[self.key(value)]
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can't merge sketches with different accuracy")
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zero += other.zero
+        self.count += other.count
+
+    def quantile(self, q):
+        """Estimate a quantile, or None if the sketch is empty."""
+        if self.count <= 0:
+            return None
+        rank = q * (self.count - 1)
+        total = self.zero
+        if total > rank:
+            return 0.0
+        for key in sorted(self.buckets):
+            total += self.buckets[key]
+            if total > rank:
+                return self.value(key)
+        return self.value(max(self.buckets))
+
+    def as_dict(self):
+        keys = sorted(key for key, count in self.buckets.items() if count)
+        # keys are delta encoded, as neighbouring buckets are usually used
+        return dict(keys=[key - previous for key, previous
+                          in zip(keys, [0] + keys[:-1])],
+                    counts=[self.buckets[key] for key in keys],
+                    zero=self.zero)
+
+    @classmethod
+    def from_dict(cls, data, relative_accuracy=RELATIVE_ACCURACY):
+        sketch = cls(relative_accuracy)
+        key = 0
+        for delta, count in zip(data['keys'], data['counts']):
+            key += delta
+            sketch.buckets[key] = count
+        sketch.zero = data['zero']
+        sketch.count = sketch.zero + sum(data['counts'])
+        return sketch
+
+
+def dimension_value(build, dimension):
+    if dimension == 'all':
+        return 'all'
+    if dimension == 'os':
+        return job_os(build['job_name'])
+    return build.get(dimension)
+
+
+class BuildSketches(object):
+    """Sketches of each metric, for each value of each dimension.
+
+    Kept up to date as builds are added to and removed from a store.
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        # metric to {dimension: {value: sketch}}
+        self.sketches = {metric: {dimension: {} for dimension in DIMENSIONS}
+                         for metric in METRICS}
+
+    def update(self, build, remove=False):
+        for metric in METRICS:
+            value = build.get(metric)
+            if value is None:
+                continue
+            for dimension in DIMENSIONS:
+                sketches = self.sketches[metric][dimension]
+                key = dimension_value(build, dimension)
+                if remove:
+                    sketch = sketches.get(key)
+                    if sketch is None:
+                        continue
+                    sketch.remove(value)
+                    if not sketch.count:
+                        del sketches[key]
+                else:
+                    if key not in sketches:
+                        sketches[key] = QuantileSketch(
+                            self.relative_accuracy)
+                    sketches[key].add(value)
+
+    def add(self, build):
+        """Count a build, a build serialisation dict."""
+        self.update(build)
+
+    def remove(self, build):
+        self.update(build, remove=True)
+
+    def merge(self, other):
+        for metric, dimensions in other.sketches.items():
+            for dimension, sketches in dimensions.items():
+                for key, sketch in sketches.items():
+                    mine = self.sketches[metric][dimension]
+                    if key not in mine:
+                        mine[key] = QuantileSketch(self.relative_accuracy)
+                    mine[key].merge(sketch)
+
+    def as_dict(self):
+        return dict(
+            relative_accuracy=self.relative_accuracy,
+            sketches={metric: {dimension: {str(key): sketch.as_dict()
+                                           for key, sketch in
+                                           sketches.items()}
+                               for dimension, sketches in dimensions.items()}
+                      for metric, dimensions in self.sketches.items()})
+
+    @classmethod
+    def from_dict(cls, data):
+        sketches = cls(data['relative_accuracy'])
+        for metric, dimensions in data['sketches'].items():
+            if metric not in METRICS:
+                # eg written by a version with other metrics
+                continue
+            for dimension, values in dimensions.items():
+                sketches.sketches[metric][dimension] = {
+                    key: QuantileSketch.from_dict(
+                        value, data['relative_accuracy'])
+                    for key, value in values.items()}
+        return sketches
+
+    def rows(self, metric, dimension):
+        """Get a row of percentiles for each value of a dimension.
+
+        Rows are sorted by the number of builds, most first.
+        """
+        rows = []
+        for key, sketch in self.sketches[metric][dimension].items():
+            row = dict(value=key, count=sketch.count)
+            for q in QUANTILES:
+                row['p{}'.format(int(q * 100))] = sketch.quantile(q)
+            rows.append(row)
+        return sorted(rows, key=lambda row: (-row['count'], str(row['value'])))
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 60:
+        return '{:.1f}s'.format(seconds)
+    if seconds < 3600:
+        return '{:.1f}m'.format(seconds / 60)
+    return '{:.2f}h'.format(seconds / 3600)
+
+
+@click.group(help='Percentiles of build durations')
+def cli():
+    pass
+
+
+@cli.command(help='Report percentiles from published sketch files.'
+                  ' Sketches from several files are merged')
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--metric', default='duration', type=click.Choice(METRICS),
+              help='Metric to report')
+@click.option('--by', 'dimension', default='job_name',
+              type=click.Choice(DIMENSIONS), help='Field to group builds by')
+@click.option('--limit', default=None, type=int,
+              help='Only show the groups with the most builds')
+def report(paths, metric, dimension, limit):
+    sketches = None
+    for path in paths:
+        with open(path) as f:
+            data = BuildSketches.from_dict(json.load(f))
+        if sketches is None:
+            sketches = data
+        else:
+            sketches.merge(data)
+    rows = sketches.rows(metric, dimension)[:limit]
+    width = max([len(str(row['value'])) for row in rows] + [len(dimension)])
+    print('{:<{width}} {:>7} {:>8} {:>8} {:>8}'.format(
+        dimension, 'builds', 'p50', 'p90', 'p99', width=width))
+    for row in rows:
+        print('{:<{width}} {:>7} {:>8} {:>8} {:>8}'.format(
+            str(row['value']), row['count'], format_seconds(row['p50']),
+            format_seconds(row['p90']), format_seconds(row['p99']),
+            width=width))
+
+
+if __name__ == '__main__':
+    cli()
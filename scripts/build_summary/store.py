@@ -0,0 +1,726 @@
+# Stdlib import
+import datetime
+import json
+import os
+import sqlite3
+import time
+import traceback
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+# 3rd Party imports
+import dateutil.parser
+
+# Project imports
+import compact
+from cluster import (ClusterIndex, MINHASH_ID, minhash_path, pack_minhash,
+                     read_minhashes, unpack_minhash, write_minhashes)
+from journal import apply_entries, Journal, journal_path
+from junit import build_number, test_report, test_row, TestIndex
+from pipeline import PipelineGraph
+from sketch import BuildSketches
+from signature import (normalise, NORMALISERS_ID, recurring_row, signature,
+                       SignatureIndex)
+
+# Build summary data can be stored in different backends. Each backend
+# holds serialisation dicts for builds and failures (as produced by
+# Build.get_serialisation_dict and Failure.get_serialisation_dict), and can
+# export them in the format of the data file read by the web UI.
+
+
+# Formats of timestamps written by str(datetime) and datetime.isoformat()
+TIMESTAMP_FORMATS = ['%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S',
+                     '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S']
+
+
+def to_datetime(timestamp):
+    """Convert a stored timestamp to a datetime.
+
+    Timestamps may be datetimes (newly scanned builds), strings (builds
+    read from a json file) or epoch seconds.
+    """
+    if isinstance(timestamp, datetime.datetime):
+        return timestamp
+    if isinstance(timestamp, (int, float)):
+        return datetime.datetime.fromtimestamp(timestamp)
+    # strptime is much faster than dateutil, for the formats that str and
+    # isoformat produce.
+    for timestamp_format in TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(timestamp, timestamp_format)
+        except ValueError:
+            pass
+    return dateutil.parser.parse(timestamp)
+
+
+def to_epoch(timestamp):
+    """Convert a stored timestamp to epoch seconds.
+
+    Timestamps are naive local times, as produced by
+    datetime.fromtimestamp in Build.
+    """
+    dt = to_datetime(timestamp)
+    return time.mktime(dt.timetuple()) + dt.microsecond / 1e6
+
+
+class Store(object):
+    """Base class for build summary storage backends."""
+
+    def build_keys(self):
+        """Return a set of (job_name, build_num) tuples for stored builds."""
+        raise NotImplementedError
+
+    def build_rules(self):
+        """Return a dict of (job_name, build_num) to the rules of a build.
+
+        The rules are the fingerprints of the failure types the build was
+        scanned with (see Failure.rules), or None if they weren't recorded.
+        """
+        raise NotImplementedError
+
+    def get(self, key):
+        """Return the build dict and failures dict of a stored build.
+
+        key is a (job_name, build_num) tuple.
+        """
+        raise NotImplementedError
+
+    def add(self, build, failures):
+        """Add or replace a build and its failures.
+
+        build is a build serialisation dict, failures is a dict of failure
+        id to failure serialisation dict. Any previously stored build with
+        the same job_name and build_num is replaced.
+        """
+        raise NotImplementedError
+
+    def prune(self, age_limit):
+        """Remove builds older than age_limit, and their failures."""
+        raise NotImplementedError
+
+    def export(self):
+        """Return a dict of builds and failures keyed by id.
+
+        This is the format of the data file read by the web UI.
+        """
+        raise NotImplementedError
+
+    def recurring(self, limit=None):
+        """Return the failures that occurred in the most builds.
+
+        Failures are grouped by signature, see signature.py. Returns a list
+        of rows (see signature.recurring_row), most builds first.
+        """
+        raise NotImplementedError
+
+    def tests(self, limit=None):
+        """Return the flaky and still failing tests of each job.
+
+        Returns a dict of flaky and failing lists of rows, see
+        junit.test_report.
+        """
+        raise NotImplementedError
+
+    def sketches(self):
+        """Return the duration sketches of stored builds.
+
+        Returns a sketch.BuildSketches, that may be updated by the store.
+        """
+        raise NotImplementedError
+
+    def pipelines(self):
+        """Return the graph of upstream and downstream stored builds.
+
+        Returns a pipeline.PipelineGraph, that may be updated by the store.
+        """
+        raise NotImplementedError
+
+    def needs_compaction(self):
+        """Check if the data file needs to be written by publish.
+
+        The data file is written on every publish, unless the store is
+        persisted as the data file and a journal, see journal.py.
+        """
+        return True
+
+    def compacted(self):
+        """Called once the data file has been written."""
+        pass
+
+    def import_data(self, data):
+        """Add the builds and failures from an exported data dict."""
+        for build in data['builds'].values():
+            self.add(build, {id: data['failures'][id]
+                             for id in build['failures']})
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class JSONStore(Store):
+    """Store data in a json file, and a journal of changes to it.
+
+    The file is the data file read by the web UI, it may be in the compact
+    format. Changes are appended to the journal when they are committed,
+    and the data file is only rewritten when the journal is compacted.
+    MinHashes of failure signatures are kept in a third file, so that they
+    aren't computed again each time the store is opened.
+    """
+
+    def __init__(self, path, read_only=False):
+        # opening the store only reads its files, read_only is accepted so
+        # that stores can be opened the same way, see SQLiteStore.
+        self.path = path
+        self.builds = {}
+        self.failures = {}
+        self.keys = {}
+        self.index = SignatureIndex(read_minhashes(minhash_path(path)))
+        self.test_index = TestIndex()
+        self.build_sketches = BuildSketches()
+        self.pipeline_graph = PipelineGraph()
+        self.journal = Journal(journal_path(path))
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+                if compact.is_compact(data):
+                    data = compact.decode(data)
+                self.builds = data.get('builds', {})
+                self.failures = data.get('failures', {})
+            except Exception:
+                print(
+                    "Failed to read json file: {jsonfile}"
+                    .format(jsonfile=path))
+                traceback.print_exc()
+        # changes made since the data file was written
+        apply_entries(dict(builds=self.builds, failures=self.failures),
+                      self.journal.replay())
+
+        # Current production data.json has some extremely long failure
+        # detail fields. failure.py ensures that doesn't happen for new
+        # failures, truncate the fields of failures read from disk.
+        for failure in self.failures.values():
+            failure['detail'] = failure['detail'][:1000]
+
+        for id, build in self.builds.items():
+            self.keys[(build['job_name'], str(build['build_num']))] = id
+            self.index_build(build)
+        # signatures whose MinHashes are stored
+        self.stored_signatures = set(self.index.clusters.minhashes)
+        self.index.stored_minhashes = {}
+
+    def index_build(self, build):
+        timestamp = to_epoch(build['timestamp'])
+        failures = [self.failures[id] for id in build['failures']
+                    if id in self.failures]
+        self.index.add(build['id'], timestamp, failures)
+        self.test_index.add(build, timestamp, failures)
+        self.build_sketches.add(build)
+        self.pipeline_graph.add(build, timestamp)
+
+    def build_keys(self):
+        return set(self.keys.keys())
+
+    def build_rules(self):
+        return {key: self.builds[id].get('rules')
+                for key, id in self.keys.items()}
+
+    def get(self, key):
+        build = self.builds[self.keys[key]]
+        return dict(build), {id: self.failures[id]
+                             for id in build['failures']
+                             if id in self.failures}
+
+    def remove(self, id):
+        build = self.builds.pop(id)
+        self.keys.pop((build['job_name'], str(build['build_num'])), None)
+        self.build_sketches.remove(build)
+        self.pipeline_graph.remove(build)
+        self.index.remove(id)
+        self.test_index.remove(id)
+        for failure_id in build['failures']:
+            self.failures.pop(failure_id, None)
+
+    def add(self, build, failures):
+        key = (build['job_name'], str(build['build_num']))
+        if key in self.keys:
+            self.remove(self.keys[key])
+        self.keys[key] = build['id']
+        self.builds[build['id']] = build
+        self.failures.update(failures)
+        self.index_build(build)
+        self.journal.add(build, failures)
+
+    def prune(self, age_limit):
+        for id, build in list(self.builds.items()):
+            try:
+                if to_datetime(build['timestamp']) > age_limit:
+                    continue
+            except Exception as e:
+                print("Build timestamp exception: " + str(e))
+            self.remove(id)
+            self.journal.remove(id)
+
+    def export(self):
+        builds = dict(self.builds)
+        failures = dict(self.failures)
+
+        def build_integrity_fail(id):
+            print("Integrity fail for build: {}".format(id))
+            del builds[id]
+
+        def failure_integrity_fail(id):
+            print("Integrity fail for failure: {}".format(id))
+            del failures[id]
+
+        # integrity check
+        # its important the data set is consistent as the
+        # UI assumes consistency. Its better to remove a few
+        # inconsistent items than have the whole UI die.
+        for id, build in list(builds.items()):
+            try:
+                if build["id"] != id:
+                    build_integrity_fail(id)
+                for failure in build["failures"]:
+                    if failure not in failures:
+                        build_integrity_fail(id)
+                        break
+            except Exception as e:
+                print("Build integrity exception: " + str(e))
+                build_integrity_fail(id)
+
+        for id, failure in list(failures.items()):
+            try:
+                if (failure["id"] != id
+                        or failure["build"] not in builds):
+                    failure_integrity_fail(id)
+            except Exception:
+                failure_integrity_fail(id)
+
+        return dict(builds=builds, failures=failures)
+
+    def recurring(self, limit=None):
+        return self.index.top(limit)
+
+    def needs_compaction(self):
+        return self.journal.needs_compaction(self.path)
+
+    def compacted(self):
+        self.journal.truncate()
+
+    def commit(self):
+        self.journal.flush()
+        signatures = set(self.index.clusters.minhashes)
+        if signatures != self.stored_signatures:
+            write_minhashes(minhash_path(self.path),
+                            self.index.clusters.minhashes)
+            self.stored_signatures = signatures
+
+    def tests(self, limit=None):
+        return self.test_index.report(limit)
+
+    def sketches(self):
+        return self.build_sketches
+
+    def pipelines(self):
+        return self.pipeline_graph
+
+
+class SQLiteStore(Store):
+    """Store data in an sqlite database.
+
+    Builds, failures and build hierachies are stored in separate tables.
+    Builds are indexed by job and build number, timestamp and repo, and
+    failures by category, signature and type, so that new builds can be
+    upserted, old builds pruned and recurring failures and failing tests
+    found without reading the whole data set. The MinHash of each signature
+    is stored, so that signatures can be clustered without normalising
+    every failure again.
+
+    A read only store (eg for service.py) opens the database read only, and
+    doesn't upgrade it or store signatures, so it can be read while
+    build_summary_gh.py writes it.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS builds (
+            id TEXT PRIMARY KEY,
+            job_name TEXT NOT NULL,
+            build_num TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            repo TEXT,
+            branch TEXT,
+            stage TEXT,
+            result TEXT,
+            duration REAL,
+            rules TEXT
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS builds_job_build
+            ON builds (job_name, build_num);
+        CREATE INDEX IF NOT EXISTS builds_timestamp ON builds (timestamp);
+        CREATE INDEX IF NOT EXISTS builds_repo ON builds (repo);
+
+        CREATE TABLE IF NOT EXISTS failures (
+            id TEXT PRIMARY KEY,
+            build_id TEXT NOT NULL
+                REFERENCES builds (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            type TEXT,
+            category TEXT,
+            description TEXT,
+            detail TEXT,
+            signature TEXT,
+            failed_since INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS failures_build ON failures (build_id);
+        CREATE INDEX IF NOT EXISTS failures_category ON failures (category);
+
+        CREATE TABLE IF NOT EXISTS build_hierachy (
+            build_id TEXT NOT NULL
+                REFERENCES builds (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            name TEXT,
+            build_num TEXT,
+            url TEXT,
+            PRIMARY KEY (build_id, position)
+        );
+
+        CREATE TABLE IF NOT EXISTS signatures (
+            signature TEXT PRIMARY KEY,
+            type TEXT,
+            minhash BLOB
+        );
+
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        if read_only:
+            self.conn = sqlite3.connect(
+                'file:{}?mode=ro'.format(quote(os.path.abspath(path))),
+                uri=True)
+        else:
+            self.conn = sqlite3.connect(path)
+            self.conn.execute("PRAGMA foreign_keys = ON")
+            self.migrate()
+        self.clusters = ClusterIndex()
+        self.update_clusters()
+        self.build_sketches = BuildSketches()
+        for build in self.sketch_rows():
+            self.build_sketches.add(build)
+        self.pipeline_graph = PipelineGraph()
+        for build in self.pipeline_rows():
+            self.pipeline_graph.add(build, build['timestamp'])
+
+    def migrate(self):
+        """Create the schema, and upgrade databases written by old versions."""
+        self.conn.executescript(self.schema)
+        # databases created before rules were recorded
+        columns = [row[1] for row in
+                   self.conn.execute("PRAGMA table_info(builds)")]
+        if 'rules' not in columns:
+            self.conn.execute("ALTER TABLE builds ADD COLUMN rules TEXT")
+        columns = [row[1] for row in
+                   self.conn.execute("PRAGMA table_info(failures)")]
+        if 'signature' not in columns:
+            self.conn.execute(
+                "ALTER TABLE failures ADD COLUMN signature TEXT")
+        if 'failed_since' not in columns:
+            self.conn.execute(
+                "ALTER TABLE failures ADD COLUMN failed_since INTEGER")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS failures_signature"
+                          " ON failures (signature)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS failures_type"
+                          " ON failures (type)")
+        self.update_signatures()
+
+    def update_signatures(self):
+        """Compute missing signatures, or all if the normalisers changed."""
+        row = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'normalisers'").fetchone()
+        if row is None or row[0] != NORMALISERS_ID:
+            self.conn.execute("UPDATE failures SET signature = NULL")
+            self.conn.execute("DELETE FROM signatures")
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value)"
+                " VALUES ('normalisers', ?)", (NORMALISERS_ID,))
+        self.conn.executemany(
+            "UPDATE failures SET signature = ? WHERE id = ?",
+            [(signature(row[1], row[2]), row[0])
+             for row in self.conn.execute(
+                 "SELECT id, type, detail FROM failures"
+                 " WHERE signature IS NULL").fetchall()])
+        self.conn.commit()
+
+    def update_clusters(self):
+        """Load stored MinHashes, computing those that are missing."""
+        row = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'minhash'").fetchone()
+        current = row is not None and row[0] == MINHASH_ID
+        if not self.read_only:
+            if not current:
+                self.conn.execute("DELETE FROM signatures")
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value)"
+                    " VALUES ('minhash', ?)", (MINHASH_ID,))
+                current = True
+            self.remove_orphan_signatures()
+        missing = ""
+        if current:
+            for key, failure_type, values in self.conn.execute(
+                    "SELECT signature, type, minhash FROM signatures"
+                    " WHERE signature IN (SELECT signature FROM failures)"
+                    " ORDER BY signature").fetchall():
+                self.clusters.add(key, failure_type,
+                                  values=unpack_minhash(values))
+            missing = (" WHERE signature NOT IN"
+                       " (SELECT signature FROM signatures)")
+        self.add_signatures(self.conn.execute(
+            "SELECT signature, type, detail FROM failures" + missing
+            + " GROUP BY signature").fetchall())
+        if not self.read_only:
+            self.conn.commit()
+
+    def add_signatures(self, rows):
+        """Cluster new signatures.
+
+        rows are (signature, type, detail) tuples, signatures that are
+        already stored are ignored.
+        """
+        new = [(key, failure_type,
+                self.clusters.add(key, failure_type, normalise(detail)))
+               for key, failure_type, detail in rows
+               if key not in self.clusters.minhashes]
+        if self.read_only:
+            return
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO signatures (signature, type, minhash)"
+            " VALUES (?, ?, ?)",
+            [(key, failure_type, sqlite3.Binary(pack_minhash(values)))
+             for key, failure_type, values in new])
+
+    def remove_orphan_signatures(self):
+        """Remove signatures that no stored failure has."""
+        orphans = [row[0] for row in self.conn.execute(
+            "SELECT signature FROM signatures WHERE signature NOT IN"
+            " (SELECT signature FROM failures)").fetchall()]
+        for key in orphans:
+            self.clusters.remove(key)
+        self.conn.executemany("DELETE FROM signatures WHERE signature = ?",
+                              [(key,) for key in orphans])
+
+    def sketch_rows(self, where="", params=()):
+        """Yield dicts of the fields of builds that sketches use."""
+        for row in self.conn.execute(
+                "SELECT job_name, repo, branch, stage, duration FROM builds "
+                + where, params):
+            yield dict(job_name=row[0], repo=row[1], branch=row[2],
+                       stage=row[3], duration=row[4])
+
+    def pipeline_rows(self, where="", params=()):
+        """Get dicts of the fields of builds that the pipeline graph uses.
+
+        Timestamps are epoch seconds.
+        """
+        builds = {}
+        for row in self.conn.execute(
+                "SELECT id, job_name, build_num, timestamp, result,"
+                " duration FROM builds " + where, params):
+            builds[row[0]] = dict(
+                id=row[0], job_name=row[1], build_num=row[2],
+                timestamp=row[3], result=row[4], duration=row[5],
+                build_hierachy=[])
+        for row in self.conn.execute(
+                "SELECT build_id, name, build_num, url FROM build_hierachy"
+                " WHERE build_id IN (SELECT id FROM builds " + where + ")"
+                " ORDER BY build_id, position", params):
+            builds[row[0]]['build_hierachy'].append(
+                dict(name=row[1], build_num=row[2], url=row[3]))
+        return list(builds.values())
+
+    def build_keys(self):
+        return set(self.conn.execute(
+            "SELECT job_name, build_num FROM builds"))
+
+    def build_rules(self):
+        return {(row[0], row[1]): row[2] for row in self.conn.execute(
+            "SELECT job_name, build_num, rules FROM builds")}
+
+    def get(self, key):
+        data = self.read("WHERE job_name = ? AND build_num = ?",
+                         (key[0], str(key[1])))
+        build = list(data['builds'].values())[0]
+        return build, data['failures']
+
+    def add(self, build, failures):
+        conn = self.conn
+        rows = [(f['id'], build['id'], position, f['type'], f['category'],
+                 f['description'], f['detail'],
+                 signature(f['type'], f['detail']), f.get('failed_since'))
+                for position, f in enumerate(failures[id]
+                                             for id in build['failures'])]
+        key = (build['job_name'], str(build['build_num']))
+        for replaced in self.sketch_rows(
+                "WHERE job_name = ? AND build_num = ?", key):
+            self.build_sketches.remove(replaced)
+        for replaced in self.pipeline_rows(
+                "WHERE job_name = ? AND build_num = ?", key):
+            self.pipeline_graph.remove(replaced)
+        conn.execute(
+            "DELETE FROM builds WHERE job_name = ? AND build_num = ?", key)
+        conn.execute(
+            "INSERT INTO builds (id, job_name, build_num, timestamp, repo,"
+            " branch, stage, result, duration, rules)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (build['id'], build['job_name'], str(build['build_num']),
+             to_epoch(build['timestamp']), build['repo'], build['branch'],
+             build['stage'], build['result'], build['duration'],
+             build.get('rules')))
+        self.build_sketches.add(build)
+        self.pipeline_graph.add(build, to_epoch(build['timestamp']))
+        conn.executemany(
+            "INSERT INTO failures (id, build_id, position, type, category,"
+            " description, detail, signature, failed_since)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.add_signatures([(row[7], row[3], row[6]) for row in rows])
+        conn.executemany(
+            "INSERT INTO build_hierachy (build_id, position, name,"
+            " build_num, url) VALUES (?, ?, ?, ?, ?)",
+            ((build['id'], position, c['name'], c['build_num'], c['url'])
+             for position, c in enumerate(build['build_hierachy'])))
+
+    def prune(self, age_limit):
+        for build in self.sketch_rows("WHERE timestamp <= ?",
+                                      (to_epoch(age_limit),)):
+            self.build_sketches.remove(build)
+        for build in self.pipeline_rows("WHERE timestamp <= ?",
+                                        (to_epoch(age_limit),)):
+            self.pipeline_graph.remove(build)
+        self.conn.execute("DELETE FROM builds WHERE timestamp <= ?",
+                          (to_epoch(age_limit),))
+
+    def export(self):
+        return self.read()
+
+    def read(self, where="", params=()):
+        """Read builds matching a where clause on the builds table.
+
+        Returns a dict of builds and failures in the same format as export.
+        """
+        builds = {}
+        for row in self.conn.execute(
+                "SELECT id, job_name, build_num, timestamp, repo, branch,"
+                " stage, result, duration, rules FROM builds "
+                + where, params):
+            builds[row[0]] = dict(
+                id=row[0],
+                job_name=row[1],
+                build_num=row[2],
+                timestamp=datetime.datetime.fromtimestamp(row[3]),
+                repo=row[4],
+                branch=row[5],
+                stage=row[6],
+                result=row[7],
+                duration=row[8],
+                rules=row[9],
+                failures=[],
+                build_hierachy=[])
+        failures = {}
+        for row in self.conn.execute(
+                "SELECT id, build_id, type, category, description, detail,"
+                " failed_since FROM failures WHERE build_id IN"
+                " (SELECT id FROM builds " + where + ")"
+                " ORDER BY build_id, position", params):
+            failures[row[0]] = dict(
+                id=row[0],
+                build=row[1],
+                type=row[2],
+                category=row[3],
+                description=row[4],
+                detail=row[5])
+            if row[2] == 'JunitFailure':
+                failures[row[0]]['failed_since'] = row[6]
+            builds[row[1]]['failures'].append(row[0])
+        for row in self.conn.execute(
+                "SELECT build_id, name, build_num, url FROM build_hierachy"
+                " WHERE build_id IN (SELECT id FROM builds " + where + ")"
+                " ORDER BY build_id, position", params):
+            builds[row[0]]['build_hierachy'].append(
+                dict(name=row[1], build_num=row[2], url=row[3]))
+        return dict(builds=builds, failures=failures)
+
+    def recurring(self, limit=None):
+        builds = {}
+        for key, build_id in self.conn.execute(
+                "SELECT DISTINCT signature, build_id FROM failures"):
+            builds.setdefault(key, set()).add(build_id)
+        resemblance = self.clusters.resemblance(builds)
+        rows = []
+        for key, in self.conn.execute(
+                "SELECT signature FROM failures GROUP BY signature"
+                " ORDER BY COUNT(DISTINCT build_id) DESC, signature"
+                " LIMIT ?", (-1 if limit is None else limit,)).fetchall():
+            failure = self.conn.execute(
+                "SELECT type, category, detail FROM failures"
+                " WHERE signature = ? LIMIT 1", (key,)).fetchone()
+            build_times = dict(self.conn.execute(
+                "SELECT DISTINCT builds.id, builds.timestamp FROM failures"
+                " JOIN builds ON builds.id = failures.build_id"
+                " WHERE failures.signature = ?", (key,)))
+            rows.append(recurring_row(
+                key,
+                dict(type=failure[0], category=failure[1],
+                     detail=failure[2]),
+                build_times, *resemblance[key]))
+        return rows
+
+    def sketches(self):
+        return self.build_sketches
+
+    def pipelines(self):
+        return self.pipeline_graph
+
+    def tests(self, limit=None):
+        latest = {}
+        for job_name, build_num in self.conn.execute(
+                "SELECT job_name, build_num FROM builds"):
+            num = build_number(build_num)
+            if num is not None and num > latest.get(job_name, -1):
+                latest[job_name] = num
+        tests = {}
+        for test, job_name, id, build_num, timestamp, since in (
+                self.conn.execute(
+                    "SELECT failures.detail, builds.job_name, builds.id,"
+                    " builds.build_num, builds.timestamp,"
+                    " failures.failed_since FROM failures"
+                    " JOIN builds ON builds.id = failures.build_id"
+                    " WHERE failures.type = 'JunitFailure'")):
+            tests.setdefault((test, job_name), {})[id] = (
+                build_num, timestamp, since)
+        return test_report(
+            [test_row(test, job_name, builds, latest.get(job_name))
+             for (test, job_name), builds in tests.items()], limit)
+
+    def commit(self):
+        # signatures of pruned and replaced builds
+        self.remove_orphan_signatures()
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+STORES = {
+    'json': JSONStore,
+    'sqlite': SQLiteStore,
+}
@@ -0,0 +1,129 @@
+# Stdlib import
+import bisect
+import re
+
+
+class TaskIndex(object):
+    """Index of ansible structure within a build's log lines.
+
+    Records the line numbers of TASK and PLAY headers and of
+    "...ignoring" markers, so that the task a failure occurred in can be
+    found with a binary search rather than walking the log.
+    """
+
+    task_re = re.compile(r'TASK:? \[((?P<role>.*)\|)?(?P<task>.*)\]')
+    play_re = re.compile(r'PLAY \[(?P<play>.*)\]')
+    ignoring_str = '...ignoring'
+    # Finds lines that may need to be indexed, in blocks of bytes
+    block_re = re.compile(br'TASK|PLAY \[|\.\.\.ignoring')
+
+    # If we match the last task to be executed chances are the failure
+    # happened post-ansible, so the last task indicator isn't that useful.
+    last_task = 'Deploy RPC HAProxy configuration files'
+
+    def __init__(self):
+        self.task_lines = []
+        self.tasks = []
+        self.play_lines = []
+        self.plays = []
+        self.ignoring_lines = []
+
+    @classmethod
+    def from_lines(cls, lines):
+        index = cls()
+        for line_num, line in enumerate(lines):
+            index.add(line_num, line)
+        return index
+
+    @classmethod
+    def is_task(cls, line):
+        return 'TASK' in line and cls.task_re.search(line) is not None
+
+    @classmethod
+    def is_play(cls, line):
+        return 'PLAY [' in line and cls.play_re.search(line) is not None
+
+    def add(self, line_num, line):
+        """Add a line to the index, lines must be added in order."""
+        if 'TASK' in line:
+            match = self.task_re.search(line)
+            if match:
+                self.task_lines.append(line_num)
+                self.tasks.append((match.group('role'),
+                                   match.group('task')))
+        if 'PLAY [' in line:
+            match = self.play_re.search(line)
+            if match:
+                self.play_lines.append(line_num)
+                self.plays.append(match.group('play'))
+        if self.ignoring_str in line:
+            self.ignoring_lines.append(line_num)
+
+    def extend(self, other, offset=0):
+        """Add the lines of another index that are after those of this one.
+
+        The line numbers of other are moved by offset, eg to renumber the
+        lines of an index of the end of a log read backwards.
+        """
+        last = max([-1] + [lines[-1] for lines in
+                           (self.task_lines, self.play_lines,
+                            self.ignoring_lines) if lines])
+        for lines, values, other_lines, other_values in (
+                (self.task_lines, self.tasks, other.task_lines, other.tasks),
+                (self.play_lines, self.plays, other.play_lines, other.plays),
+                (self.ignoring_lines, None, other.ignoring_lines, None)):
+            for pos, line_num in enumerate(other_lines):
+                if line_num + offset > last:
+                    lines.append(line_num + offset)
+                    if values is not None:
+                        values.append(other_values[pos])
+
+    def previous_task(self, line_num):
+        """Describe the task that was running at line_num.
+
+        Returns "play / role / task", or "" if the task or the play it
+        belongs to can't be found.
+        """
+        task_pos = bisect.bisect_right(self.task_lines, line_num) - 1
+        if task_pos < 0:
+            return ""
+        play_pos = bisect.bisect_right(self.play_lines,
+                                       self.task_lines[task_pos]) - 1
+        if play_pos < 0:
+            return ""
+        role, task = self.tasks[task_pos]
+        play = self.plays[play_pos]
+        if task.strip() == self.last_task:
+            return 'N/A'
+        if role:
+            return '{play} / {role} / {task}'.format(
+                role=role,
+                play=play,
+                task=task)
+        else:
+            return '{play} / {task}'.format(
+                play=play,
+                task=task)
+
+    def next_task_line(self, line_num):
+        """Return the line number of the first task at or after line_num.
+
+        Returns None if there are no further tasks.
+        """
+        task_pos = bisect.bisect_left(self.task_lines, line_num)
+        if task_pos == len(self.task_lines):
+            return None
+        return self.task_lines[task_pos]
+
+    def failure_ignored(self, fail_line):
+        """Check if ansible ignored a failure that occurred at fail_line.
+
+        A failure is ignored if "...ignoring" appears before the next task
+        starts.
+        """
+        next_task_line = self.next_task_line(fail_line)
+        if next_task_line is None:
+            return False
+        ignoring_pos = bisect.bisect_left(self.ignoring_lines, fail_line)
+        return (ignoring_pos < len(self.ignoring_lines)
+                and self.ignoring_lines[ignoring_pos] < next_task_line)
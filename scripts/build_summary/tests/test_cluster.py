@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from store import JSONStore, SQLiteStore
+
+DETAIL = ('Task Failed: setup hosts / openstack hosts / Install packages for'
+          ' the galera server role on the infra containers {}')
+
+
+def build(build_num, *details):
+    id = 'PM_a_{}'.format(build_num)
+    failures = {
+        '{}_{}'.format(id, num): dict(
+            id='{}_{}'.format(id, num), build=id, type='AnsibleTaskFailure',
+            category='C5 Local Task', description='An ansible task failed',
+            detail=detail)
+        for num, detail in enumerate(details)}
+    return dict(id=id, job_name='PM_a', build_num=str(build_num),
+                timestamp='2017-03-0{} 12:00:00'.format(build_num),
+                failures=sorted(failures), build_hierachy=[],
+                repo='rpc-openstack', branch='master', stage='PM',
+                result='FAILURE', duration=3600000), failures
+
+
+class ResemblanceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def recurring(self, store):
+        self.addCleanup(store.close)
+        # similar failures, build 2 has two of them
+        store.add(*build(1, DETAIL.format('alpha')))
+        store.add(*build(2, DETAIL.format('bravo'), DETAIL.format('charlie')))
+        store.add(*build(3, DETAIL.format('charlie')))
+        store.add(*build(4, 'Could not find a version of foo'))
+        store.commit()
+        return {row['detail'].split()[-1]: (row['count'], row['resembles'])
+                for row in store.recurring()}
+
+    def test_distinct_builds(self):
+        """A build with several similar failures is counted once"""
+        expected = {
+            'alpha': (1, 2),
+            'bravo': (1, 2),
+            'charlie': (2, 1),
+            'foo': (1, 0),
+        }
+        self.assertEqual(self.recurring(JSONStore(
+            os.path.join(self.directory, 'data.json'))), expected)
+        self.assertEqual(self.recurring(SQLiteStore(
+            os.path.join(self.directory, 'data.db'))), expected)
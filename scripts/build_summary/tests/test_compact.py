@@ -0,0 +1,91 @@
+import datetime
+import json
+import unittest
+
+import compact
+
+BUILD_URL = 'https://jenkins/job/{job_name}/{build_num}'
+
+
+def build(id, job_name, build_num, timestamp, failures, hierachy, **fields):
+    data = dict(id=id, job_name=job_name, build_num=build_num,
+                timestamp=timestamp, failures=failures,
+                build_hierachy=hierachy, repo='rpc-openstack',
+                branch='master', stage='PM', result='FAILURE',
+                duration=3600000)
+    data.update(fields)
+    return data
+
+
+def cause(job_name, build_num):
+    return dict(name=job_name, build_num=build_num,
+                url=BUILD_URL.format(job_name=job_name, build_num=build_num))
+
+
+class CompactTestCase(unittest.TestCase):
+
+    def data(self):
+        trigger = cause('PM_trigger', '7')
+        builds = [
+            # hierachy ending with the build itself, which isn't stored
+            build('PM_a_1', 'PM_a', '1',
+                  datetime.datetime(2017, 3, 1, 12, 0, 0, 123000),
+                  ['f1', 'f2'], [trigger, cause('PM_a', '1')]),
+            # same hierachy without the build itself
+            build('PM_a_2', 'PM_a', '2',
+                  datetime.datetime(2017, 3, 1, 13, 30), ['f3'], [trigger],
+                  rules='abc123'),
+            # the last entry isn't the build's own url
+            build('PM_b_5', 'PM_b', '5',
+                  datetime.datetime(2017, 2, 28, 23, 59, 59), [],
+                  [trigger, dict(cause('PM_b', '5'), url='elsewhere')]),
+            build('PM_c_9', 'PM_c', '9',
+                  datetime.datetime(2017, 3, 2), [], []),
+        ]
+        failures = [
+            dict(id='f1', build='PM_a_1', type='PipFailure',
+                 category='C1 Remote Dependency', description='Pip',
+                 detail='foo==1'),
+            dict(id='f2', build='PM_a_1', type='JunitFailure',
+                 category='C7 Uncategorised', description='Junit',
+                 detail='test_x', failed_since=None),
+            dict(id='f3', build='PM_a_2', type='JunitFailure',
+                 category='C7 Uncategorised', description='Junit',
+                 detail='test_x', failed_since=1),
+        ]
+        return dict(builds={b['id']: b for b in builds},
+                    failures={f['id']: f for f in failures},
+                    timestamp='2017-03-02T10:00:00')
+
+    def test_round_trip(self):
+        data = self.data()
+        for build_url in (BUILD_URL, None):
+            encoded = compact.encode(data, build_url=build_url)
+            self.assertTrue(compact.is_compact(encoded))
+            # the encoding is json serialisable
+            encoded = json.loads(json.dumps(encoded))
+            self.assertEqual(compact.decode(encoded), data)
+
+    def test_own_hierachy_entry(self):
+        encoded = compact.encode(self.data(), build_url=BUILD_URL)
+        column = encoded['builds']['columns'].index('build_hierachy')
+        hierachies = [row[column] for row in encoded['builds']['rows']]
+        # PM_b_5, PM_a_1, PM_a_2, PM_c_9 in time order, both PM_a builds
+        # share the trigger hierachy
+        self.assertEqual(hierachies, [[0, 0], [1, 1], [1, 0], [2, 0]])
+
+    def test_no_sparse_columns(self):
+        data = self.data()
+        del data['builds']['PM_a_2']['rules']
+        del data['failures']['f2']['failed_since']
+        del data['failures']['f3']['failed_since']
+        encoded = compact.encode(data, build_url=BUILD_URL)
+        self.assertEqual(encoded['failures']['sparse'], [])
+        self.assertEqual(len(encoded['failures']['rows'][0]),
+                         len(encoded['failures']['columns']))
+        self.assertEqual(compact.decode(encoded), data)
+
+    def test_version(self):
+        encoded = compact.encode(self.data())
+        encoded['version'] = compact.VERSION + 1
+        self.assertRaises(ValueError, compact.decode, encoded)
@@ -0,0 +1,67 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import discovery
+
+JOB_RE = re.compile('PM_')
+NOW = 1500000000
+
+
+class FindBuildsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        # build numbers and their build.xml mtimes in minutes before NOW
+        self.make_job('PM_a', {1: 300, 2: 200, 3: 100, 4: 5})
+        # build 8 finished after build 9
+        self.make_job('PM_b', {7: 250, 8: 30, 9: 40, 10: 1})
+        self.make_job('RE_c', {1: 0})
+        # a build that hasn't written its build.xml yet
+        os.makedirs(os.path.join(self.directory, 'PM_a', 'builds', '5'))
+        os.symlink('4', os.path.join(self.directory, 'PM_a', 'builds',
+                                     'lastSuccessfulBuild'))
+
+    def make_job(self, job_name, builds):
+        for build_num, age in builds.items():
+            folder = os.path.join(self.directory, job_name, 'builds',
+                                  str(build_num))
+            os.makedirs(folder)
+            path = os.path.join(folder, 'build.xml')
+            open(path, 'w').close()
+            os.utime(path, (NOW - age * 60, NOW - age * 60))
+
+    def find(self, skip=(), minutes=None):
+        newer_than = None if minutes is None else NOW - minutes * 60
+        return [(build['job_name'], build['build_num']) for build in
+                discovery.find_builds(self.directory, JOB_RE, skip,
+                                      newer_than)]
+
+    def test_newest_first(self):
+        self.assertEqual(self.find(), [
+            ('PM_b', '10'), ('PM_a', '4'), ('PM_b', '9'), ('PM_b', '8'),
+            ('PM_a', '3'), ('PM_a', '2'), ('PM_b', '7'), ('PM_a', '1')])
+
+    def test_skip(self):
+        self.assertEqual(self.find(skip={('PM_b', '10'), ('PM_a', '3')}), [
+            ('PM_a', '4'), ('PM_b', '9'), ('PM_b', '8'), ('PM_a', '2'),
+            ('PM_b', '7'), ('PM_a', '1')])
+
+    def test_newer_than(self):
+        """Older builds of each job aren't stat'ed"""
+        with mock.patch.object(discovery.os, 'stat',
+                               side_effect=os.stat) as stat:
+            self.assertEqual(self.find(skip={('PM_a', '4')}, minutes=150), [
+                ('PM_b', '10'), ('PM_b', '9'), ('PM_b', '8'),
+                ('PM_a', '3')])
+        stated = sorted(os.path.relpath(os.path.dirname(call[0][0]),
+                                        self.directory)
+                        for call in stat.call_args_list)
+        self.assertEqual(stated, [
+            'PM_a/builds/2', 'PM_a/builds/3', 'PM_a/builds/5',
+            'PM_b/builds/10', 'PM_b/builds/7', 'PM_b/builds/8',
+            'PM_b/builds/9'])
@@ -0,0 +1,247 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from failure import (Failure, PipFailure, SlaveOfflineFailure,
+                     TempestFailure)
+from logsource import LogSource
+from scanner import MATCH_FIRST, required_literals
+
+# Lines matching each pattern of each failure type, keyed by pattern.
+# Every pattern needs samples, so that a literal that isn't in every match
+# (which would make the scanner miss failures) is found.
+SAMPLES = {
+    r'Failed to fetch (\s*from\s*)?([^\s]*)\.git': [
+        'Failed to fetch git://github.com/openstack/nova.git',
+        'fatal: Failed to fetch  from https://git.openstack.org/x.git',
+    ],
+    r'hudson\.plugins\.git': [
+        'hudson.plugins.git.GitException: Command "git fetch" failed',
+    ],
+    r"Failed to fetch (\s*from\s*)?([^\s]*)( Hash Sum mismatch)?": [
+        'W: Failed to fetch http://mirror/ubuntu/a.deb Hash Sum mismatch',
+        'E: Failed to fetch http://mirror/ubuntu/b.deb  404  Not Found',
+    ],
+    ("E: (?:Unable to locate package ([a-zA-Z-_]+)"
+     "|Package '([a-zA-Z-_]+)' has no installation candidate)"): [
+        'E: Unable to locate package python-foo',
+        "E: Package 'libssl-dev' has no installation candidate",
+    ],
+    r'\{0\} (?P<test>tempest[^ ]*).*\.\.\. FAILED': [
+        '{0} tempest.api.compute.servers.test_x.Test.test_y [12.3s] ...'
+        ' FAILED',
+    ],
+    'Agent went offline during the build': [
+        'ERROR: Agent went offline during the build',
+    ],
+    "Could not find a version that satisfies the requirement ([^ ]*)": [
+        'Could not find a version that satisfies the requirement foo==1.0'
+        ' (from versions: )',
+    ],
+    r"hudson\.[^ ]*Exception.*": [
+        'hudson.remoting.ChannelClosedException: channel is closed',
+        'Caused by: hudson.AbortException',
+    ],
+    "ERROR:.*is not a legal parameter in an Ansible task or handler": [
+        "ERROR: 'foo' is not a legal parameter in an Ansible task or"
+        " handler",
+    ],
+    '(fatal|failed):.*=>': [
+        'fatal: [aio1]: FAILED! => {"changed": false}',
+        'failed: [aio1_galera_container-1a2b3c4d] (item=x) => {}',
+    ],
+    (r'Build timed out \(after [0-9]* minutes\). '
+     'Marking the build as aborted.'
+     '|Timeout has been exceeded'
+     '|Cancelling nested steps due to timeout'
+     '|Timeout waiting for NodePool ZNode '
+     '/requests/.* to reach state fulfilled'): [
+        'Build timed out (after 240 minutes). Marking the build as aborted.',
+        'Timeout has been exceeded',
+        'Cancelling nested steps due to timeout',
+        'Timeout waiting for NodePool ZNode /requests/100-0000001 to reach'
+        ' state fulfilled',
+    ],
+    "Timeout when waiting for (.*):22": [
+        'fatal: [aio1]: Timeout when waiting for 172.29.236.100:22',
+    ],
+}
+
+
+class RequiredLiteralsTestCase(unittest.TestCase):
+
+    def test_failure_patterns(self):
+        """Every match of a failure pattern contains one of its literals"""
+        patterns = set(pattern for cls in Failure.__subclasses__()
+                       for pattern in cls.patterns)
+        self.assertEqual(set(SAMPLES), patterns)
+        for pattern, samples in SAMPLES.items():
+            compiled = re.compile(pattern)
+            literals = required_literals(compiled)
+            self.assertTrue(literals, pattern)
+            for sample in samples:
+                match = compiled.search(sample)
+                self.assertIsNotNone(match, sample)
+                self.assertTrue(
+                    any(literal in match.group() for literal in literals),
+                    "{!r} has none of {!r}".format(sample, literals))
+
+    def test_optional_and_alternatives(self):
+        self.assertEqual(required_literals(re.compile('ab(cd)?ef')), ['ab'])
+        self.assertEqual(required_literals(re.compile('x(?:abc|def)y')),
+                         ['abc', 'def'])
+        # an alternative without a literal can match anything
+        self.assertIsNone(required_literals(re.compile('(?:abc|[0-9]+)')))
+
+    def test_ignore_case(self):
+        self.assertIsNone(required_literals(re.compile('abc', re.I)))
+        self.assertIsNone(required_literals(re.compile('(?i)abc')))
+        self.assertEqual(required_literals(re.compile('(?i:abc)defg')),
+                         ['defg'])
+        self.assertIsNone(required_literals(re.compile('(?:abc|(?i:xyz))')))
+
+
+class StaleRulesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(Failure, '_fingerprints', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rules = Failure.rules()
+
+    def stale_rules(self, **changes):
+        """Compare the recorded rules with TempestFailure changed."""
+        with mock.patch.multiple(TempestFailure, **changes):
+            Failure._fingerprints = None
+            return Failure.stale_rules(self.rules)
+
+    def test_unchanged(self):
+        self.assertEqual(Failure.stale_rules(self.rules), ([], []))
+
+    def test_changed_pattern(self):
+        self.assertEqual(
+            self.stale_rules(patterns=[r'\{0\} (?P<test>tempest[^ ]*) FAIL']),
+            ([TempestFailure], []))
+
+    def test_changed_handling(self):
+        self.assertEqual(self.stale_rules(rules_version=2),
+                         ([TempestFailure], []))
+        self.assertEqual(self.stale_rules(match_mode=MATCH_FIRST),
+                         ([TempestFailure], []))
+
+    def test_changed_scanning(self):
+        with mock.patch.object(Failure, 'scan_version', 2):
+            Failure._fingerprints = None
+            changed, removed = Failure.stale_rules(self.rules)
+        self.assertEqual(changed, Failure.__subclasses__())
+
+    def test_added_and_removed(self):
+        rules = ";".join(item for item in self.rules.split(";")
+                         if not item.startswith("TempestFailure="))
+        self.assertEqual(Failure.stale_rules(rules + ";GoneFailure=abc"),
+                         ([TempestFailure], ['GoneFailure']))
+        self.assertEqual(Failure.stale_rules(None),
+                         (Failure.__subclasses__(), []))
+
+
+class Build(object):
+
+    def __init__(self, build_folder):
+        self.id = 'build'
+        self.failures = []
+        self.log_lines = LogSource(build_folder)
+        self.task_index = self.log_lines.task_index
+
+
+# A log with several hits for failure types of each match mode
+LOG = """\
+PLAY [setup hosts] ***
+TASK [pip_install|Install pip packages] ***
+Could not find a version that satisfies the requirement foo==1.0
+...ignoring
+TASK [pip_install|Install more pip packages] ***
+Could not find a version that satisfies the requirement bar==2.0
+Failed to fetch git://github.com/openstack/nova.git
+Failed to fetch http://mirror/ubuntu/a.deb Hash Sum mismatch
+WARNING: The following packages cannot be authenticated! (retrying)
+TASK [apt|Install apt packages] ***
+WARNING: The following packages cannot be authenticated!
+fatal: [aio1]: FAILED! => {"msg": "apt failed"}
+Failed to connect to the host via ssh
+Timeout when waiting for 172.29.236.100:22
+dpkg status database is locked by another process
+TASK [keys|Add keys] ***
+failed: [aio1] => {"msg": "ignored"}
+...ignoring
+hudson.remoting.ChannelClosedException: channel is closed
+PLAY [tempest] ***
+TASK [tempest|Run tempest] ***
+{0} tempest.api.one [1.0s] ... FAILED
+{0} tempest.api.two [1.0s] ... FAILED
+Could not get lock /var/lib/dpkg/lock
+hudson.AbortException: script returned exit code 1
+TASK [setup|Run checks] ***
+fatal: [aio1]: FAILED! => {"msg": "checks failed"}
+[PostBuildScript] - Execution post build scripts.
+Agent went offline during the build
+"""
+
+
+class ScanLogsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(Failure.failures.clear)
+        with open(os.path.join(self.directory, 'log'), 'w') as f:
+            f.write(LOG)
+
+    def scan(self, classes=None):
+        build = Build(self.directory)
+        Failure.scan_logs(build, classes)
+        failures = [Failure.failures[id] for id in build.failures]
+        return {type(failure).__name__: (failure.detail, failure.category)
+                for failure in failures}
+
+    def test_scan_logs(self):
+        self.assertEqual(self.scan(), {
+            # first hit, the .git line isn't accepted as an apt failure
+            'GitFetchFailure': (
+                'Git Fetch Fail: Failed to fetch'
+                ' git://github.com/openstack/nova.git\n',
+                'C1 Remote Dependency'),
+            'AptFailure': (
+                'Apt Fetch Fail: Failed to fetch'
+                ' http://mirror/ubuntu/a.deb Hash Sum mismatch\n',
+                'C1 Remote Dependency'),
+            # only whole lines are accepted
+            'AptMirrorFailure': (
+                'Apt Mirror Fail: WARNING: The following packages cannot be'
+                ' authenticated! setup hosts / apt / Install apt packages',
+                'C2 Mirror'),
+            'SSHFailure': ('Failed to connect to the host via ssh',
+                           'C3 SSH'),
+            # last hits, the excluded exception isn't accepted
+            'DpkgLock': ('dpkg locked. PrevTask: tempest / tempest /'
+                         ' Run tempest', 'C5 Local Task'),
+            'TempestFailure': ('Tempest Test Failed: tempest.api.two',
+                               'C8 Tempest'),
+            'JenkinsException': (
+                'hudson.remoting.ChannelClosedException: channel is closed',
+                'C7 Uncategorised'),
+            # every hit, the category of the apt task failure sticks and
+            # the ignored failure is skipped
+            'AnsibleTaskFailure': (
+                'Task Failed: tempest / setup / Run checks',
+                'C1 Remote Dependency'),
+        })
+
+    def test_first_hit_ignored(self):
+        """Only the first pip hit counts, and it was ignored"""
+        self.assertEqual(self.scan([PipFailure]), {})
+
+    def test_after_post_build_marker(self):
+        self.assertEqual(self.scan([SlaveOfflineFailure]), {})
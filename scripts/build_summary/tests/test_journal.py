@@ -0,0 +1,99 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from journal import apply_entries, Journal, journal_path
+from store import JSONStore
+
+
+def build(job_name, build_num, timestamp, failures=(), result='FAILURE'):
+    id = '{}_{}'.format(job_name, build_num)
+    return dict(id=id, job_name=job_name, build_num=build_num,
+                timestamp=timestamp, failures=[f['id'] for f in failures],
+                build_hierachy=[], repo='rpc-openstack', branch='master',
+                stage='PM', result=result, duration=3600000), \
+        {f['id']: dict(f, build=id) for f in failures}
+
+
+def failure(id, detail):
+    return dict(id=id, type='PipFailure', category='C1 Remote Dependency',
+                description='Pip', detail=detail)
+
+
+# builds and failures as read back from json, timestamps are strings
+OLD = build('PM_a', '1', '2017-03-01 12:00:00', [failure('f1', 'foo==1')])
+NEW = build('PM_a', '2', '2017-03-02 12:00:00', [failure('f2', 'bar==2')])
+RESCANNED = build('PM_a', '2', '2017-03-02 12:00:00',
+                  [failure('f3', 'baz==3')], result='ABORTED')
+OTHER = build('PM_b', '5', '2017-03-03 08:30:00.250000')
+
+
+def data(*builds):
+    return dict(builds={b['id']: b for b, failures in builds},
+                failures={id: f for b, failures in builds
+                          for id, f in failures.items()})
+
+
+class JournalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'data.json')
+
+    def open(self):
+        store = JSONStore(self.path)
+        self.addCleanup(store.close)
+        return store
+
+    def test_partial_last_line(self):
+        """A run that stopped while appending loses only its last entry"""
+        journal = Journal(journal_path(self.path))
+        journal.add(*OLD)
+        journal.flush()
+        journal.add(*NEW)
+        journal.flush()
+        with open(journal.path, 'rb+') as f:
+            f.truncate(os.path.getsize(journal.path) - 10)
+        self.assertEqual(apply_entries(data(), journal.replay()), data(OLD))
+
+        # the next run starts its entries on a new line
+        store = self.open()
+        self.assertEqual(store.export(), data(OLD))
+        store.add(*OTHER)
+        store.commit()
+        self.assertEqual(
+            [entry['build']['id'] for entry in journal.replay()],
+            ['PM_a_1', 'PM_b_5'])
+        self.assertEqual(self.open().export(), data(OLD, OTHER))
+
+    def test_replay_after_compaction(self):
+        """The journal can be replayed over the snapshot it was compacted to
+
+        A run that stops after renaming the new data file over the old one,
+        but before removing the journal, leaves both.
+        """
+        store = self.open()
+        store.add(*OLD)
+        store.add(*NEW)
+        store.commit()
+        store.add(*RESCANNED)
+        store.add(*OTHER)
+        store.prune(datetime.datetime(2017, 3, 2))
+        store.commit()
+        expected = data(RESCANNED, OTHER)
+        self.assertEqual(store.export(), expected)
+        self.assertTrue(store.needs_compaction())
+
+        with open(self.path, 'w') as f:
+            json.dump(dict(store.export(), timestamp='2017-03-04 00:00:00'),
+                      f)
+        store = self.open()
+        self.assertEqual(store.export(), expected)
+
+        store.compacted()
+        self.assertFalse(os.path.exists(journal_path(self.path)))
+        self.assertEqual(self.open().export(), expected)
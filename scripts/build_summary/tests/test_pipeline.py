@@ -0,0 +1,63 @@
+import unittest
+
+from pipeline import PipelineGraph
+
+PUSH = dict(name='Github Push by alice', build_num='', url='#')
+TRIGGER = 'PM-trigger_rpc-openstack-master'
+AIO = 'PM_rpc-openstack-master-xenial_mnaio'
+# 2018-04-25 14:22:28
+START = 1524666148.0
+
+
+def build(job_name, build_num, duration, upstream=()):
+    hierachy = [PUSH] + [dict(name=name, build_num=str(num),
+                              url='https://jenkins/job/{}/{}'.format(name,
+                                                                     num))
+                         for name, num in upstream]
+    return dict(id='{}-{}'.format(job_name, build_num), job_name=job_name,
+                build_num=build_num, result='SUCCESS', duration=duration,
+                build_hierachy=hierachy)
+
+
+class PipelineTestCase(unittest.TestCase):
+
+    def test_queue_gap(self):
+        """A build queued after its upstream build finished"""
+        graph = PipelineGraph()
+        graph.add(build(TRIGGER, 7, 120), START)
+        # triggered when the trigger build finished, and queued for 5m
+        graph.add(build(AIO, 42, 3600, [(TRIGGER, 7)]), START + 120 + 300)
+        pipeline, = graph.pipelines()
+        self.assertEqual(pipeline['cause'], 'Github Push by alice')
+        self.assertEqual(pipeline['latency'], 120 + 300 + 3600)
+        self.assertEqual(pipeline['queued'], 300)
+        self.assertEqual(pipeline['executing'], 120 + 3600)
+        self.assertEqual(pipeline['other'], 0)
+        trigger, aio = pipeline['critical_path']
+        self.assertEqual((trigger['name'], trigger['queued']), (TRIGGER, None))
+        self.assertEqual((aio['name'], aio['queued'], aio['executing']),
+                         (AIO, 300, 3600))
+
+    def test_started_while_upstream_running(self):
+        """No wait is known for a build started by a running build step"""
+        graph = PipelineGraph()
+        graph.add(build(TRIGGER, 7, 3000), START)
+        graph.add(build(AIO, 42, 3600, [(TRIGGER, 7)]), START + 60)
+        pipeline, = graph.pipelines()
+        self.assertEqual(pipeline['latency'], 60 + 3600)
+        self.assertEqual(pipeline['queued'], 0)
+        self.assertEqual(pipeline['executing'], 60 + 3600)
+        self.assertIsNone(pipeline['critical_path'][1]['queued'])
+
+    def test_upstream_not_stored(self):
+        """Time in upstream builds that aren't stored isn't a wait"""
+        graph = PipelineGraph()
+        graph.add(build(TRIGGER, 7, 120), START)
+        graph.add(build(AIO, 42, 3600, [(TRIGGER, 7), ('PM-deploy', 3)]),
+                  START + 1000)
+        pipeline, = graph.pipelines()
+        self.assertEqual(pipeline['queued'], 0)
+        self.assertEqual(pipeline['other'], 1000 - 120)
+        self.assertEqual([hop['name'] for hop in pipeline['critical_path']],
+                         [TRIGGER, 'PM-deploy', AIO])
+        self.assertIsNone(pipeline['critical_path'][2]['queued'])
@@ -0,0 +1,194 @@
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import logblocks
+from failure import (DpkgLock, Failure, JenkinsException, PipFailure,
+                     SlaveOfflineFailure, TempestFailure)
+from logsource import LogSource
+from scanner import LogScanner, MATCH_FIRST, MATCH_LAST
+
+MARKER = LogSource.post_build_marker.rstrip('\n')
+# Lines that match failure types or are indexed, and filler
+LINES = [
+    'TASK [role|do thing] ****', 'TASK: [other] ***', 'PLAY [hosts] ***',
+    '...ignoring', 'fatal: [host]: FAILED! => {}', 'failed: [x] => y',
+    'Agent went offline during the build',
+    'Build timed out (after 5 minutes). Marking the build as aborted.',
+    'Timeout has been exceeded',
+    'hudson.remoting.ChannelClosedException: boom',
+    'hudson.Foo Exception script returned exit code 1',
+    'dpkg status database is locked by another process',
+    'Could not get lock /var/lib/dpkg/lock',
+    'ERROR: foo is not a legal parameter in an Ansible task or handler',
+    '{0} tempest.api.foo.bar [1.0s] ... FAILED',
+    'WARNING: The following packages cannot be authenticated!',
+    'WARNING: The following packages cannot be authenticated! not whole',
+    'Could not find a version that satisfies the requirement foo==1',
+    'E: Unable to locate package foo', 'Failed to fetch http://x/y',
+    'Failed to fetch git://x/y.git', 'caf\xe9 ☃ TASK [uni|code]',
+    'Failed to connect to the host via ssh',
+    'Timeout when waiting for 1.2.3.4:22',
+    'ERROR: Service Unavailable (HTTP 503)',
+    'Warning: failed to create container',
+]
+FILLER = ['ok: [aio1]', 'changed: [aio1]', '', 'x' * 300]
+# Classes that need their first hit, and classes that need their last hit,
+# searching for both splits the search, see LogScanner.search_split.
+FIRST = [SlaveOfflineFailure, PipFailure]
+LAST = [TempestFailure, DpkgLock, JenkinsException]
+
+
+class Build(object):
+    id = 'build'
+
+
+def match_text(match):
+    return match if isinstance(match, str) else match.group()
+
+
+class SearchBlocksTestCase(unittest.TestCase):
+    """Block searches find the same hits as searching line by line"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(Failure.failures.clear)
+        for name, value in (('BLOCK_SIZE', logblocks.BLOCK_SIZE),
+                            ('CHECKPOINT_INTERVAL',
+                             logblocks.CHECKPOINT_INTERVAL)):
+            self.addCleanup(setattr, logblocks, name, value)
+
+    def write_log(self, filename, lines, terminator='\n', newline=True,
+                  compress=False):
+        """Write a log file, optionally as two gzip members."""
+        data = terminator.join(lines)
+        if newline and lines:
+            data += terminator
+        data = data.encode('utf-8')
+        path = os.path.join(self.directory, filename)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if not compress:
+            with open(path, 'wb') as f:
+                f.write(data)
+            return
+        with open(path + '.gz', 'wb') as f:
+            cut = len(data) // 2
+            f.write(gzip.compress(data[:cut]))
+            f.write(gzip.compress(data[cut:]))
+
+    def hits(self, classes, reverse='lines'):
+        """Describe the hits of a search, with their task index context.
+
+        Searches line by line if reverse is 'lines', otherwise searches
+        blocks in the direction given by reverse.
+        """
+        scanner = Failure.scanner(classes)
+        self.assertIsNotNone(scanner.block_re)
+        source = LogSource(self.directory)
+        failures = {cls: cls(Build()) for cls, matchers in scanner.classes}
+        if reverse == 'lines':
+            hits = scanner.search(failures, source)
+            source.drain()
+        else:
+            hits = scanner.search_blocks(failures, source.log_blocks(),
+                                         source.task_index, reverse)
+        index = source.task_index
+        return {type(failure).__name__: [
+            (line_num, line, match_text(match),
+             index.previous_task(line_num), index.failure_ignored(line_num))
+            for line_num, line, match in failure_hits]
+            for failure, failure_hits in hits.items()}
+
+    def line_count(self):
+        source = LogSource(self.directory)
+        source.drain()
+        return source.line_count
+
+    def assert_same_hits(self, classes):
+        expected = self.hits(classes)
+        modes = set(cls.match_mode for cls, matchers
+                    in Failure.scanner(classes).classes)
+        if modes == set([MATCH_LAST]):
+            # the logs are read backwards, lines are numbered back from
+            # the end
+            total = self.line_count()
+            expected = {name: [(hit[0] - total,) + hit[1:] for hit in hits]
+                        for name, hits in expected.items()}
+            self.assertEqual(self.hits(classes, reverse=True), expected)
+        else:
+            self.assertEqual(self.hits(classes, reverse=False), expected)
+        self.assertEqual(self.hits(classes, reverse=None), expected)
+
+    def class_sets(self):
+        subclasses = Failure.__subclasses__()
+        return [
+            # includes a class that needs every hit
+            None,
+            [cls for cls in subclasses if cls.match_mode == MATCH_FIRST],
+            [cls for cls in subclasses if cls.match_mode == MATCH_LAST],
+            FIRST + LAST,
+        ]
+
+    def test_split_search(self):
+        """First hits near the start, last hits near the end"""
+        head = ['PLAY [setup] ***', 'TASK [pip|install] ***',
+                'Could not find a version that satisfies the requirement a',
+                '...ignoring', 'TASK [host|check] ***',
+                'Agent went offline during the build',
+                'TASK [next] ***']
+        tail = ['PLAY [tempest] ***', 'TASK [tempest|run] ***',
+                '{0} tempest.api.one [1.0s] ... FAILED',
+                'dpkg status database is locked by another process',
+                '{0} tempest.api.two [1.0s] ... FAILED',
+                'hudson.remoting.ChannelClosedException: gone',
+                'TASK [after] ***', 'ok: [aio1]']
+        self.write_log('log', head + ['ok: [aio1]'] * 200 + tail)
+        self.write_log('archive/artifacts/runcmd-bash.log',
+                       ['ok'] * 50 + tail, terminator='\r\n',
+                       compress=True)
+        original = LogScanner.search_direction
+        for block_size in (1, 7, 1 << 20):
+            logblocks.BLOCK_SIZE = block_size
+            logblocks.CHECKPOINT_INTERVAL = 16
+            with mock.patch.object(LogScanner, 'search_direction',
+                                   autospec=True,
+                                   side_effect=original) as search:
+                self.assert_same_hits(FIRST + LAST)
+            # the rest of the logs were read backwards
+            self.assertIn(True,
+                          [call[0][4] for call in search.call_args_list])
+
+    def test_random_logs(self):
+        """Plain and gzipped logs, with CRLF, CR and no trailing newline"""
+        rng = random.Random(1)
+        for iteration in range(40):
+            shutil.rmtree(self.directory)
+            os.makedirs(self.directory)
+            for filename in LogSource.log_files:
+                if rng.random() < 0.2:
+                    continue
+                lines = [rng.choice(LINES) if rng.random() < 0.3
+                         else rng.choice(FILLER)
+                         for i in range(rng.randint(0, 200))]
+                if lines and rng.random() < 0.2:
+                    lines.insert(rng.randrange(len(lines)), MARKER)
+                self.write_log(filename, lines,
+                               terminator=rng.choice(['\n', '\r\n', '\r']),
+                               newline=rng.random() < 0.7,
+                               compress=rng.random() < 0.4)
+            logblocks.BLOCK_SIZE = rng.choice([1, 3, 64, 1 << 20])
+            logblocks.CHECKPOINT_INTERVAL = rng.choice([1, 50, 1 << 18])
+            for classes in self.class_sets():
+                self.assert_same_hits(classes)
+
+    def test_empty_logs(self):
+        self.write_log('log', [])
+        self.write_log('archive/artifacts/deploy.sh.log', [], compress=True)
+        for classes in self.class_sets():
+            self.assert_same_hits(classes)
@@ -0,0 +1,54 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from click.testing import CliRunner
+
+import sketch
+
+
+def build(job_name, duration):
+    return dict(job_name=job_name, repo='rpc-openstack', branch='master',
+                stage='PM', duration=duration)
+
+
+class SketchReportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_sketches(self, name, builds):
+        sketches = sketch.BuildSketches()
+        for b in builds:
+            sketches.add(b)
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            json.dump(sketches.as_dict(), f)
+        return path
+
+    def test_report(self):
+        """sketch.py report FILE prints percentiles of each job"""
+        path = self.write_sketches('sketches.json', (
+            [build('PM_xenial', 600)] * 3 + [build('PM_bionic', 7200)]))
+        result = CliRunner().invoke(sketch.cli, ['report', path])
+        self.assertEqual(result.exit_code, 0, result.output)
+        lines = result.output.splitlines()
+        self.assertEqual(lines[0].split(),
+                         ['job_name', 'builds', 'p50', 'p90', 'p99'])
+        # percentiles are within 1% of the durations
+        self.assertEqual(lines[1].split(),
+                         ['PM_xenial', '3', '9.9m', '9.9m', '9.9m'])
+        self.assertEqual(lines[2].split(),
+                         ['PM_bionic', '1', '2.02h', '2.02h', '2.02h'])
+
+    def test_report_merges_files(self):
+        paths = [self.write_sketches('a.json', [build('PM_xenial', 60)]),
+                 self.write_sketches('b.json', [build('PM_xenial', 60)])]
+        result = CliRunner().invoke(sketch.cli,
+                                    ['report', '--by', 'all'] + paths)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(result.output.splitlines()[1].split(),
+                         ['all', '2', '59.7s', '59.7s', '59.7s'])
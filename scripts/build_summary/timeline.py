@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+# Stdlib import
+import datetime
+import json
+
+# 3rd Party imports
+import click
+
+# Project imports
+from instrument import escape_tag
+from query import read_data
+from sketch import dimension_value
+from store import to_epoch
+
+# Concurrency of builds over time, reconstructed from the start time and
+# duration of each stored build.
+#
+# Each build is a start and an end event. Events are sorted once by time
+# and swept in order, keeping a count of running builds overall and for
+# each group (eg each OS), so the whole timeline takes O(n log n) for n
+# builds. The sweep produces the times at which each count changed, which
+# are resampled into the peak count of each fixed interval for charts and
+# influxdb.
+#
+# Pipeline builds don't record the node label they ran on, the OS of a job
+# (see build.job_os) is the nearest grouping of the nodes builds need.
+
+DIMENSIONS = ['all', 'os', 'stage', 'repo']
+# Seconds in each point of the resampled series
+INTERVAL = 900
+MEASUREMENT = 'build_summary_concurrency'
+
+
+def sweep(builds, dimensions=DIMENSIONS):
+    """Count the builds running over time, for each group of builds.
+
+    Returns a dict of (dimension, group) to a list of (epoch time, number
+    of builds running from that time) tuples, in time order. Builds without
+    a duration are skipped.
+    """
+    events = []
+    for build in builds:
+        duration = build.get('duration')
+        if not duration or duration < 0:
+            continue
+        start = to_epoch(build['timestamp'])
+        keys = [(dimension, dimension_value(build, dimension))
+                for dimension in dimensions]
+        events.append((start, 1, keys))
+        events.append((start + duration, -1, keys))
+    # builds that end at the same time as others start aren't concurrent
+    events.sort(key=lambda event: (event[0], event[1]))
+    running = {}
+    steps = {}
+    for time, delta, keys in events:
+        for key in keys:
+            count = running.get(key, 0) + delta
+            running[key] = count
+            series = steps.setdefault(key, [])
+            if series and series[-1][0] == time:
+                series[-1] = (time, count)
+            else:
+                series.append((time, count))
+    return steps
+
+
+def resample(steps, start, interval, points):
+    """Get the peak count of each interval of a series of steps."""
+    values = []
+    pos = 0
+    current = 0
+    for point in range(points):
+        end = start + (point + 1) * interval
+        peak = current
+        while pos < len(steps) and steps[pos][0] < end:
+            current = steps[pos][1]
+            peak = max(peak, current)
+            pos += 1
+        values.append(peak)
+    return values
+
+
+def peak(steps):
+    """Get the highest count of a series, and when it was first reached."""
+    time, count = max(steps, key=lambda step: (step[1], -step[0]))
+    return dict(running=count, time=datetime.datetime.fromtimestamp(time))
+
+
+def timeline(builds, interval=INTERVAL, dimensions=DIMENSIONS):
+    """Build the chart ready concurrency series of some builds.
+
+    Returns a dict with the start time and interval of the series, and
+    the series and peak of each group of each dimension.
+    """
+    steps = sweep(builds, dimensions)
+    result = dict(interval=interval, start=None,
+                  series={dimension: {} for dimension in dimensions},
+                  peaks={dimension: {} for dimension in dimensions})
+    if not steps:
+        return result
+    first = min(series[0][0] for series in steps.values())
+    last = max(series[-1][0] for series in steps.values())
+    start = int(first // interval) * interval
+    points = int((last - start) // interval) + 1
+    result['start'] = datetime.datetime.fromtimestamp(start)
+    for (dimension, group), series in steps.items():
+        result['series'][dimension][str(group)] = resample(
+            series, start, interval, points)
+        result['peaks'][dimension][str(group)] = peak(series)
+    return result
+
+
+def line_protocol(result):
+    """Yield influxdb line protocol lines for a timeline."""
+    if result['start'] is None:
+        return
+    start = to_epoch(result['start'])
+    for dimension, groups in sorted(result['series'].items()):
+        for group, values in sorted(groups.items()):
+            for point, value in enumerate(values):
+                yield '{},dimension={},group={} running={}i {}'.format(
+                    MEASUREMENT, escape_tag(dimension), escape_tag(group),
+                    value,
+                    int(start + point * result['interval']) * 10 ** 9)
+
+
+@click.command(help='Report the peak concurrency of builds from a data'
+                    ' file')
+@click.argument('path')
+@click.option('--by', 'dimension', default='all',
+              type=click.Choice(DIMENSIONS), help='Field to group builds by')
+@click.option('--interval', default=INTERVAL,
+              help='Seconds in each point of the exported series')
+@click.option('--json', 'json_path', default=None,
+              help='Write the series to this json file')
+@click.option('--influx', 'influx_path', default=None,
+              help='Write the series to this influxdb line protocol file')
+def report(path, dimension, interval, json_path, influx_path):
+    result = timeline(read_data(path)['builds'].values(), interval)
+    for group, group_peak in sorted(
+            result['peaks'][dimension].items(),
+            key=lambda item: -item[1]['running']):
+        print("{}\t{}\t{}".format(group_peak['running'], group_peak['time'],
+                                  group))
+    if json_path is not None:
+        with open(json_path, 'w') as f:
+            json.dump(result, f, default=str)
+    if influx_path is not None:
+        with open(influx_path, 'w') as f:
+            for line in line_protocol(result):
+                f.write(line + '\n')
+
+
+if __name__ == '__main__':
+    report()
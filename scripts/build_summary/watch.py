@@ -0,0 +1,300 @@
+# Stdlib import
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+# Project imports
+from buildxml import read_build_xml
+from discovery import find_builds, path_groups
+
+# Watchers report builds in a jenkins jobs dir whose build.xml may have
+# been finalised, so they can be scanned as soon as they complete rather
+# than on the next walk of the whole jobs dir. Builds are reported as
+# path groups dicts (build_folder, job_name, build_num), the same as those
+# found by discovery.find_builds.
+#
+# Only <jobsdir>/<job>/builds/<build_num> is watched, for jobs whose name
+# matches job_re.
+
+# inotify event masks, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+# struct inotify_event, excluding the variable length name
+EVENT = struct.Struct('iIII')
+
+
+def is_finished(build_folder):
+    """Check if a build has completed, ie its build.xml has a result."""
+    try:
+        return read_build_xml(
+            os.path.join(build_folder, 'build.xml')).result is not None
+    except Exception:
+        # missing, or still being written
+        return False
+
+
+def list_dir(path):
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+
+class Inotify(object):
+    """Minimal wrapper for the linux inotify api using ctypes."""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self.libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        # close on exec, so the descriptor isn't held by scan workers
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            self.raise_error()
+
+    def raise_error(self, path=None):
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error), path)
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, path.encode('utf-8'),
+                                         mask)
+        if wd < 0:
+            self.raise_error(path)
+        return wd
+
+    def rm_watch(self, wd):
+        # fails if the watch has already been removed, which is fine
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """Wait for events, returns a list of (wd, mask, name) tuples.
+
+        An empty list is returned if there are no events within timeout
+        seconds.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        data = os.read(self.fd, 65536)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, name.decode('utf-8', 'replace')))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class InotifyWatcher(object):
+    """Watch a jobs dir using inotify.
+
+    The jobs dir, each job dir and each builds dir are watched for new
+    jobs and builds. The dir of each build that hasn't been scanned is
+    watched for build.xml being written, jenkins writes it to a temporary
+    file then renames it into place. Watches on builds are removed once
+    they have been scanned, so the number of watches depends on the number
+    of jobs and running builds rather than the size of the jobs dir.
+    """
+
+    dir_events = IN_CREATE | IN_MOVED_TO | IN_ONLYDIR
+    build_events = IN_CLOSE_WRITE | IN_MOVED_TO | IN_ONLYDIR
+
+    def __init__(self, jobsdir, job_re, known):
+        self.jobsdir = jobsdir
+        self.job_re = job_re
+        self.known = known
+        self.inotify = Inotify()
+        # wd to (job_name, build_num) of the watched dir. Both are None
+        # for the jobs dir, build_num is None for job dirs and 'builds' for
+        # builds dirs.
+        self.watches = {}
+        # (job_name, build_num) to wd of watched build dirs
+        self.build_watches = {}
+        self.candidates = {}
+        try:
+            self.watch_jobs()
+        except OSError:
+            self.close()
+            raise
+
+    def add_watch(self, path, mask, job_name=None, build_num=None):
+        wd = self.inotify.add_watch(path, mask)
+        self.watches[wd] = (job_name, build_num)
+        return wd
+
+    def watch_jobs(self):
+        self.add_watch(self.jobsdir, self.dir_events)
+        for job_name in list_dir(self.jobsdir):
+            self.watch_job(job_name)
+
+    def watch_job(self, job_name):
+        if not self.job_re.match(job_name):
+            return
+        job_dir = os.path.join(self.jobsdir, job_name)
+        if not os.path.isdir(job_dir):
+            return
+        self.add_watch(job_dir, self.dir_events, job_name)
+        builds_dir = os.path.join(job_dir, 'builds')
+        if os.path.isdir(builds_dir):
+            self.watch_builds(job_name)
+
+    def watch_builds(self, job_name):
+        builds_dir = os.path.join(self.jobsdir, job_name, 'builds')
+        self.add_watch(builds_dir, self.dir_events, job_name, 'builds')
+        for build_num in list_dir(builds_dir):
+            self.watch_build(job_name, build_num)
+
+    def watch_build(self, job_name, build_num):
+        key = (job_name, build_num)
+        if (not build_num.isdigit() or key in self.known
+                or key in self.build_watches):
+            return
+        build_folder = os.path.join(self.jobsdir, job_name, 'builds',
+                                    build_num)
+        if not os.path.isdir(build_folder):
+            return
+        self.build_watches[key] = self.add_watch(
+            build_folder, self.build_events, job_name, build_num)
+        # build.xml may have been written before the watch was added
+        self.candidates[key] = path_groups(self.jobsdir, job_name,
+                                           build_num)
+
+    def resync(self):
+        """Drop all watches and start again, after events have been lost."""
+        for wd in list(self.watches):
+            self.inotify.rm_watch(wd)
+        self.watches = {}
+        self.build_watches = {}
+        self.watch_jobs()
+
+    def poll(self, timeout=None):
+        """Wait for builds that may have finished.
+
+        Returns a list of path groups, which is empty if nothing happened
+        within timeout seconds.
+        """
+        if not self.candidates:
+            for wd, mask, name in self.inotify.read(timeout):
+                if mask & IN_Q_OVERFLOW:
+                    self.resync()
+                    break
+                if mask & IN_IGNORED:
+                    # watched dir was removed
+                    job_build = self.watches.pop(wd, None)
+                    self.build_watches.pop(job_build, None)
+                    continue
+                if wd not in self.watches:
+                    continue
+                job_name, build_num = self.watches[wd]
+                if job_name is None:
+                    self.watch_job(name)
+                elif build_num is None:
+                    if name == 'builds':
+                        self.watch_builds(job_name)
+                elif build_num == 'builds':
+                    self.watch_build(job_name, name)
+                elif name == 'build.xml':
+                    self.candidates[(job_name, build_num)] = path_groups(
+                        self.jobsdir, job_name, build_num)
+        candidates = list(self.candidates.values())
+        self.candidates = {}
+        return candidates
+
+    def done(self, key):
+        """Stop watching a build once it has been scanned."""
+        self.known.add(key)
+        wd = self.build_watches.pop(key, None)
+        if wd is not None:
+            self.watches.pop(wd, None)
+            self.inotify.rm_watch(wd)
+
+    def close(self):
+        self.inotify.close()
+
+
+class PollingWatcher(object):
+    """Watch a jobs dir by listing the builds dir of each job periodically.
+
+    Used where inotify isn't available. Only the builds dirs are listed,
+    and only build.xml of builds that haven't been scanned is checked.
+    """
+
+    def __init__(self, jobsdir, job_re, known, interval=30):
+        self.jobsdir = jobsdir
+        self.job_re = job_re
+        self.known = known
+        self.interval = interval
+        # mtime of build.xml of unscanned builds when last reported
+        self.mtimes = {}
+        self.next_poll = 0
+
+    def poll(self, timeout=None):
+        """Wait for builds that may have finished.
+
+        Returns a list of path groups, which is empty if nothing happened
+        within timeout seconds.
+        """
+        wait = self.next_poll - time.time()
+        if timeout is not None and wait > timeout:
+            time.sleep(timeout)
+            return []
+        if wait > 0:
+            time.sleep(wait)
+        self.next_poll = time.time() + self.interval
+        candidates = []
+        for build in find_builds(self.jobsdir, self.job_re, self.known):
+            key = (build['job_name'], build['build_num'])
+            try:
+                mtime = os.stat(os.path.join(build['build_folder'],
+                                             'build.xml')).st_mtime
+            except OSError:
+                continue
+            if self.mtimes.get(key) != mtime:
+                self.mtimes[key] = mtime
+                candidates.append(build)
+        return candidates
+
+    def done(self, key):
+        self.known.add(key)
+        self.mtimes.pop(key, None)
+
+    def close(self):
+        pass
+
+
+def make_watcher(jobsdir, job_re, known, interval=30, polling=False):
+    """Get an inotify watcher, or a polling watcher if that isn't possible.
+
+    known is a set of (job_name, build_num) tuples of builds that have
+    already been scanned.
+    """
+    if not polling:
+        try:
+            return InotifyWatcher(jobsdir, job_re, known)
+        except OSError as e:
+            # eg not linux, or the limit on the number of watches has been
+            # reached (fs.inotify.max_user_watches)
+            print("inotify unavailable, polling instead: {}".format(e))
+    return PollingWatcher(jobsdir, job_re, known, interval)
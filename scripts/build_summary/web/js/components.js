@@ -31,7 +31,14 @@ trendGraph = Vue.component("trendGraph",{
   methods: {
     draw: function(){
       var ctx = this.$el.querySelector(".chart").getContext('2d')
-      var chart = new Chart(ctx, this.chart)
+      this.chartObj = new Chart(ctx, this.chart)
+    }
+  },
+  watch: {
+    // redraw when the data changes, eg when the selected range changes
+    chart: function(){
+      this.chartObj.destroy()
+      this.draw()
     }
   },
   mounted: function(){ this.draw() },
@@ -64,7 +71,7 @@ trendGraph = Vue.component("trendGraph",{
 //             backgroundColor: colours[i],
 //             data: this.$root.histogram(
 //               c[2].map(f => f.build),
-//               this.$root.retention_days,
+//               this.$root.range_days,
 //               1
 //             )
 //           }); return a
@@ -82,7 +89,14 @@ trendGraph = Vue.component("trendGraph",{
 
 failureTypesTrend = Vue.component("failureTypesTrend",{
   props: {
-    "builds":{},
+    "filter": {
+      // filter for rollup rows
+      default: function(){
+        return function(row){
+          return true
+        }
+      }
+    },
     "title": {},
     "topN": {default: 5},
     "dsFilter": {
@@ -111,9 +125,9 @@ failureTypesTrend = Vue.component("failureTypesTrend",{
       }
     },
     topFailureTypes: function(){
-      return this.$root.failuresByType(this.builds)
+      return this.$root.rollupCountBy(
+        this.$root.rangeRollups.failures.filter(this.filter), "type")
         .slice(0,this.topN)
-        .map(l => [l[0], l[1], l[2].map(f => f.build)])
       },
     datasets: function(){
       var colours = this.$root.colours(this.topFailureTypes.length + 1)
@@ -123,11 +137,7 @@ failureTypesTrend = Vue.component("failureTypesTrend",{
           // ensure success is always green
           //backgroundColor: c[1] == "Success" ? colours[0] : colours[(i+1)%(colours.length-1)],
           backgroundColor: colours[i],
-          data: this.$root.histogram(
-            c[2],
-            this.$root.retention_days,
-            1
-          )
+          data: this.$root.rollupHistogram(c[2], this.$root.range_days)
         }); return a
       },[])
       var filtered = ds.filter(this.dsFilter)
@@ -138,7 +148,14 @@ failureTypesTrend = Vue.component("failureTypesTrend",{
 })
 failureCategoriesTrend = Vue.component("failureCategoriesTrend",{
   props: {
-    "builds": {},
+    "filter": {
+      // filter for rollup rows
+      default: function(){
+        return function(row){
+          return true
+        }
+      }
+    },
     "title": {},
     "dsFilter": {
       default: function(){
@@ -165,7 +182,8 @@ failureCategoriesTrend = Vue.component("failureCategoriesTrend",{
       }
     },
     datasets: function(){
-      var failuresByCategory = this.$root.failuresByCategory(this.builds)
+      var failuresByCategory = this.$root.rollupCountBy(
+        this.$root.rangeRollups.failures.filter(this.filter), "category")
       var colours = this.$root.colours(failuresByCategory.length + 1)
       var ds = failuresByCategory.reduce((a, c, i) => {
         a.push({
@@ -173,11 +191,7 @@ failureCategoriesTrend = Vue.component("failureCategoriesTrend",{
           // ensure success is always green
           //backgroundColor: c == "Success" ? colours[0] : colours[(i+1)%(colours.length-1)],
           backgroundColor: colours[i],
-          data: this.$root.histogram(
-            c[2].map(f => f.build),
-            this.$root.retention_days,
-            1
-          )
+          data: this.$root.rollupHistogram(c[2], this.$root.range_days)
         }); return a
       },[])
       return ds.filter(this.dsFilter)
@@ -199,31 +213,36 @@ repoTable = Vue.component("repoTable",{
       descending: true
     }
     d.rowsperpage = [5, 15, 25, 50, 100, {text:"All",value:-1}]
-    d.items = []
-    Object.values(this.$root.repos).forEach(r => {
-      var builds = r[2]
-      var ro = {name: r[1],
-                numBuilds: builds.length,
-                mostFailingJob: ' ',
-                mostFailingBranch: ' ',
-                topFailureType: ' ',
-                failPercent: 0}
-      var buildFailures = builds.filter(b => b.result != "SUCCESS")
-      var failCount = buildFailures.length
-      ro.failPercent = ((failCount / ro.numBuilds) * 100).toFixed(0)
-      mostFailingJob = buildFailures.countBy("job_name")[0]
-      ro.mostFailingJob = mostFailingJob[1]
-      ro.mostFailingJobCount = mostFailingJob[0]
-      mostFailingBranch = buildFailures.countBy("branch")[0]
-      ro.mostFailingBranch = mostFailingBranch[1]
-      ro.mostFailingBranchCount = mostFailingBranch[0]
-      topFailureType = this.$root.failuresByType(builds)[0]
-      ro.topFailureType = topFailureType[1]
-      ro.topFailureTypeCount = topFailureType[0]
-      d.items.push(ro)
-    })
     return d
   },
+  computed: {
+    items: function(){
+      var rollups = this.$root.rangeRollups
+      var failuresByRepo = rollups.failures.groupBy("repo")
+      return this.$root.rollupCountBy(rollups.builds, "repo").map(r => {
+        var ro = {name: r[1],
+                  numBuilds: r[0],
+                  mostFailingJob: ' ',
+                  mostFailingBranch: ' ',
+                  topFailureType: ' ',
+                  failPercent: 0}
+        var buildFailures = r[2].filter(b => b.result != "SUCCESS")
+        var failCount = buildFailures.reduce((a, b) => a + b.count, 0)
+        ro.failPercent = ((failCount / ro.numBuilds) * 100).toFixed(0)
+        mostFailingJob = this.$root.rollupCountBy(buildFailures, "job_name")[0]
+        ro.mostFailingJob = mostFailingJob[1]
+        ro.mostFailingJobCount = mostFailingJob[0]
+        mostFailingBranch = this.$root.rollupCountBy(buildFailures, "branch")[0]
+        ro.mostFailingBranch = mostFailingBranch[1]
+        ro.mostFailingBranchCount = mostFailingBranch[0]
+        topFailureType = this.$root.rollupCountBy(
+          failuresByRepo[r[1]] || [], "type")[0]
+        ro.topFailureType = topFailureType[1]
+        ro.topFailureTypeCount = topFailureType[0]
+        return ro
+      })
+    }
+  },
   template: `
     <div>
       <v-card>
@@ -262,19 +281,32 @@ repoTable = Vue.component("repoTable",{
   `
 })
 resultTrendGraph = Vue.component("resultTrendGraph", {
-  props: ["builds", "title"],
+  props: {
+    "filter": {
+      // filter for rollup rows
+      default: function(){
+        return function(row){
+          return true
+        }
+      }
+    },
+    "title": {}
+  },
   computed: {
+    rows: function(){
+      return this.$root.rangeRollups.builds.filter(this.filter)
+    },
     success: function(){
-      return this.$root.histogram(
-        this.builds.filter(b => b.result == "SUCCESS"), this.$root.retention_days, 1)
+      return this.$root.rollupHistogram(
+        this.rows.filter(b => b.result == "SUCCESS"), this.$root.range_days)
     },
     failurepr: function(){
-      return this.$root.histogram(
-        this.builds.filter(b => b.result != "SUCCESS" && b.stage == "PR"), this.$root.retention_days, 1)
+      return this.$root.rollupHistogram(
+        this.rows.filter(b => b.result != "SUCCESS" && b.stage == "PR"), this.$root.range_days)
     },
     failurepm: function(){
-      return this.$root.histogram(
-        this.builds.filter(b => b.result != "SUCCESS" && b.stage == "PM"), this.$root.retention_days, 1)
+      return this.$root.rollupHistogram(
+        this.rows.filter(b => b.result != "SUCCESS" && b.stage == "PM"), this.$root.range_days)
     },
     chart: function(){
       return {
@@ -312,7 +344,16 @@ resultTrendGraph = Vue.component("resultTrendGraph", {
 })
 
 trendGraphs = Vue.component("trendGraphs",{
-  props: ["builds"],
+  props: {
+    "filter": {
+      // filter for rollup rows
+      default: function(){
+        return function(row){
+          return true
+        }
+      }
+    }
+  },
   template: `
     <v-tabs>
       <v-tab>Builds by Result</v-tab>
@@ -321,17 +362,17 @@ trendGraphs = Vue.component("trendGraphs",{
       <v-tab-item>
         <resultTrendGraph
           title=""
-          :builds="this.builds"></resultTrendGraph>
+          :filter="this.filter"></resultTrendGraph>
       </v-tab-item>
       <v-tab-item>
         <failureCategoriesTrend
           title=""
-          :builds="this.builds"></failureCategoriesTrend>
+          :filter="this.filter"></failureCategoriesTrend>
       </v-tab-item>
       <v-tab-item>
         <failureTypesTrend
           title=""
-          :builds="this.builds">
+          :filter="this.filter">
         </failureTypesTrend>
       </v-tab-item>
 
@@ -867,6 +908,188 @@ failureTable = Vue.component("failureTable",{
   `
 })
 
+// Failures grouped by signature, ie with identifiers such as uuids and
+// addresses removed from the detail. Counts are across all retained builds.
+// Signatures with similar details are in the same cluster, clicking the
+// number of similar failures shows the other signatures in the cluster.
+recurringFailureTable = Vue.component("recurringFailureTable",{
+  props: {
+    'title':{},
+    'numTopJobs': {
+      default: 3
+    }
+  },
+  computed: {
+    items: function(){
+      return this.$root.recurring.map(r => {
+        // jobs are only known once builds have been loaded
+        var builds = r.builds
+          .map(id => this.$root.builds_raw[id])
+          .filter(b => b)
+        return Object.assign({}, r, {
+          topJobs: builds.length ? builds.countBy("job_name").slice(0, this.numTopJobs) : []
+        })
+      })
+    }
+  },
+  data: function(){
+      return {
+        headers: [
+          {text: "Type", value: "type"},
+          {text: "Failure", value: "detail"},
+          {text: "Builds", value: "count"},
+          {text: "Similar", value: "resembles"},
+          {text: "Oldest Occurence", value: "first_seen"},
+          {text: "Newest Occurence", value: "last_seen"},
+          {text: "Top Jobs", value: "topJobs", sortable: false},
+        ],
+        search: '',
+        rowsperpage: [5, 10, 25, 50, {text: "All", value: -1}],
+        pagination: {
+          sortBy: 'count',
+          descending: true
+        },
+      }
+  },
+  template: `
+    <v-card>
+      <v-card-title primary-title>
+        <h3>{{title}}</h3>
+        <v-spacer></v-spacer>
+        <v-text-field
+          v-model="search"
+          append-icon="search"
+          label="Search"
+          single-line
+          hide-details></v-text-field>
+      </v-card-title>
+      <v-card-text>
+        <v-data-table
+          :headers="headers"
+          :items="items"
+          :rows-per-page-items="rowsperpage"
+          :search="search"
+          :pagination.sync="pagination">
+          <template slot="items" slot-scope="props">
+              <td>
+                <v-tooltip bottom>
+                  <router-link slot="activator" :to="'/ftype/'+props.item.type">{{props.item.type}}</router-link>
+                  <span>Category: {{props.item.category}}</span>
+                </v-tooltip>
+              </td>
+              <td>
+                {{props.item.detail}}
+              </td>
+              <td>
+                {{props.item.count}}
+              </td>
+              <td>
+                <a v-if="props.item.resembles" @click="search = props.item.cluster">
+                  resembles {{props.item.resembles}} others
+                </a>
+              </td>
+              <td>
+                <dateCell :date="props.item.first_seen"></dateCell>
+              </td>
+              <td>
+                <dateCell :date="props.item.last_seen"></dateCell>
+              </td>
+              <td>
+                <ul>
+                  <li v-for="job in props.item.topJobs" :key="job[1]">
+                    <router-link :to="'/job/'+job[1]">{{job[1]}}</router-link> ({{job[0]}})
+                  </li>
+                </ul>
+              </td>
+          </template>
+        </v-data-table>
+      </v-card-text>
+    </v-card>
+  `
+})
+
+// Junit tests that failed in retained builds, per job. Flaky tests failed in
+// several separate runs of builds, still failing tests failed in the newest
+// build of their job. Failing since is the first build of the current run
+// of failures, as recorded by jenkins.
+testTable = Vue.component("testTable",{
+  props: {
+    'title':{},
+    // flaky or failing
+    'report':{}
+  },
+  computed: {
+    items: function(){
+      return this.$root.tests[this.report]
+    }
+  },
+  data: function(){
+      return {
+        headers: [
+          {text: "Test", value: "test"},
+          {text: "Job", value: "job_name"},
+          {text: "Failed Builds", value: "count"},
+          {text: "Runs Of Failures", value: "streaks"},
+          {text: "Failing Since", value: "failing_since"},
+          {text: "Oldest Failure", value: "first_failed"},
+          {text: "Newest Failure", value: "last_failed"},
+        ],
+        search: '',
+        rowsperpage: [5, 10, 25, 50, {text: "All", value: -1}],
+        pagination: {
+          sortBy: this.report == 'flaky' ? 'streaks' : 'failing_since',
+          descending: this.report == 'flaky'
+        },
+      }
+  },
+  template: `
+    <v-card>
+      <v-card-title primary-title>
+        <h3>{{title}}</h3>
+        <v-spacer></v-spacer>
+        <v-text-field
+          v-model="search"
+          append-icon="search"
+          label="Search"
+          single-line
+          hide-details></v-text-field>
+      </v-card-title>
+      <v-card-text>
+        <v-data-table
+          :headers="headers"
+          :items="items"
+          :rows-per-page-items="rowsperpage"
+          :search="search"
+          :pagination.sync="pagination">
+          <template slot="items" slot-scope="props">
+              <td>
+                {{props.item.test}}
+              </td>
+              <td>
+                <router-link :to="'/job/'+props.item.job_name">{{props.item.job_name}}</router-link>
+              </td>
+              <td>
+                {{props.item.count}}
+              </td>
+              <td>
+                {{props.item.streaks}}
+              </td>
+              <td>
+                {{props.item.failing_since}}
+              </td>
+              <td>
+                <dateCell :date="props.item.first_failed"></dateCell>
+              </td>
+              <td>
+                <dateCell :date="props.item.last_failed"></dateCell>
+              </td>
+          </template>
+        </v-data-table>
+      </v-card-text>
+    </v-card>
+  `
+})
+
 dateCell = Vue.component("dateCell",{
   props: ["date"],
   computed: {
@@ -2,13 +2,21 @@ homeView = Vue.component("homeView",{
   template: `
     <div>
       <titleCard title="All Builds"></titlecard>
-      <trendGraphs
-        :builds="Object.values(this.$root.builds)"
-      ></trendGraphs>
-      <failureTables :builds="Object.values(this.$root.builds)">
+      <trendGraphs></trendGraphs>
+      <failureTables v-if="$root.dataloaded"
+        :builds="Object.values(this.$root.builds)">
       </failureTables>
+      <recurringFailureTable v-if="$root.recurringloaded"
+        title="Top Recurring Failures">
+      </recurringFailureTable>
+      <testTable v-if="$root.testsloaded" report="flaky"
+        title="Flaky Tests">
+      </testTable>
+      <testTable v-if="$root.testsloaded" report="failing"
+        title="Tests Still Failing">
+      </testTable>
       <repoTable></repoTable>
-      <buildTable
+      <buildTable v-if="$root.dataloaded"
         :buildsOrFilter="Object.values(this.$root.builds)"
         title="Recent Builds From All Jobs">
       </buildTable>
@@ -23,6 +31,11 @@ repoDetailView = Vue.component("repoview", {
       return this.$root.repos.filter(l => l[1]==this.repoName)[0][2]
     }
   },
+  methods: {
+    filter: function(row){
+      return row.repo == this.repoName
+    }
+  },
   template: `
     <div>
       <titleCard
@@ -31,10 +44,11 @@ repoDetailView = Vue.component("repoview", {
         <a :href="this.$root.ghBase+repoName">View this repository on Github</a><v-icon>launch</v-icon>
       </titleCard>
       <trendGraphs
-        :builds="this.builds"
+        :filter="this.filter"
       ></trendGraphs>
       <!-- failure types pie -->
       <!-- failure categories pie -->
+      <div v-if="$root.dataloaded">
       <jobTable
         :builds="this.builds"
         title="Jobs"></jobTable>
@@ -45,6 +59,7 @@ repoDetailView = Vue.component("repoview", {
         title="Build Results"
         :buildsOrFilter="this.builds"
       ></buildTable>
+      </div>
     </div>
   `
 })
@@ -56,6 +71,11 @@ jobView = Vue.component("jobView", {
       return Object.values(this.$root.builds).filter(b => b.job_name == this.jobName)
     }
   },
+  methods: {
+    filter: function(row){
+      return row.job_name == this.jobName
+    }
+  },
   template: `
     <div>
       <titleCard
@@ -64,8 +84,9 @@ jobView = Vue.component("jobView", {
       <a :href="this.$root.jenkinsBase+jobName">View job in in Jenkins</a><v-icon>launch</v-icon>
       </titleCard>
       <trendGraphs
-        :builds="this.builds"
+        :filter="this.filter"
       ></trendGraphs>
+      <div v-if="$root.dataloaded">
       <failureTables
         :builds="this.builds"
         :showTopJobs="false">
@@ -74,6 +95,7 @@ jobView = Vue.component("jobView", {
         title="Build Results"
         :buildsOrFilter="this.builds"
       ></buildTable>
+      </div>
     </div>
   `
 })
@@ -99,13 +121,17 @@ failureTypeView = Vue.component("failureTypeView",{
         return this.failures.map(f => f.build)
       },
       category: function(){
-        return this.failures[0].category
+        var row = this.$root.rollups.failures.find(r => r.type == this.type)
+        return row ? row.category : ""
       }
   },
   methods: {
     dsFilter: function(ds){
       var type = this.type
       return ds.label == type
+    },
+    filter: function(row){
+      return row.type == this.type
     }
   },
   template: `
@@ -117,9 +143,10 @@ failureTypeView = Vue.component("failureTypeView",{
       </titleCard>
       <failureTypesTrend
         title=""
-        :builds="this.builds"
+        :filter="this.filter"
         :dsFilter="this.dsFilter">
       </failureTypesTrend>
+      <div v-if="$root.dataloaded">
       <jobTable
         title="Jobs"
         :builds="this.builds"
@@ -131,6 +158,7 @@ failureTypeView = Vue.component("failureTypeView",{
         :buildsOrFilter="this.builds"
         title="Builds"
       ></buildTable>
+      </div>
     </div>
   `
 })
@@ -164,6 +192,9 @@ failureCategoryView = Vue.component("failureCategoryView",{
     typeFilter: function(failure){
       var category = this.category
       return failure.category == category
+    },
+    filter: function(row){
+      return row.category == this.category
     }
   },
   template: `
@@ -174,9 +205,10 @@ failureCategoryView = Vue.component("failureCategoryView",{
       </titleCard>
       <failureCategoriesTrend
         title=""
-        :builds="this.builds"
+        :filter="this.filter"
         :dsFilter="this.dsFilter">
       </failureCategoriesTrend>
+      <div v-if="$root.dataloaded">
       <jobTable
         title="Jobs"
         :builds="this.builds"
@@ -189,6 +221,7 @@ failureCategoryView = Vue.component("failureCategoryView",{
         :buildsOrFilter="this.builds"
         title="Builds"
       ></buildTable>
+      </div>
     </div>
   `
 })